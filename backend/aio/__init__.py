@@ -0,0 +1,20 @@
+"""
+Асинхронные (asyncio + asyncpg) версии горячих обработчиков мессенджера Друг:
+страница и отправка сообщений, список чатов, проверка сессии.
+
+Ответы — те же, что у функций backend/messages и backend/chats: разбор параметров,
+тексты SQL и сборка JSON берутся из их index.py, своё здесь только ожидание БД.
+Остальные маршруты этих функций и все прочие функции обслуживаются синхронными
+handler'ами в пуле потоков (см. aio/server.py).
+
+Запуск: cd backend && DATABASE_URL=postgres://... python -m aio.server
+"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# server.py — из backend/, общие модули (core, db, sessions, presence) — из любой функции,
+# копии одинаковые (это проверяет server.check_shared_modules)
+for path in (BACKEND_DIR, os.path.join(BACKEND_DIR, "messages")):
+    if path not in sys.path:
+        sys.path.append(path)
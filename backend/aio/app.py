@@ -0,0 +1,104 @@
+"""
+Асинхронная обёртка над core.App синхронной функции: маршруты, CORS и порядок
+сопоставления — её собственные, асинхронно выполняются только заменённые маршруты,
+остальные уходят в fallback (синхронный handler в пуле потоков).
+"""
+import functools
+
+import core
+import db
+import sessions
+
+from . import pool
+
+
+class AsyncApp:
+    def __init__(self, sync_app: core.App, fallback):
+        self.sync_app = sync_app
+        self.cors = sync_app.cors
+        self.fallback = fallback  # async (event, context) -> resp
+        self.overrides = {}
+
+    def replace(self, sync_fn):
+        """Регистрирует асинхронную версию маршрута, который в sync_app обслуживает sync_fn."""
+        def register(fn):
+            self.overrides[sync_fn] = fn
+            return fn
+        return register
+
+    def match(self, req: core.Request):
+        # Первый подходящий маршрут синхронного приложения — как в core.App.dispatch
+        for method, fragment, fn in self.sync_app.routes:
+            if method == req.method and (fragment is None or fragment in req.path):
+                return self.overrides.get(fn)
+        return None
+
+    async def __call__(self, event: dict, context) -> dict:
+        if event.get("httpMethod") == "OPTIONS":
+            return {"statusCode": 200, "headers": dict(self.cors), "body": ""}
+        req = core.Request(event, context)
+        fn = self.match(req)
+        if fn is None:
+            return await self.fallback(event, context)
+        try:
+            resp = await fn(req)
+        except core.HttpError as e:
+            resp = core.error(e.status, e.error, e.message)
+        resp["headers"] = {**self.cors, **(resp.get("headers") or {})}
+        return core.compress(resp, req)
+
+
+async def get_user_by_session(conn, token):
+    """Как sessions.get_user_by_session: общий с синхронными функциями кэш процесса, промах — в БД."""
+    if not token:
+        return None
+    user = sessions.cached_user(token)
+    if user is None:
+        row = await pool.fetchrow(conn, sessions.SESSION_SQL, token)
+        if row:
+            user = sessions.remember_session(token, row)
+    return user
+
+
+async def pin_writes(resp: dict, token, conn) -> dict:
+    """
+    Как sessions.pin_writes после записи через asyncpg: пин сессии в общем с синхронными
+    маршрутами db (их чтения с реплик его видят) и LSN записи клиенту в X-Write-LSN.
+    """
+    if not db.REPLICA_URLS:
+        return resp
+    lsn = await conn.fetchval("SELECT pg_current_wal_lsn()::text")
+    db.pin(token, db.parse_lsn(lsn))
+    resp["headers"] = {**(resp.get("headers") or {}), "X-Write-LSN": lsn}
+    return resp
+
+
+def authenticated(fn=None, *, missing_error="unauthorized", invalid_error="unauthorized", read_only=False):
+    """
+    Асинхронный sessions.authenticated: соединение из пула asyncpg, затем fn(req, conn, user).
+    read_only=True — соединение с реплики (pool.read_connection) с учётом пина сессии и X-Min-LSN;
+    после остальных маршрутов, кроме GET, сессия закрепляется за primary (pin_writes).
+    """
+    def decorate(fn):
+        async def run(req, conn, user):
+            if not user:
+                return core.error(401, invalid_error)
+            resp = await fn(req, conn, user)
+            if not read_only and req.method != "GET":
+                resp = await pin_writes(resp, req.session_token, conn)
+            return resp
+
+        @functools.wraps(fn)
+        async def wrapper(req):
+            if not req.session_token:
+                return core.error(401, missing_error)
+            if read_only:
+                async with pool.read_connection(req.session_token, req.headers.get("x-min-lsn")) as conn:
+                    user = await get_user_by_session(conn, req.session_token)
+                    if user or not pool.is_replica(conn):
+                        return await run(req, conn, user)
+                # Только что созданная сессия могла ещё не дойти до реплики — проверяем на primary
+            async with pool.connection() as conn:
+                return await run(req, conn, await get_user_by_session(conn, req.session_token))
+        return wrapper
+    return decorate(fn) if fn else decorate
@@ -0,0 +1,25 @@
+"""
+Асинхронный GET / (список чатов) функции backend/chats.
+/contacts и создание личного чата остаются синхронными.
+"""
+import core
+
+from . import pool
+from .app import AsyncApp, authenticated
+
+
+def make_app(chats, fallback) -> AsyncApp:
+    """chats — загруженный модуль backend/chats/index.py."""
+    app = AsyncApp(chats.app, fallback)
+
+    @app.replace(chats.list_chats)
+    @authenticated(read_only=True)
+    async def list_chats(req, conn, user):
+        limit = req.limit_param(chats.DEFAULT_PAGE, chats.MAX_PAGE)
+        before = chats.parse_cursor(req.query.get("cursor"))
+
+        sql, args = chats.chat_list_query(user["id"], before, limit)
+        rows = await pool.fetch(conn, sql, *args)
+        return core.json_response(200, chats.chat_list_response(rows, limit))
+
+    return app
@@ -0,0 +1,52 @@
+"""
+Асинхронные GET / (страница сообщений) и POST / (отправка) функции backend/messages.
+/sync, /search и /read остаются синхронными.
+"""
+import core
+
+from . import pool
+from .app import AsyncApp, authenticated
+
+
+def make_app(messages, fallback) -> AsyncApp:
+    """messages — загруженный модуль backend/messages/index.py."""
+    app = AsyncApp(messages.app, fallback)
+
+    @app.replace(messages.list_messages)
+    @authenticated(read_only=True)
+    async def list_messages(req, conn, user):
+        user_id = user["id"]
+        if not req.query.get("chat_id"):
+            return core.error(400, "chat_id required")
+        chat_id = req.int_param("chat_id", error="invalid_chat_id")
+        limit = req.limit_param(messages.DEFAULT_PAGE, messages.MAX_PAGE)
+        before_id = req.int_param("before_id")
+        after_id = req.int_param("after_id")
+
+        if not await pool.fetchrow(conn, messages.MEMBER_SQL, chat_id, user_id):
+            raise core.HttpError(403, "forbidden")
+
+        sql, args = messages.page_query(chat_id, before_id, after_id, limit)
+        rows = await pool.fetch(conn, sql, *args)
+        return core.json_response(200, messages.page_response(rows, user_id, before_id, after_id, limit))
+
+    @app.replace(messages.post_messages)
+    @authenticated
+    async def post_messages(req, conn, user):
+        user_id = user["id"]
+        body = req.json()
+        batch = "messages" in body
+        items = messages.parse_send_items(body)
+
+        chat_ids = sorted({item["chat_id"] for item in items})
+        async with conn.transaction():
+            if len(await pool.fetch(conn, messages.MEMBER_OF_SQL, user_id, chat_ids)) != len(chat_ids):
+                return core.error(403, "forbidden")
+            rows = await pool.run_plan(conn, messages.send_messages_plan(user_id, items))
+
+        sent = [messages.sent_message(item, row, user) for item, row in zip(items, rows)]
+        if batch:
+            return core.json_response(200, {"messages": sent})
+        return core.json_response(200, {"message": sent[0]})
+
+    return app
@@ -0,0 +1,250 @@
+"""
+Пул соединений asyncpg для асинхронных обработчиков.
+Соединения не привязаны к потокам: тысячи клиентов ждут БД в одном event loop,
+а одновременно занято не больше AIO_POOL_MAX соединений.
+
+Подготовленные запросы: asyncpg готовит каждый текст запроса один раз на соединение
+и держит его в кэше соединения (AIO_STATEMENT_CACHE), повторный вызов идёт без разбора
+и планирования заново. Тексты SQL общие с синхронными функциями, %s переводятся в $n.
+
+Настройки (переменные окружения):
+AIO_POOL_MIN          — сколько соединений открыть сразу (по умолчанию 2)
+AIO_POOL_MAX          — максимум соединений на процесс (20)
+AIO_POOL_WAIT         — сколько секунд ждать свободного соединения (5)
+AIO_POOL_IDLE_TIMEOUT — через сколько секунд простоя закрывать соединение (300)
+AIO_STATEMENT_CACHE   — подготовленных запросов на соединение (256); 0 — за pgbouncer в режиме transaction
+PGOPTIONS             — «-c имя=значение» (например search_path) передаются серверу, как у libpq
+
+Реплики — те же DATABASE_REPLICA_URLS и DB_REPLICA_*, что у db.py: read_connection отдаёт
+соединение реплики, если она воспроизвела WAL до записи сессии (пин процесса в db или X-Min-LSN),
+иначе — primary. Пины общие с синхронными маршрутами.
+"""
+import asyncio
+import contextlib
+import functools
+import os
+import re
+import shlex
+import time
+
+import asyncpg
+
+import db
+
+POOL_MIN = int(os.environ.get("AIO_POOL_MIN", "2"))
+POOL_MAX = int(os.environ.get("AIO_POOL_MAX", "20"))
+POOL_WAIT = float(os.environ.get("AIO_POOL_WAIT", "5"))
+POOL_IDLE_TIMEOUT = float(os.environ.get("AIO_POOL_IDLE_TIMEOUT", "300"))
+STATEMENT_CACHE = int(os.environ.get("AIO_STATEMENT_CACHE", "256"))
+
+_PARAM = re.compile(r"%s")
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=1024)
+def dollar(sql: str) -> str:
+    """Плейсхолдеры psycopg2 (%s) → позиционные asyncpg ($1, $2, ...). Тексты — константы, поэтому кэш."""
+    counter = iter(range(1, sql.count("%s") + 1))
+    return _PARAM.sub(lambda m: f"${next(counter)}", sql)
+
+
+def server_settings() -> dict:
+    """Параметры сервера из PGOPTIONS: asyncpg, в отличие от libpq, эту переменную не читает."""
+    settings = {}
+    args = shlex.split(os.environ.get("PGOPTIONS", ""))
+    for i, arg in enumerate(args):
+        if arg == "-c" and i + 1 < len(args):
+            option = args[i + 1]
+        elif arg.startswith("-c") and len(arg) > 2:
+            option = arg[2:]
+        else:
+            continue
+        name, _, value = option.partition("=")
+        settings[name.strip()] = value.strip()
+    return settings
+
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool() -> asyncpg.Pool:
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    os.environ["DATABASE_URL"],
+                    min_size=min(POOL_MIN, POOL_MAX),
+                    max_size=POOL_MAX,
+                    max_inactive_connection_lifetime=POOL_IDLE_TIMEOUT,
+                    statement_cache_size=STATEMENT_CACHE,
+                    server_settings=server_settings(),
+                )
+    return _pool
+
+
+@contextlib.asynccontextmanager
+async def connection():
+    pool = await get_pool()
+    try:
+        conn = await pool.acquire(timeout=POOL_WAIT)
+    except asyncio.TimeoutError:
+        raise PoolExhausted(f"all {POOL_MAX} connections are busy")
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+class Replica:
+    """Пул asyncpg реплики и последний замер её отставания — как db.Replica."""
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.pool = None
+        self._lock = asyncio.Lock()
+        self.replay_lsn = 0
+        self.lag_seconds = None
+        self.checked_at = 0.0
+        self.reads = 0
+        self.fallbacks = 0
+        self.errors = 0
+
+    async def get_pool(self) -> asyncpg.Pool:
+        if self.pool is None:
+            async with self._lock:
+                if self.pool is None:
+                    self.pool = await asyncpg.create_pool(
+                        self.dsn,
+                        min_size=0,
+                        max_size=POOL_MAX,
+                        max_inactive_connection_lifetime=POOL_IDLE_TIMEOUT,
+                        statement_cache_size=STATEMENT_CACHE,
+                        server_settings=server_settings(),
+                    )
+        return self.pool
+
+    async def measure(self, conn):
+        lsn, lag = await conn.fetchrow(db.REPLICA_LAG_SQL)
+        self.replay_lsn = db.parse_lsn(lsn)
+        self.lag_seconds = float(lag)
+        self.checked_at = time.monotonic()
+
+    def usable(self) -> bool:
+        return self.lag_seconds is None or self.lag_seconds <= db.REPLICA_MAX_LAG
+
+    def stats(self) -> dict:
+        return {
+            "lag_seconds": None if self.lag_seconds is None else round(self.lag_seconds, 3),
+            "replay_lsn": self.replay_lsn,
+            "reads": self.reads,
+            "fallbacks": self.fallbacks,
+            "errors": self.errors,
+            "size": self.pool.get_size() if self.pool else 0,
+        }
+
+
+_replicas = [Replica(dsn) for dsn in db.REPLICA_URLS]
+_replica_turn = 0
+_on_replica = set()  # id соединений, выданных read_connection с реплики
+
+
+async def _replica_conn(key, min_lsn):
+    """(реплика, соединение), если реплика догнала записи сессии и не отстаёт; иначе None."""
+    global _replica_turn
+    now = time.monotonic()
+    # Отставшую реплику тоже перемеряем раз в DB_REPLICA_LAG_CHECK — так она вернётся, когда догонит
+    replicas = [r for r in _replicas if r.usable() or now - r.checked_at >= db.REPLICA_LAG_CHECK]
+    if not replicas:
+        return None
+    needed = db.required_lsn(key, min_lsn)
+    _replica_turn += 1
+    replica = replicas[_replica_turn % len(replicas)]
+
+    try:
+        replica_pool = await replica.get_pool()
+        conn = await replica_pool.acquire(timeout=POOL_WAIT)
+    except Exception:
+        replica.errors += 1
+        replica.fallbacks += 1
+        return None
+    try:
+        stale = time.monotonic() - replica.checked_at >= db.REPLICA_LAG_CHECK
+        if stale or (needed and replica.replay_lsn < needed):
+            await replica.measure(conn)
+    except Exception:
+        replica.errors += 1
+        await replica_pool.release(conn)
+        replica.fallbacks += 1
+        return None
+    if not replica.usable() or replica.replay_lsn < needed:
+        await replica_pool.release(conn)
+        replica.fallbacks += 1
+        return None
+    replica.reads += 1
+    return replica, conn
+
+
+@contextlib.asynccontextmanager
+async def read_connection(key=None, min_lsn=None):
+    """Соединение для чтения: реплика, догнавшая записи сессии key, иначе (и без реплик) — primary."""
+    picked = await _replica_conn(key, min_lsn) if _replicas else None
+    if picked is None:
+        async with connection() as conn:
+            yield conn
+        return
+    replica, conn = picked
+    _on_replica.add(id(conn))
+    try:
+        yield conn
+    finally:
+        _on_replica.discard(id(conn))
+        await replica.pool.release(conn)
+
+
+def is_replica(conn) -> bool:
+    return id(conn) in _on_replica
+
+
+async def fetch(conn, sql: str, *args) -> list:
+    """Строки как кортежи — в том же виде, что отдаёт курсор psycopg2."""
+    return [tuple(r) for r in await conn.fetch(dollar(sql), *args)]
+
+
+async def fetchrow(conn, sql: str, *args):
+    row = await conn.fetchrow(dollar(sql), *args)
+    return tuple(row) if row is not None else None
+
+
+async def run_plan(conn, plan):
+    """Выполняет план синхронной функции (генератор (sql, args) → строки) на соединении asyncpg."""
+    try:
+        sql, args = next(plan)
+        while True:
+            sql, args = plan.send(await fetch(conn, sql, *args))
+    except StopIteration as done:
+        return done.value
+
+
+async def close():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+    for replica in _replicas:
+        if replica.pool is not None:
+            await replica.pool.close()
+            replica.pool = None
+
+
+def stats() -> dict:
+    info = {}
+    if _pool is not None:
+        info = {"size": _pool.get_size(), "idle": _pool.get_idle_size(), "max": _pool.get_max_size()}
+    if _replicas:
+        info["replicas"] = {r.dsn.rsplit("@", 1)[-1]: r.stats() for r in _replicas}
+    return info
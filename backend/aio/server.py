@@ -0,0 +1,218 @@
+"""
+Асинхронный вариант backend/server.py: один event loop держит все соединения клиентов
+(HTTP/1.1 keep-alive), горячие маршруты messages и chats ждут Postgres через asyncpg,
+остальное — синхронные handler'ы функций в ограниченном пуле потоков, как в server.py.
+
+Простаивающее соединение клиента — это корутина и буферы, а не поток, поэтому тысячи
+одновременных клиентов не требуют тысячи потоков и соединений с БД.
+
+Настройки — те же SERVER_*, что у backend/server.py (SERVER_WORKERS — потоки для
+синхронных маршрутов, SERVER_QUEUE — сколько синхронных запросов может ждать потока, дальше — 503,
+SERVER_BACKLOG — очередь подключений), плюс AIO_* пула asyncpg (aio/pool.py).
+
+Запуск: cd backend && DATABASE_URL=postgres://... python -m aio.server
+"""
+import asyncio
+import base64
+import functools
+import json
+import signal
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import server as sync_server
+
+from . import chats, messages, pool
+
+# Функции с асинхронными маршрутами: имя -> фабрика AsyncApp
+ASYNC_APPS = {"messages": messages.make_app, "chats": chats.make_app}
+
+JSON = {"Content-Type": "application/json"}
+
+
+class AsyncFunctionServer:
+    def __init__(self, names, workers: int = sync_server.SERVER_WORKERS):
+        handlers = sync_server.load_functions(names)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="worker")
+        self.workers = workers
+        # Как в server.py: сверх потоков ждать может не больше SERVER_QUEUE синхронных запросов, дальше — 503
+        self.slots = threading.BoundedSemaphore(workers + sync_server.SERVER_QUEUE)
+        self.rejected = 0
+        self.apps = {}
+        for name, handler in handlers.items():
+            fallback = functools.partial(self.run_sync, handler)
+            make_app = ASYNC_APPS.get(name)
+            if make_app is not None:
+                module = sys.modules[f"friend_{name.replace('-', '_')}_index"]
+                self.apps[name] = make_app(module, fallback)
+            else:
+                self.apps[name] = fallback
+        self.draining = False
+        self.connections = 0
+        self.in_flight = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.writers = set()
+
+    async def run_sync(self, handler, event, context):
+        if not self.slots.acquire(blocking=False):
+            self.rejected += 1
+            return {"statusCode": 503, "headers": {"Retry-After": "1"}, "body": '{"error":"overloaded"}'}
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, handler, event, context)
+        finally:
+            self.slots.release()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self.writers.add(writer)
+        peer = (writer.get_extra_info("peername") or ("", 0))[0]
+        try:
+            while not self.draining:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), sync_server.SERVER_KEEPALIVE)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.send(writer, 431, JSON, b'{"error":"headers_too_large"}', close=True)
+                    break
+                try:
+                    request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+                    method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    await self.send(writer, 400, JSON, b'{"error":"bad_request"}', close=True)
+                    break
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip()] = value.strip()
+                lower = {k.lower(): v for k, v in headers.items()}
+                if "transfer-encoding" in lower:
+                    await self.send(writer, 411, JSON, b'{"error":"length_required"}', close=True)
+                    break
+                length = sync_server.content_length(lower.get("content-length"))
+                if length < 0:
+                    await self.send(writer, 400, JSON, b'{"error":"invalid_content_length"}', close=True)
+                    break
+                if length > sync_server.SERVER_MAX_BODY:
+                    await self.send(writer, 413, JSON, b'{"error":"payload_too_large"}', close=True)
+                    break
+                try:
+                    body = await reader.readexactly(length) if length else b""
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                keep_alive = version == "HTTP/1.1" and lower.get("connection", "").lower() != "close"
+                self.in_flight += 1
+                self.idle.clear()
+                try:
+                    status, resp_headers, raw = await self.dispatch(method, target, headers, body, peer)
+                    await self.send(writer, status, resp_headers, raw, close=not keep_alive or self.draining,
+                                    head_only=method == "HEAD")
+                finally:
+                    self.in_flight -= 1
+                    if not self.in_flight:
+                        self.idle.set()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            self.writers.discard(writer)
+            writer.close()
+
+    async def dispatch(self, method: str, target: str, headers: dict, body: bytes, peer: str):
+        started = time.perf_counter()
+        url = urllib.parse.urlsplit(target)
+        parts = url.path.lstrip("/").split("/", 1)
+        function_name, rest = parts[0], "/" + (parts[1] if len(parts) > 1 else "")
+
+        if function_name == "healthz":
+            return 200, JSON, self.health().encode()
+        app = self.apps.get(function_name)
+        if app is None:
+            return 404, JSON, b'{"error":"unknown_function"}'
+
+        try:
+            event = sync_server.make_event(method, headers, rest, url.query, body, peer)
+            resp = await app(event, sync_server.Context(function_name))
+        except Exception:
+            print(f"[SERVER ERROR] {method} {target}\n{traceback.format_exc()}")
+            return 500, JSON, b'{"error":"internal_error"}'
+
+        raw = resp.get("body") or ""
+        if resp.get("isBase64Encoded"):
+            raw = base64.b64decode(raw)
+        elif isinstance(raw, str):
+            raw = raw.encode()
+        if sync_server.SERVER_ACCESS_LOG:
+            ms = (time.perf_counter() - started) * 1000
+            print(f"[ACCESS] {method} {target} {resp.get('statusCode')} {ms:.1f}ms")
+        return resp.get("statusCode", 200), {**JSON, **(resp.get("headers") or {})}, raw
+
+    async def send(self, writer, status: int, headers: dict, body: bytes, close: bool = False, head_only=False):
+        try:
+            reason = HTTPStatus(status).phrase
+        except ValueError:
+            reason = ""
+        lines = [f"HTTP/1.1 {status} {reason}"]
+        for key, value in headers.items():
+            if key.lower() not in ("content-length", "connection"):
+                lines.append(f"{key}: {value}")
+        lines.append(f"Content-Length: {len(body)}")
+        if close:
+            lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", errors="replace"))
+        if not head_only:
+            writer.write(body)
+        await writer.drain()
+
+    def health(self) -> str:
+        info = {"functions": sorted(self.apps), "async": sorted(ASYNC_APPS), "workers": self.workers,
+                "rejected": self.rejected, "connections": self.connections, "in_flight": self.in_flight, "draining": self.draining,
+                "aio_pool": pool.stats(), **sync_server.shared_stats()}
+        return json.dumps(info, ensure_ascii=False, default=str)
+
+    async def drain(self, timeout: float = sync_server.SERVER_DRAIN_TIMEOUT):
+        """Дождаться начатых запросов, закрыть простаивающие соединения и оба пула."""
+        self.draining = True
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[SERVER] drain timeout after {timeout}s, exiting with requests in flight")
+        for writer in list(self.writers):
+            writer.close()
+        await pool.close()
+        self.executor.shutdown(wait=True)
+        sync_server.close_shared_state()
+
+
+async def serve():
+    names = sync_server.discover_functions()
+    sync_server.check_shared_modules(names)
+    app_server = AsyncFunctionServer(names)
+    sync_server.start_shared_state()
+    listener = await asyncio.start_server(app_server.handle_connection, sync_server.SERVER_HOST,
+                                          sync_server.SERVER_PORT, backlog=sync_server.SERVER_BACKLOG)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    print(f"[SERVER] asyncio listening on {sync_server.SERVER_HOST}:{sync_server.SERVER_PORT} "
+          f"workers={app_server.workers} pool_max={pool.POOL_MAX} functions={','.join(names)}")
+    await stop.wait()
+    print("[SERVER] shutting down")
+    listener.close()
+    await app_server.drain()
+    print("[SERVER] stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
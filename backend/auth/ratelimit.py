@@ -0,0 +1,161 @@
+"""
+Ограничение частоты запросов (token bucket) по телефону, IP и логину.
+Проверка идёт до любой работы с БД: отклонённый запрос не берёт соединение из пула.
+Функции деплоятся независимо, поэтому одинаковая копия файла лежит в каждой.
+
+Корзины живут в памяти процесса. Экземпляров функции может быть несколько, поэтому
+при RATELIMIT_STORE=postgres пропущенный локально запрос дополнительно сверяется
+с общей UNLOGGED-таблицей rate_limits (одна строка на ключ, корзины запроса под FOR UPDATE).
+
+Настройки (переменные окружения):
+RATELIMIT_STORE    — memory | postgres (по умолчанию memory)
+RATELIMIT_MAX_KEYS — сколько ключей держать в памяти, старые вытесняются (100000)
+RATELIMIT_<ПРАВИЛО> — «ёмкость/период_в_секундах», например RATELIMIT_SMS_SEND_PHONE=1/60
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import core
+
+RATELIMIT_STORE = os.environ.get("RATELIMIT_STORE", "memory")
+RATELIMIT_MAX_KEYS = int(os.environ.get("RATELIMIT_MAX_KEYS", "100000"))
+
+# правило -> (ёмкость корзины, период полного пополнения в секундах)
+DEFAULT_RULES = {
+    "sms_send_phone": (1, 60),
+    "sms_send_ip": (10, 600),
+    "sms_verify_phone": (5, 600),
+    "sms_verify_ip": (30, 600),
+    "login_username": (10, 600),
+    "login_ip": (30, 600),
+}
+
+
+def _load_rules() -> dict:
+    rules = {}
+    for name, (capacity, period) in DEFAULT_RULES.items():
+        raw = os.environ.get(f"RATELIMIT_{name.upper()}")
+        if raw:
+            capacity, period = raw.split("/")
+        capacity, period = float(capacity), float(period)
+        rules[name] = (capacity, capacity / period)  # (ёмкость, токенов в секунду)
+    return rules
+
+
+RULES = _load_rules()
+
+
+class MemoryStore:
+    def __init__(self, max_keys: int = RATELIMIT_MAX_KEYS):
+        self._buckets = OrderedDict()  # (правило, ключ) -> (токены, monotonic)
+        self._lock = threading.Lock()
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.rejected = 0
+
+    def take(self, items) -> float:
+        """
+        Списывает по токену со всех корзин items = [(правило, ключ)], если в каждой есть токен.
+        Возвращает 0, если пропущено, иначе — через сколько секунд повторить.
+        """
+        now = time.monotonic()
+        with self._lock:
+            refilled = []
+            retry_after = 0.0
+            for rule, key in items:
+                capacity, rate = RULES[rule]
+                tokens, ts = self._buckets.get((rule, key), (capacity, now))
+                tokens = min(capacity, tokens + (now - ts) * rate)
+                refilled.append(((rule, key), tokens))
+                if tokens < 1:
+                    retry_after = max(retry_after, (1 - tokens) / rate)
+            # Отказ ничего не списывает: корзины только пополняются до текущего момента
+            spend = 0 if retry_after else 1
+            for bucket, tokens in refilled:
+                self._buckets[bucket] = (tokens - spend, now)
+                self._buckets.move_to_end(bucket)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            if retry_after:
+                self.rejected += 1
+            else:
+                self.allowed += 1
+            return retry_after
+
+
+# Все корзины запроса блокируются разом в порядке ключа, решение принимается по всем сразу:
+# отказ по одной корзине не списывает токены с остальных (как в MemoryStore.take)
+SHARED_ENSURE_SQL = """INSERT INTO rate_limits (key, tokens, updated_at)
+                       SELECT k, c, NOW() FROM unnest(%s::varchar[], %s::float8[]) AS w(k, c)
+                       ON CONFLICT (key) DO NOTHING"""
+# Пополнение считается в БД по её часам — у экземпляров функции они могут расходиться
+SHARED_LOCK_SQL = """SELECT r.key, LEAST(w.capacity, r.tokens + EXTRACT(EPOCH FROM NOW() - r.updated_at) * w.rate)
+                     FROM rate_limits r
+                     JOIN unnest(%s::varchar[], %s::float8[], %s::float8[]) AS w(key, capacity, rate) ON w.key = r.key
+                     ORDER BY r.key
+                     FOR UPDATE OF r"""
+SHARED_SPEND_SQL = """UPDATE rate_limits r SET tokens = w.tokens, updated_at = NOW(), allowed = %s
+                      FROM unnest(%s::varchar[], %s::float8[]) AS w(key, tokens)
+                      WHERE r.key = w.key"""
+# key в rate_limits — VARCHAR(128); длинные ключи (логин, IPv6 с префиксом правила) хэшируются
+SHARED_KEY_MAX = 128
+
+
+def shared_key(rule: str, key: str) -> str:
+    full = f"{rule}:{key}"
+    if len(full) <= SHARED_KEY_MAX:
+        return full
+    return f"{rule}#{hashlib.sha256(full.encode()).hexdigest()}"
+
+
+_local = MemoryStore()
+
+
+def check(items) -> float:
+    """Проверка по корзинам процесса — без обращения к БД. 0 — пропустить, иначе Retry-After в секундах."""
+    return _local.take([(rule, key) for rule, key in items if key])
+
+
+def check_shared(conn, cur, items) -> float:
+    """
+    Сверка с общей таблицей rate_limits (только при RATELIMIT_STORE=postgres).
+    Токены списываются со всех корзин, только если в каждой есть токен.
+    Коммитит сразу: попытка должна засчитаться, даже если обработчик потом откатит транзакцию.
+    """
+    if RATELIMIT_STORE != "postgres":
+        return 0.0
+    rules = {}
+    for rule, key in items:
+        if key:
+            rules[shared_key(rule, key)] = RULES[rule]
+    if not rules:
+        return 0.0
+    keys = sorted(rules)
+    capacities = [rules[k][0] for k in keys]
+    rates = [rules[k][1] for k in keys]
+    cur.execute(SHARED_ENSURE_SQL, (keys, capacities))
+    cur.execute(SHARED_LOCK_SQL, (keys, capacities, rates))
+    tokens = dict(cur.fetchall())
+
+    retry_after = 0.0
+    for key in keys:
+        if tokens[key] < 1:
+            retry_after = max(retry_after, (1 - tokens[key]) / rules[key][1])
+    spend = 0 if retry_after else 1
+    cur.execute(SHARED_SPEND_SQL, (not retry_after, keys, [tokens[k] - spend for k in keys]))
+    conn.commit()
+    return retry_after
+
+
+def rejected(retry_after: float, message: str = None) -> dict:
+    resp = core.error(429, "too_many_requests", message)
+    resp["headers"]["Retry-After"] = str(math.ceil(retry_after))
+    return resp
+
+
+def stats() -> dict:
+    return {"allowed": _local.allowed, "rejected": _local.rejected, "keys": len(_local._buckets)}
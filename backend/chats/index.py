@@ -1,154 +1,401 @@
 """
 API чатов мессенджера Друг.
-GET / — список чатов текущего пользователя
-POST / — создать личный чат с пользователем
-GET /contacts — список всех пользователей
+GET / — список чатов текущего пользователя (limit / cursor — постранично)
+POST / — найти или создать личный чат с пользователем ({"user_id"}) или группу ({"type": "group", "name", "user_ids"})
+GET /members?chat_id=X — участники чата (limit / cursor — постранично)
+POST /members — добавить участников группы пачкой ({"chat_id", "user_ids"}), только владелец
+POST /members/remove — удалить участников пачкой (владелец) или выйти из группы (свой id)
+GET /contacts — справочник пользователей (q — поиск, limit / cursor — постранично, ETag)
 """
-import json
-import os
-import psycopg2
+import hashlib
+from datetime import datetime
+import time
+import core
+import db
+import presence
+import sessions
 
-CORS = {
-    "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-    "Access-Control-Allow-Headers": "Content-Type, X-Session-Id",
-}
+app = core.App(
+    "GET, POST, OPTIONS",
+    allow_headers="Content-Type, X-Session-Id, If-None-Match",
+    expose_headers="ETag",
+)
 
+DEFAULT_PAGE = 100
+MAX_PAGE = 500
 
-def get_conn():
-    return psycopg2.connect(os.environ["DATABASE_URL"])
+# Последнее сообщение берётся из сводки в chats (её ведёт backend/messages при отправке),
+# собеседник личного чата — в том же запросе, без отдельного SELECT на каждый чат.
+# Непрочитанное — разность счётчиков, а не COUNT(*) по сообщениям чата.
+# Собеседник — другой конец пары (pair_low, pair_high): поиск по первичному ключу users без chat_members,
+# поэтому статистика больших групп не уводит планировщик в перебор пользователей.
+# Порядок — по chats.last_activity_at: копия времени в chat_members сделала бы отправку O(участников).
+CHAT_LIST_SQL = f"""SELECT c.id, c.type, c.name,
+                          c.last_message_text, c.last_message_at,
+                          c.last_activity_at,
+                          peer.display_name, peer.avatar_initials, {presence.online_sql("peer")},
+                          GREATEST(c.message_count - cm.read_count, 0),
+                          peer.avatar_thumb_url, c.member_count
+                   FROM chat_members cm
+                   JOIN chats c ON c.id = cm.chat_id
+                   LEFT JOIN users peer ON c.type = 'personal'
+                     AND peer.id = CASE WHEN c.pair_low = %s THEN c.pair_high ELSE c.pair_low END
+                   WHERE cm.user_id = %s {{cond}}
+                   ORDER BY c.last_activity_at DESC, c.id DESC
+                   LIMIT %s"""
+CHAT_LIST_FIRST_SQL = db.register("chats_list_first", CHAT_LIST_SQL.format(cond=""))
+CHAT_LIST_BEFORE_SQL = db.register("chats_list_before", CHAT_LIST_SQL.format(
+    cond="AND (c.last_activity_at, c.id) < (%s, %s)"))
 
 
-def get_user_by_session(cur, session_id):
-    if not session_id:
+# Личный чат — по упорядоченной паре (меньший id, больший id), уникальный индекс uq_chats_personal_pair
+PERSONAL_CHAT_SQL = "SELECT id FROM chats WHERE pair_low = %s AND pair_high = %s AND type = 'personal'"
+# Создание за один запрос: чат и участники, если пары ещё нет. Параллельный запрос той же пары
+# дождётся конфликта и получит тот же id (DO UPDATE возвращает существующую строку, DO NOTHING — ничего).
+# Нет собеседника — нет строки.
+OPEN_PERSONAL_CHAT_SQL = """WITH chat AS (
+                              INSERT INTO chats (type, member_count, pair_low, pair_high)
+                              SELECT 'personal', %s, %s, %s WHERE EXISTS (SELECT 1 FROM users WHERE id = %s)
+                              ON CONFLICT (pair_low, pair_high) WHERE type = 'personal'
+                              DO UPDATE SET pair_low = EXCLUDED.pair_low
+                              RETURNING id, xmax = 0 AS created
+                            ), members AS (
+                              INSERT INTO chat_members (chat_id, user_id)
+                              SELECT chat.id, u FROM chat, unnest(%s::int[]) AS u WHERE chat.created
+                            )
+                            SELECT id FROM chat"""
+
+MEMBERS_PAGE = 100
+MAX_MEMBERS_PAGE = 1000
+# Сколько участников можно добавить или удалить одним запросом (один INSERT / DELETE по массиву)
+MAX_MEMBERS_BATCH = 10_000
+GROUP_NAME_MAX = 100
+
+# Новые участники видят историю, но не получают её как непрочитанное: отметка — на последнем сообщении.
+# Несуществующие пользователи и уже состоящие в чате отбрасываются тем же запросом.
+ADD_MEMBERS_SQL = """INSERT INTO chat_members (chat_id, user_id, last_read_message_id, read_count)
+                     SELECT %s, u.id, %s, %s FROM users u WHERE u.id = ANY(%s::int[])
+                     ON CONFLICT (chat_id, user_id) DO NOTHING
+                     RETURNING user_id"""
+REMOVE_MEMBERS_SQL = """DELETE FROM chat_members
+                        WHERE chat_id = %s AND user_id = ANY(%s::int[]) AND role != 'owner'
+                        RETURNING user_id"""
+# Строка чата блокируется на всё изменение состава: те же блокировки берёт отправка (резерв seq),
+# поэтому отметка «прочитано» новых участников не разойдётся со счётчиком сообщений
+GROUP_FOR_UPDATE_SQL = """SELECT c.type, cm.role, c.message_count, COALESCE(c.last_message_id, 0)
+                          FROM chats c LEFT JOIN chat_members cm ON cm.chat_id = c.id AND cm.user_id = %s
+                          WHERE c.id = %s
+                          FOR UPDATE OF c"""
+# Keyset по user_id — тот же уникальный индекс (chat_id, user_id), что у проверки членства
+MEMBERS_PAGE_SQL = f"""SELECT u.id, u.display_name, u.avatar_initials, {presence.online_sql("u")},
+                              u.avatar_thumb_url, cm.role
+                       FROM chat_members cm JOIN users u ON u.id = cm.user_id
+                       WHERE cm.chat_id = %s AND cm.user_id > %s
+                       ORDER BY cm.user_id
+                       LIMIT %s"""
+
+CONTACTS_PAGE = 50
+CONTACTS_MAX_PAGE = 200
+
+# То же выражение, что в индексе idx_users_directory_trgm (V0010) — иначе индекс не подхватится
+DIRECTORY_SEARCH_EXPR = (
+    "(lower(display_name) || ' ' || lower(username) || ' ' || "
+    "lower(coalesce(department, '')) || ' ' || lower(coalesce(position, '')))"
+)
+
+
+def like_pattern(q: str) -> str:
+    escaped = q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def parse_contacts_cursor(raw):
+    """Курсор справочника: «<display_name>:<id>»."""
+    if not raw:
         return None
+    try:
+        name, user_id = raw.rsplit(":", 1)
+        return name, int(user_id)
+    except ValueError:
+        raise core.HttpError(400, "invalid_cursor")
+
+
+def parse_cursor(raw):
+    """Курсор страницы чатов: «<last_activity_at в ISO>:<chat_id>»."""
+    if not raw:
+        return None
+    try:
+        activity, chat_id = raw.rsplit(":", 1)
+        return datetime.fromisoformat(activity), int(chat_id)
+    except ValueError:
+        raise core.HttpError(400, "invalid_cursor")
+
+
+def chat_list_query(user_id, before, limit):
+    if before:
+        return CHAT_LIST_BEFORE_SQL, [user_id, user_id, *before, limit + 1]
+    return CHAT_LIST_FIRST_SQL, [user_id, user_id, limit + 1]
+
+
+def chat_from_row(row) -> dict:
+    chat_id, chat_type, chat_name = row[0], row[1], row[2]
+    last_text, last_time = row[3], row[4]
+
+    # Для личных чатов — имя собеседника
+    display_name = chat_name
+    avatar = None
+    avatar_url = None
+    other_online = False
+    if chat_type == "personal":
+        if row[6] is not None:
+            display_name = row[6]
+            avatar = row[7]
+            other_online = row[8]
+            avatar_url = row[10]
+    else:
+        # Для группового — первые буквы слов названия
+        words = (chat_name or "ГЧ").split()
+        avatar = "".join(w[0].upper() for w in words[:2])
+
+    return {
+        "id": chat_id,
+        "type": chat_type,
+        "name": display_name,
+        "avatar": avatar or "??",
+        "avatar_url": avatar_url,
+        "online": other_online,
+        "last_message": last_text or "",
+        "last_time": last_time.strftime("%H:%M") if last_time else "",
+        "unread": row[9],
+        "members": row[11],
+    }
+
+
+def chat_list_response(chat_rows, limit) -> dict:
+    chat_rows = list(chat_rows)
+    has_more = len(chat_rows) > limit
+    chat_rows = chat_rows[:limit]
+    cursor = f"{chat_rows[-1][5].isoformat()}:{chat_rows[-1][0]}" if has_more else None
+    return {"chats": [chat_from_row(row) for row in chat_rows], "cursor": cursor}
+
+
+def parse_chat_id(body: dict) -> int:
+    try:
+        return int(body["chat_id"])
+    except (KeyError, TypeError, ValueError):
+        raise core.HttpError(400, "chat_id required")
+
+
+def parse_user_ids(raw) -> list:
+    """user_ids запроса: уникальные целые, не больше MAX_MEMBERS_BATCH."""
+    if not isinstance(raw, list):
+        raise core.HttpError(400, "user_ids required")
+    try:
+        user_ids = list(dict.fromkeys(int(u) for u in raw))
+    except (TypeError, ValueError):
+        raise core.HttpError(400, "user_ids required")
+    if len(user_ids) > MAX_MEMBERS_BATCH:
+        raise core.HttpError(400, "too_many_members")
+    return user_ids
+
+
+def lock_group(cur, chat_id, user_id):
+    """Блокирует строку группы; возвращает (роль пользователя, message_count, last_message_id)."""
+    cur.execute(GROUP_FOR_UPDATE_SQL, (user_id, chat_id))
+    row = cur.fetchone()
+    if row is None:
+        raise core.HttpError(404, "chat_not_found")
+    if row[1] is None:
+        raise core.HttpError(403, "forbidden")
+    if row[0] != "group":
+        raise core.HttpError(400, "not_a_group")
+    return row[1], row[2], row[3]
+
+
+def add_members(cur, chat_id, user_ids, message_count, last_message_id) -> list:
+    """Добавляет участников одним INSERT и сдвигает member_count. Возвращает id добавленных."""
+    if not user_ids:
+        return []
+    cur.execute(ADD_MEMBERS_SQL, (chat_id, last_message_id, message_count, user_ids))
+    added = [r[0] for r in cur.fetchall()]
+    if added:
+        cur.execute("UPDATE chats SET member_count = member_count + %s WHERE id = %s", (len(added), chat_id))
+    return added
+
+
+def create_group(conn, cur, user, body: dict) -> dict:
+    name = (body.get("name") or "").strip()
+    if not name or len(name) > GROUP_NAME_MAX:
+        return core.error(400, "name required")
+    user_ids = parse_user_ids(body.get("user_ids", []))
+
+    cur.execute("INSERT INTO chats (type, name, member_count) VALUES ('group', %s, 1) RETURNING id", (name,))
+    chat_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO chat_members (chat_id, user_id, role) VALUES (%s, %s, 'owner')", (chat_id, user["id"]))
+    added = add_members(cur, chat_id, [u for u in user_ids if u != user["id"]], 0, 0)
+    conn.commit()
+    return core.json_response(200, {"chat_id": chat_id, "members": len(added) + 1})
+
+
+# GET /members — участники чата постранично (курсор — последний user_id страницы)
+@app.route("GET", "members")
+@sessions.authenticated(read_only=True)
+def list_members(req, conn, cur, user):
+    if not req.query.get("chat_id"):
+        return core.error(400, "chat_id required")
+    chat_id = req.int_param("chat_id", error="invalid_chat_id")
+    limit = req.limit_param(MEMBERS_PAGE, MAX_MEMBERS_PAGE)
+    after = req.int_param("cursor") or 0
+
     cur.execute(
-        """SELECT u.id, u.username, u.display_name, u.avatar_initials
-           FROM sessions s JOIN users u ON u.id = s.user_id
-           WHERE s.token = %s AND s.expires_at > NOW()""",
-        (session_id,)
+        """SELECT c.member_count FROM chat_members cm JOIN chats c ON c.id = cm.chat_id
+           WHERE cm.chat_id = %s AND cm.user_id = %s""",
+        (chat_id, user["id"])
     )
-    return cur.fetchone()
+    row = cur.fetchone()
+    if row is None:
+        return core.error(403, "forbidden")
 
+    cur.execute(MEMBERS_PAGE_SQL, (chat_id, after, limit + 1))
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    members = [
+        {"id": r[0], "display_name": r[1], "avatar_initials": r[2], "online": r[3],
+         "avatar_thumb_url": r[4], "role": r[5]}
+        for r in rows
+    ]
+    cursor = str(rows[-1][0]) if has_more else None
+    return core.json_response(200, {"members": members, "count": row[0], "cursor": cursor})
 
-def handler(event: dict, context) -> dict:
-    if event.get("httpMethod") == "OPTIONS":
-        return {"statusCode": 200, "headers": CORS, "body": ""}
 
-    method = event.get("httpMethod", "GET")
-    path = event.get("path", "/")
-    headers = event.get("headers") or {}
-    session_id = headers.get("x-session-id") or headers.get("X-Session-Id")
+# POST /members/remove — удалить участников пачкой; не владелец может удалить только себя (выйти)
+@app.route("POST", "members/remove")
+@sessions.authenticated
+def remove_members(req, conn, cur, user):
+    body = req.json()
+    chat_id = parse_chat_id(body)
+    user_ids = parse_user_ids(body.get("user_ids"))
+
+    role, _, _ = lock_group(cur, chat_id, user["id"])
+    if role != "owner" and user_ids != [user["id"]]:
+        return core.error(403, "forbidden")
+    cur.execute(REMOVE_MEMBERS_SQL, (chat_id, user_ids))
+    removed = [r[0] for r in cur.fetchall()]
+    cur.execute("UPDATE chats SET member_count = member_count - %s WHERE id = %s RETURNING member_count",
+                (len(removed), chat_id))
+    count = cur.fetchone()[0]
+    conn.commit()
+    return core.json_response(200, {"removed": removed, "count": count})
+
+
+# POST /members — добавить участников группы пачкой (только владелец)
+@app.route("POST", "members")
+@sessions.authenticated
+def post_members(req, conn, cur, user):
+    body = req.json()
+    chat_id = parse_chat_id(body)
+    user_ids = parse_user_ids(body.get("user_ids"))
+
+    role, message_count, last_message_id = lock_group(cur, chat_id, user["id"])
+    if role != "owner":
+        return core.error(403, "forbidden")
+    added = add_members(cur, chat_id, user_ids, message_count, last_message_id)
+    cur.execute("SELECT member_count FROM chats WHERE id = %s", (chat_id,))
+    count = cur.fetchone()[0]
+    conn.commit()
+    return core.json_response(200, {"added": added, "count": count})
+
 
-    conn = get_conn()
+# GET /contacts — справочник: поиск по триграммному индексу, keyset по (display_name, id)
+@app.route("GET", "contacts")
+@sessions.authenticated(read_only=True)
+def list_contacts(req, conn, cur, user):
+    user_id = user["id"]
+    q = (req.query.get("q") or "").strip()
+    limit = req.limit_param(CONTACTS_PAGE, CONTACTS_MAX_PAGE)
+    after = parse_contacts_cursor(req.query.get("cursor"))
+
+    # Версия справочника — MAX(updated_at) по индексу; не изменился — 304 без выборки строк.
+    # «В сети» вычисляется по last_seen, поэтому версия ещё и устаревает раз в интервал сброса присутствия.
+    cur.execute("SELECT MAX(updated_at) FROM users")
+    version = cur.fetchone()[0]
+    presence_epoch = int(time.time() // presence.PRESENCE_FLUSH_INTERVAL)
+    etag = 'W/"' + hashlib.sha1(
+        f"{version}|{presence_epoch}|{user_id}|{q}|{req.query.get('cursor') or ''}|{limit}".encode()
+    ).hexdigest() + '"'
+    if req.headers.get("if-none-match") == etag:
+        return {"statusCode": 304, "headers": {"ETag": etag}, "body": ""}
+
+    cond = ""
+    args = [user_id]
+    if q:
+        cond += f" AND {DIRECTORY_SEARCH_EXPR} LIKE %s"
+        args.append(like_pattern(q))
+    if after:
+        cond += " AND (display_name, id) > (%s, %s)"
+        args += list(after)
+    args.append(limit + 1)
+    cur.execute(
+        f"""SELECT id, username, display_name, position, department, phone, avatar_initials,
+                   {presence.online_sql()}, avatar_thumb_url
+            FROM users WHERE id != %s{cond}
+            ORDER BY display_name, id
+            LIMIT %s""",
+        args
+    )
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    contacts = [
+        {"id": r[0], "username": r[1], "display_name": r[2], "position": r[3],
+         "department": r[4], "phone": r[5], "avatar_initials": r[6], "online": r[7],
+         "avatar_thumb_url": r[8]}
+        for r in rows
+    ]
+    cursor = f"{rows[-1][2]}:{rows[-1][0]}" if has_more else None
+    return core.json_response(200, {"contacts": contacts, "cursor": cursor}, {"ETag": etag})
+
+
+# GET / — список чатов (одним запросом, по сводке последнего сообщения в chats)
+@app.route("GET")
+@sessions.authenticated(read_only=True)
+def list_chats(req, conn, cur, user):
+    user_id = user["id"]
+    limit = req.limit_param(DEFAULT_PAGE, MAX_PAGE)
+    before = parse_cursor(req.query.get("cursor"))
+
+    sql, args = chat_list_query(user_id, before, limit)
+    db.execute(cur, sql, args)
+    return core.json_response(200, chat_list_response(cur.fetchall(), limit))
+
+
+# POST / — создать группу или создать / найти личный чат
+@app.route("POST")
+@sessions.authenticated
+def open_personal_chat(req, conn, cur, user):
+    body = req.json()
+    if body.get("type") == "group":
+        return create_group(conn, cur, user, body)
     try:
-        cur = conn.cursor()
-        user = get_user_by_session(cur, session_id)
-        if not user:
-            return {"statusCode": 401, "headers": CORS, "body": json.dumps({"error": "unauthorized"})}
-
-        user_id = user[0]
-
-        # GET /contacts
-        if method == "GET" and "contacts" in path:
-            cur.execute(
-                """SELECT id, username, display_name, position, department, phone, avatar_initials, online
-                   FROM users WHERE id != %s ORDER BY display_name""",
-                (user_id,)
-            )
-            rows = cur.fetchall()
-            contacts = [
-                {"id": r[0], "username": r[1], "display_name": r[2], "position": r[3],
-                 "department": r[4], "phone": r[5], "avatar_initials": r[6], "online": r[7]}
-                for r in rows
-            ]
-            return {"statusCode": 200, "headers": CORS, "body": json.dumps({"contacts": contacts})}
-
-        # GET / — список чатов
-        if method == "GET":
-            cur.execute(
-                """SELECT c.id, c.type, c.name,
-                          m.text, m.created_at, m.sender_id,
-                          sender.display_name as sender_name
-                   FROM chats c
-                   JOIN chat_members cm ON cm.chat_id = c.id AND cm.user_id = %s
-                   LEFT JOIN LATERAL (
-                     SELECT text, created_at, sender_id FROM messages
-                     WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1
-                   ) m ON true
-                   LEFT JOIN users sender ON sender.id = m.sender_id
-                   ORDER BY COALESCE(m.created_at, c.created_at) DESC""",
-                (user_id,)
-            )
-            chat_rows = cur.fetchall()
-
-            chats = []
-            for row in chat_rows:
-                chat_id, chat_type, chat_name = row[0], row[1], row[2]
-                last_text, last_time, last_sender_id, last_sender_name = row[3], row[4], row[5], row[6]
-
-                # Для личных чатов — имя собеседника
-                display_name = chat_name
-                avatar = None
-                other_online = False
-                if chat_type == "personal":
-                    cur.execute(
-                        """SELECT u.display_name, u.avatar_initials, u.online
-                           FROM chat_members cm JOIN users u ON u.id = cm.user_id
-                           WHERE cm.chat_id = %s AND cm.user_id != %s LIMIT 1""",
-                        (chat_id, user_id)
-                    )
-                    other = cur.fetchone()
-                    if other:
-                        display_name = other[0]
-                        avatar = other[1]
-                        other_online = other[2]
-                else:
-                    # Для группового — первые буквы слов названия
-                    words = (chat_name or "ГЧ").split()
-                    avatar = "".join(w[0].upper() for w in words[:2])
-
-                # Кол-во непрочитанных (упрощённо — 0 для своих)
-                chats.append({
-                    "id": chat_id,
-                    "type": chat_type,
-                    "name": display_name,
-                    "avatar": avatar or "??",
-                    "online": other_online,
-                    "last_message": last_text or "",
-                    "last_time": last_time.strftime("%H:%M") if last_time else "",
-                    "unread": 0,
-                })
-
-            return {"statusCode": 200, "headers": CORS, "body": json.dumps({"chats": chats})}
-
-        # POST / — создать или найти личный чат
-        if method == "POST":
-            body = json.loads(event.get("body") or "{}")
-            other_user_id = body.get("user_id")
-            if not other_user_id:
-                return {"statusCode": 400, "headers": CORS, "body": json.dumps({"error": "user_id required"})}
-
-            # Найти существующий личный чат между двумя пользователями
-            cur.execute(
-                """SELECT c.id FROM chats c
-                   JOIN chat_members cm1 ON cm1.chat_id = c.id AND cm1.user_id = %s
-                   JOIN chat_members cm2 ON cm2.chat_id = c.id AND cm2.user_id = %s
-                   WHERE c.type = 'personal' LIMIT 1""",
-                (user_id, other_user_id)
-            )
-            existing = cur.fetchone()
-            if existing:
-                return {"statusCode": 200, "headers": CORS, "body": json.dumps({"chat_id": existing[0]})}
-
-            cur.execute("INSERT INTO chats (type) VALUES ('personal') RETURNING id")
-            chat_id = cur.fetchone()[0]
-            cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s), (%s, %s)",
-                        (chat_id, user_id, chat_id, other_user_id))
-            conn.commit()
-            return {"statusCode": 200, "headers": CORS, "body": json.dumps({"chat_id": chat_id})}
-
-    finally:
-        conn.close()
-
-    return {"statusCode": 405, "headers": CORS, "body": json.dumps({"error": "not_found"})}
+        other_user_id = int(body["user_id"])
+    except (KeyError, TypeError, ValueError):
+        return core.error(400, "user_id required")
+    low, high = sorted((user["id"], other_user_id))
+
+    # Уже есть — одно чтение по уникальному индексу, без записи
+    cur.execute(PERSONAL_CHAT_SQL, (low, high))
+    existing = cur.fetchone()
+    if existing:
+        return core.json_response(200, {"chat_id": existing[0]})
+
+    cur.execute(OPEN_PERSONAL_CHAT_SQL, (len({low, high}), low, high, other_user_id, sorted({low, high})))
+    row = cur.fetchone()
+    if row is None:
+        return core.error(404, "user_not_found")
+    conn.commit()
+    return core.json_response(200, {"chat_id": row[0]})
+
+
+def handler(event: dict, context) -> dict:
+    return app(event, context)
@@ -0,0 +1,154 @@
+"""
+Инструментирование запросов: время каждого SQL-запроса (нормализованный текст,
+длительность, строки), получение соединения из пула, кодирование JSON и сжатие.
+Итог вызова уходит в заголовок Server-Timing и одну JSON-строку лога.
+Функции деплоятся независимо, поэтому одинаковая копия файла лежит в каждой.
+
+Выключено по умолчанию: тогда core и db проверяют один флаг ENABLED и ничего не замеряют.
+
+Настройки (переменные окружения):
+INSTRUMENT              — 1, чтобы включить
+INSTRUMENT_LOG          — писать строку лога на каждый вызов (по умолчанию 1 при включённом)
+INSTRUMENT_AGGREGATE    — копить в процессе сводку самых дорогих форм запросов (0)
+INSTRUMENT_MAX_SHAPES   — сколько форм запросов держать в сводке (500)
+INSTRUMENT_REPORT_EVERY — печатать топ сводки раз в столько вызовов (1000)
+"""
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+ENABLED = os.environ.get("INSTRUMENT", "0") == "1"
+LOG = os.environ.get("INSTRUMENT_LOG", "1") == "1"
+AGGREGATE = os.environ.get("INSTRUMENT_AGGREGATE", "0") == "1"
+MAX_SHAPES = int(os.environ.get("INSTRUMENT_MAX_SHAPES", "500"))
+REPORT_EVERY = int(os.environ.get("INSTRUMENT_REPORT_EVERY", "1000"))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM = re.compile(r"%\(\w+\)s|%s")
+_SPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize(sql: str) -> str:
+    """Форма запроса: литералы и параметры → ?, пробелы схлопнуты. Тексты запросов — константы, поэтому кэш."""
+    sql = _STRING.sub("?", sql)
+    sql = _PARAM.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+class Trace:
+    __slots__ = ("method", "path", "started", "phases", "statements")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.phases = {}      # conn / encode / compress -> мс
+        self.statements = []  # [(sql, мс, строк)]
+
+    def phase(self, name: str, ms: float):
+        self.phases[name] = self.phases.get(name, 0.0) + ms
+
+    def db_ms(self) -> float:
+        return sum(ms for _, ms, _ in self.statements)
+
+
+class ShapeStats:
+    """Сводка по формам запросов: число, суммарное и максимальное время, строки."""
+
+    def __init__(self, max_shapes: int = MAX_SHAPES):
+        self._shapes = {}  # sql -> [count, total_ms, max_ms, rows]
+        self._lock = threading.Lock()
+        self.max_shapes = max_shapes
+        self.requests = 0
+
+    def add(self, statements):
+        with self._lock:
+            self.requests += 1
+            for sql, ms, rows in statements:
+                s = self._shapes.get(sql)
+                if s is None:
+                    if len(self._shapes) >= self.max_shapes:
+                        # Вытесняем самую дешёвую форму — дорогие и должны остаться видны
+                        del self._shapes[min(self._shapes, key=lambda k: self._shapes[k][1])]
+                    s = self._shapes[sql] = [0, 0.0, 0.0, 0]
+                s[0] += 1
+                s[1] += ms
+                s[2] = max(s[2], ms)
+                s[3] += max(rows, 0)
+
+    def top(self, n: int = 10) -> list:
+        with self._lock:
+            items = sorted(self._shapes.items(), key=lambda kv: kv[1][1], reverse=True)[:n]
+        return [
+            {"sql": sql[:300], "count": c, "total_ms": round(total, 2),
+             "mean_ms": round(total / c, 3), "max_ms": round(mx, 2), "rows": rows}
+            for sql, (c, total, mx, rows) in items
+        ]
+
+
+_local = threading.local()
+_shapes = ShapeStats()
+
+
+def current():
+    return getattr(_local, "trace", None)
+
+
+def record(sql, ms: float, rows: int):
+    trace = current()
+    if trace is not None:
+        sql = sql.decode() if isinstance(sql, bytes) else str(sql)
+        trace.statements.append((normalize(sql), ms, rows))
+
+
+def begin(method: str, path: str) -> Trace:
+    trace = _local.trace = Trace(method, path)
+    return trace
+
+
+def phase(name: str, ms: float):
+    trace = current()
+    if trace is not None:
+        trace.phase(name, ms)
+
+
+def finish(trace: Trace, resp: dict) -> dict:
+    """Добавляет Server-Timing к ответу, пишет строку лога и сводку."""
+    _local.trace = None
+    total = (time.perf_counter() - trace.started) * 1000
+    db_ms = trace.db_ms()
+    metrics = [f'db;dur={db_ms:.2f};desc="{len(trace.statements)} queries"']
+    metrics += [f"{name};dur={ms:.2f}" for name, ms in trace.phases.items()]
+    metrics.append(f"total;dur={total:.2f}")
+    headers = dict(resp.get("headers") or {})
+    headers["Server-Timing"] = ", ".join(metrics)
+    headers["Timing-Allow-Origin"] = "*"
+    resp["headers"] = headers
+
+    if LOG:
+        print(json.dumps({
+            "event": "request",
+            "method": trace.method,
+            "path": trace.path,
+            "status": resp.get("statusCode"),
+            "total_ms": round(total, 2),
+            "db_ms": round(db_ms, 2),
+            "queries": len(trace.statements),
+            **{f"{name}_ms": round(ms, 2) for name, ms in trace.phases.items()},
+            "statements": [{"sql": sql[:200], "ms": round(ms, 2), "rows": rows} for sql, ms, rows in trace.statements],
+        }, ensure_ascii=False))
+    if AGGREGATE:
+        _shapes.add(trace.statements)
+        if _shapes.requests % REPORT_EVERY == 0:
+            print(f"[INSTRUMENT TOP] {json.dumps(_shapes.top(), ensure_ascii=False)}")
+    return resp
+
+
+def stats(n: int = 10) -> dict:
+    return {"requests": _shapes.requests, "top": _shapes.top(n)}
@@ -0,0 +1,325 @@
+"""
+Архив холодных секций messages.
+Секция выгружается COPY в текстовый формат Postgres (одна строка — одно сообщение), сжимается gzip
+и кладётся в хранилище вместе с манифестом; каталог выгрузок — таблица messages_archive.
+Выгруженную секцию можно вернуть в messages (restore: COPY FROM + ATTACH PARTITION)
+или прочитать прямо из архива, не возвращая (scan — по чату и подстроке текста).
+
+Настройки (переменные окружения):
+MESSAGES_ARCHIVE_URL — s3://bucket/prefix (S3_ENDPOINT_URL, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+                       или каталог на диске; без него архивирование выключено
+
+Из командной строки (DATABASE_URL — база):
+python backend/maintenance/archive.py list
+python backend/maintenance/archive.py export messages_p000000000000
+python backend/maintenance/archive.py restore messages_p000000000000
+python backend/maintenance/archive.py scan messages_p000000000000 --chat 42 --grep привет
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+from contextlib import closing, contextmanager
+
+MESSAGES_ARCHIVE_URL = os.environ.get("MESSAGES_ARCHIVE_URL", "")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "https://bucket.poehali.dev")
+
+# search_tsv — вычисляемая, при возврате секции Postgres посчитает её заново
+COLUMNS = ("id", "chat_id", "sender_id", "text", "file_name", "file_size", "msg_type", "created_at", "seq",
+           "client_msg_id")
+DATA_SUFFIX = ".copy.gz"
+MANIFEST_SUFFIX = ".json"
+
+PARTITIONS_SQL = """SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+                    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = 'messages'::regclass"""
+PARTITION_BOUND = re.compile(r"FROM \('?(-?\d+)'?\) TO \('?(-?\d+)'?\)")
+COPY_ESCAPE = re.compile(r"\\(.)")
+COPY_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+
+
+def partition_name(lo: int) -> str:
+    """Секция называется по нижней границе id: messages_p000005000000."""
+    return f"messages_p{lo:012d}"
+
+
+def partitions(cur) -> dict:
+    """Секции messages по диапазонам id: {имя: (от, до)} по возрастанию, без секции по умолчанию."""
+    cur.execute(PARTITIONS_SQL)
+    bounds = {}
+    for name, expr in cur.fetchall():
+        m = PARTITION_BOUND.search(expr or "")
+        if m:
+            bounds[name] = (int(m.group(1)), int(m.group(2)))
+    return dict(sorted(bounds.items(), key=lambda kv: kv[1]))
+
+
+def archive_candidates(cur, older_than_days: int) -> list:
+    """Закрытые секции (весь их диапазон id уже выдан), последнее сообщение которых старше older_than_days дней."""
+    cur.execute("SELECT last_value FROM messages_id_seq")
+    top = cur.fetchone()[0]
+    names = []
+    for name, (lo, hi) in partitions(cur).items():
+        if hi > top:
+            break
+        cur.execute(
+            f"SELECT created_at > NOW() - make_interval(days => %s) FROM {name} ORDER BY id DESC LIMIT 1",
+            (older_than_days,)
+        )
+        row = cur.fetchone()
+        if row is None or not row[0]:
+            names.append(name)
+    return names
+
+
+class Tap:
+    """Обёртка файла: по пути считает байты, строки и sha256 того, что через неё прошло."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+        self.bytes = 0
+        self.lines = 0
+
+    def _seen(self, data):
+        self.sha.update(data)
+        self.bytes += len(data)
+        self.lines += data.count(b"\n")
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self._seen(data)
+        return self.f.write(data)
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self._seen(data)
+        return data
+
+    def flush(self):
+        pass
+
+
+class LocalStorage:
+    def __init__(self, root: str):
+        self.root = root
+
+    def location(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    @contextmanager
+    def writer(self, name: str):
+        """Файл появляется под своим именем только целиком записанным."""
+        os.makedirs(self.root, exist_ok=True)
+        path = self.location(name)
+        with open(path + ".part", "wb") as f:
+            yield f
+        os.replace(path + ".part", path)
+
+    def reader(self, name: str):
+        return open(self.location(name), "rb")
+
+
+class S3Storage:
+    def __init__(self, bucket: str, prefix: str):
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
+            aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
+            config=Config(signature_version="s3v4", retries={"max_attempts": 3}),
+        )
+
+    def key(self, name: str) -> str:
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def location(self, name: str) -> str:
+        return f"s3://{self.bucket}/{self.key(name)}"
+
+    @contextmanager
+    def writer(self, name: str):
+        """Пишем во временный файл, потом загружаем (upload_fileobj сам режет большой файл на части)."""
+        with tempfile.TemporaryFile() as f:
+            yield f
+            f.seek(0)
+            self.client.upload_fileobj(f, self.bucket, self.key(name))
+
+    def reader(self, name: str):
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(name))["Body"]
+
+
+def get_storage(url: str = None):
+    """Хранилище по MESSAGES_ARCHIVE_URL; None — архив не настроен."""
+    url = url or MESSAGES_ARCHIVE_URL
+    if not url:
+        return None
+    if url.startswith("s3://"):
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        return S3Storage(bucket, prefix)
+    return LocalStorage(url)
+
+
+def export_partition(conn, name: str, storage) -> dict:
+    """
+    Выгружает закрытую секцию в хранилище, записывает её в каталог и отсоединяет от messages.
+    Всё — одной транзакцией: пока идёт выгрузка, запись в секцию заблокирована (чтение — нет);
+    если отсоединить не удалось, секция остаётся на месте, а файл перезапишется следующей попыткой.
+    Возвращает манифест.
+    """
+    cur = conn.cursor()
+    bounds = partitions(cur)
+    if name not in bounds:
+        raise ValueError(f"{name} is not a partition of messages")
+    lo, hi = bounds[name]
+    cur.execute("SELECT last_value FROM messages_id_seq")
+    if hi > cur.fetchone()[0]:
+        raise ValueError(f"{name} is still receiving messages")
+
+    cur.execute("SET LOCAL lock_timeout = '5s'")
+    cur.execute(f"LOCK TABLE {name} IN SHARE MODE")
+    cur.execute(f"SELECT created_at FROM {name} ORDER BY id LIMIT 1")
+    first = cur.fetchone()
+    cur.execute(f"SELECT created_at FROM {name} ORDER BY id DESC LIMIT 1")
+    last = cur.fetchone()
+
+    with storage.writer(name + DATA_SUFFIX) as f:
+        packed = Tap(f)
+        with gzip.GzipFile(filename="", fileobj=packed, mode="wb") as gz:
+            plain = Tap(gz)
+            cur.copy_expert(f"COPY {name} ({', '.join(COLUMNS)}) TO STDOUT", plain)
+
+    manifest = {
+        "partition": name,
+        "id_from": lo,
+        "id_to": hi,
+        "created_from": first[0].isoformat() if first else None,
+        "created_to": last[0].isoformat() if last else None,
+        "rows": plain.lines,
+        "columns": list(COLUMNS),
+        "format": "postgresql-copy-text+gzip",
+        "location": storage.location(name + DATA_SUFFIX),
+        "bytes": packed.bytes,
+        "sha256": packed.sha.hexdigest(),
+    }
+    with storage.writer(name + MANIFEST_SUFFIX) as f:
+        f.write(json.dumps(manifest, ensure_ascii=False, indent=2).encode())
+
+    cur.execute(
+        """INSERT INTO messages_archive
+             (partition_name, id_from, id_to, created_from, created_to, row_count, location, bytes, sha256)
+           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+           ON CONFLICT (partition_name) DO UPDATE SET
+             created_from = EXCLUDED.created_from, created_to = EXCLUDED.created_to,
+             row_count = EXCLUDED.row_count, location = EXCLUDED.location, bytes = EXCLUDED.bytes,
+             sha256 = EXCLUDED.sha256, archived_at = NOW(), restored_at = NULL""",
+        (name, lo, hi, first[0] if first else None, last[0] if last else None, plain.lines,
+         manifest["location"], packed.bytes, manifest["sha256"])
+    )
+    cur.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+    cur.execute(f"DROP TABLE {name}")
+    conn.commit()
+    return manifest
+
+
+def restore_partition(conn, name: str, storage) -> dict:
+    """Возвращает выгруженную секцию в messages: новая таблица, COPY FROM из архива, ATTACH PARTITION."""
+    cur = conn.cursor()
+    cur.execute("SELECT id_from, id_to, row_count, sha256 FROM messages_archive WHERE partition_name = %s", (name,))
+    row = cur.fetchone()
+    if row is None:
+        raise ValueError(f"{name} is not in messages_archive")
+    lo, hi, row_count, sha256 = row
+
+    cur.execute(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING GENERATED)")
+    with closing(storage.reader(name + DATA_SUFFIX)) as f:
+        packed = Tap(f)
+        with gzip.GzipFile(filename="", fileobj=packed, mode="rb") as gz:
+            cur.copy_expert(f"COPY {name} ({', '.join(COLUMNS)}) FROM STDIN", gz)
+    if packed.sha.hexdigest() != sha256.strip():
+        raise ValueError(f"{name}: checksum mismatch")
+
+    # CHECK с границами секции избавляет ATTACH от полного прохода по таблице под блокировкой
+    cur.execute(f"ALTER TABLE {name} ADD CONSTRAINT {name}_bounds CHECK (id >= {lo} AND id < {hi})")
+    cur.execute("SET LOCAL lock_timeout = '5s'")
+    cur.execute(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM ({lo}) TO ({hi})")
+    cur.execute(f"ALTER TABLE {name} DROP CONSTRAINT {name}_bounds")
+    cur.execute("UPDATE messages_archive SET restored_at = NOW() WHERE partition_name = %s", (name,))
+    conn.commit()
+    return {"partition": name, "id_from": lo, "id_to": hi, "rows": row_count}
+
+
+def copy_unescape(value: str):
+    if value == "\\N":
+        return None
+    if "\\" not in value:
+        return value
+    return COPY_ESCAPE.sub(lambda m: COPY_ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def scan_archive(storage, name: str, chat_id: int = None, contains: str = None):
+    """Читает выгруженную секцию прямо из архива: сообщения (словари) чата chat_id и/или с подстрокой contains."""
+    needle = contains.lower() if contains else None
+    with closing(storage.reader(name + DATA_SUFFIX)) as f, gzip.GzipFile(filename="", fileobj=f, mode="rb") as gz:
+        for line in gz:
+            fields = line.decode().rstrip("\n").split("\t")
+            if chat_id is not None and fields[1] != str(chat_id):
+                continue
+            row = dict(zip(COLUMNS, (copy_unescape(v) for v in fields)))
+            if needle and needle not in (row["text"] or "").lower():
+                continue
+            yield row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["list", "export", "restore", "scan"])
+    parser.add_argument("partition", nargs="?")
+    parser.add_argument("--storage", help="вместо MESSAGES_ARCHIVE_URL")
+    parser.add_argument("--chat", type=int, help="scan: только этот чат")
+    parser.add_argument("--grep", help="scan: подстрока текста")
+    args = parser.parse_args()
+    if args.command != "list" and not args.partition:
+        parser.error(f"{args.command} needs a partition name")
+
+    storage = get_storage(args.storage)
+    if args.command != "list" and storage is None:
+        parser.error("MESSAGES_ARCHIVE_URL is not set")
+
+    if args.command == "scan":
+        for row in scan_archive(storage, args.partition, args.chat, args.grep):
+            print(json.dumps(row, ensure_ascii=False))
+        return
+
+    import db
+
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        if args.command == "list":
+            for name, (lo, hi) in partitions(cur).items():
+                print(f"attached  {name}  [{lo}, {hi})")
+            cur.execute(
+                """SELECT partition_name, id_from, id_to, row_count, location, archived_at
+                   FROM messages_archive WHERE restored_at IS NULL ORDER BY id_from"""
+            )
+            for name, lo, hi, row_count, location, archived_at in cur.fetchall():
+                print(f"archived  {name}  [{lo}, {hi})  {row_count} rows  {location}  {archived_at:%Y-%m-%d}")
+        elif args.command == "export":
+            print(json.dumps(export_partition(conn, args.partition, storage), ensure_ascii=False, indent=2))
+        else:
+            print(json.dumps(restore_partition(conn, args.partition, storage), ensure_ascii=False))
+    finally:
+        db.put_conn(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Общее ядро обработчиков мессенджера Друг: CORS, разбор event, маршрутизация
+по методу и пути, быстрый JSON и сжатие больших ответов.
+Функции деплоятся независимо, поэтому одинаковая копия файла лежит в каждой.
+
+Настройки (переменные окружения):
+COMPRESS_MIN_BYTES — сжимать ответы не меньше этого размера (по умолчанию 1024)
+"""
+import base64
+import gzip
+import json
+import os
+import time
+import zlib
+
+import instrument
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+
+
+def dumps(payload) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload).decode()
+    # Кириллица без \uXXXX-экранирования — вдвое меньше байт
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+class HttpError(Exception):
+    """Прерывает обработку и превращается в ответ {"error": ..., "message": ...}."""
+
+    def __init__(self, status: int, error: str, message: str = None):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+        self.message = message
+
+
+class Request:
+    def __init__(self, event: dict, context=None):
+        self.event = event
+        self.context = context
+        self.method = event.get("httpMethod", "GET")
+        self.path = event.get("path", "/")
+        self.headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+        self.query = event.get("queryStringParameters") or {}
+        self._json = None
+
+    @property
+    def session_token(self):
+        return self.headers.get("x-session-id")
+
+    @property
+    def client_ip(self):
+        identity = (self.event.get("requestContext") or {}).get("identity") or {}
+        forwarded = (self.headers.get("x-forwarded-for") or "").split(",")[0].strip()
+        return identity.get("sourceIp") or forwarded or None
+
+    def raw_body(self) -> bytes:
+        raw = self.event.get("body") or ""
+        if self.event.get("isBase64Encoded"):
+            return base64.b64decode(raw)
+        return raw.encode() if isinstance(raw, str) else raw
+
+    def json(self) -> dict:
+        if self._json is None:
+            raw = self.event.get("body") or "{}"
+            if self.event.get("isBase64Encoded"):
+                raw = base64.b64decode(raw)
+            try:
+                self._json = loads(raw)
+            except ValueError:
+                raise HttpError(400, "invalid_json")
+            if not isinstance(self._json, dict):
+                raise HttpError(400, "invalid_json")
+        return self._json
+
+    def int_param(self, name: str, default=None, error: str = "invalid_cursor"):
+        value = self.query.get(name)
+        if not value:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise HttpError(400, error)
+
+    def limit_param(self, default: int, maximum: int) -> int:
+        return min(max(self.int_param("limit", default, "invalid_limit"), 1), maximum)
+
+
+def json_response(status: int, payload, headers: dict = None) -> dict:
+    if not instrument.ENABLED:
+        return {"statusCode": status, "headers": dict(headers or {}), "body": dumps(payload)}
+    started = time.perf_counter()
+    body = dumps(payload)
+    instrument.phase("encode", (time.perf_counter() - started) * 1000)
+    return {"statusCode": status, "headers": dict(headers or {}), "body": body}
+
+
+def error(status: int, code: str, message: str = None) -> dict:
+    payload = {"error": code}
+    if message:
+        payload["message"] = message
+    return json_response(status, payload)
+
+
+def _accepted_encoding(accept: str):
+    accept = (accept or "").lower()
+    for encoding in ("gzip", "deflate"):
+        for part in accept.split(","):
+            name, _, params = part.strip().partition(";")
+            if name.strip() == encoding and params.replace(" ", "") != "q=0":
+                return encoding
+    return None
+
+
+def compress(resp: dict, req: Request) -> dict:
+    """gzip/deflate для тел больше COMPRESS_MIN_BYTES, если клиент их принимает."""
+    body = resp.get("body")
+    if not body or resp.get("isBase64Encoded") or len(body) < COMPRESS_MIN_BYTES:
+        return resp
+    encoding = _accepted_encoding(req.headers.get("accept-encoding"))
+    if not encoding:
+        return resp
+    raw = body.encode() if isinstance(body, str) else body
+    packed = gzip.compress(raw, compresslevel=5) if encoding == "gzip" else zlib.compress(raw, 5)
+    headers = dict(resp.get("headers") or {})
+    headers["Content-Encoding"] = encoding
+    headers["Vary"] = "Accept-Encoding"
+    return {**resp, "headers": headers, "body": base64.b64encode(packed).decode(), "isBase64Encoded": True}
+
+
+class App:
+    """
+    Маршруты проверяются в порядке регистрации: первый с подходящим методом,
+    у которого фрагмент встречается в пути (или фрагмента нет), обрабатывает запрос.
+    """
+
+    def __init__(self, methods: str, allow_headers: str = "Content-Type, X-Session-Id",
+                 expose_headers: str = None):
+        self.cors = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": methods,
+            # X-Min-LSN / X-Write-LSN — чтение своих записей при чтении с реплик (db.get_read_conn)
+            "Access-Control-Allow-Headers": f"{allow_headers}, X-Min-LSN",
+            "Access-Control-Expose-Headers": ", ".join(filter(None, ("X-Write-LSN", expose_headers))),
+        }
+        self.routes = []
+
+    def route(self, method: str, fragment: str = None):
+        def register(fn):
+            self.routes.append((method, fragment, fn))
+            return fn
+        return register
+
+    def dispatch(self, req: Request) -> dict:
+        for method, fragment, fn in self.routes:
+            if method == req.method and (fragment is None or fragment in req.path):
+                return fn(req)
+        return error(405, "method_not_allowed")
+
+    def __call__(self, event: dict, context) -> dict:
+        if event.get("httpMethod") == "OPTIONS":
+            return {"statusCode": 200, "headers": dict(self.cors), "body": ""}
+        req = Request(event, context)
+        trace = instrument.begin(req.method, req.path) if instrument.ENABLED else None
+        try:
+            resp = self.dispatch(req)
+        except HttpError as e:
+            resp = error(e.status, e.error, e.message)
+        resp["headers"] = {**self.cors, **(resp.get("headers") or {})}
+        if trace is None:
+            return compress(resp, req)
+        started = time.perf_counter()
+        resp = compress(resp, req)
+        trace.phase("compress", (time.perf_counter() - started) * 1000)
+        return instrument.finish(trace, resp)
@@ -0,0 +1,505 @@
+"""
+Фоновое обслуживание БД мессенджера Друг (вызывается по расписанию).
+POST / {"action": "reconcile_unread"} — сверка счётчиков непрочитанного
+POST / {"action": "dispatch_sms"} — отправка СМС из sms_outbox (ждёт NOTIFY до конца бюджета)
+POST / {"action": "sweep_expired"} — удаление истёкших сессий, кодов, отправленных СМС, корзин rate_limits
+                                    и старых client_msg_id, ротация секций sms_codes и messages
+POST / {"action": "backfill_messages"} — перенос истории messages в секционированную таблицу (между V0016 и V0017)
+POST / {"action": "backfill_message_refs"} — перенос ссылок на сообщения в BIGINT-колонки (между V0020 и V0021)
+POST / {"action": "archive_messages"} — выгрузка старых секций messages в архив (archive.py)
+
+Доступ только с заголовком X-Maintenance-Token = MAINTENANCE_TOKEN.
+Работа идёт пачками и укладывается в MAINTENANCE_BUDGET секунд;
+в ответе — курсор, с которого продолжить следующий запуск.
+"""
+import hmac
+import json
+import os
+import select
+import time
+from datetime import datetime, timedelta, timezone
+import core
+import archive
+import db
+import sms
+
+app = core.App("POST, OPTIONS", allow_headers="Content-Type, X-Maintenance-Token")
+
+MAINTENANCE_BUDGET = float(os.environ.get("MAINTENANCE_BUDGET", "20"))
+DEFAULT_BATCH = 500
+
+SMS_BATCH = int(os.environ.get("SMS_BATCH", "50"))
+SMS_MAX_ATTEMPTS = int(os.environ.get("SMS_MAX_ATTEMPTS", "5"))
+SMS_BACKOFF_BASE = float(os.environ.get("SMS_BACKOFF_BASE", "2"))
+SMS_BACKOFF_MAX = float(os.environ.get("SMS_BACKOFF_MAX", "60"))
+SMS_LEASE = int(os.environ.get("SMS_LEASE", "60"))
+SMS_POLL = float(os.environ.get("SMS_POLL", "5"))
+
+SWEEP_BATCH = int(os.environ.get("SWEEP_BATCH", "1000"))
+SMS_CODES_PARTITIONS_AHEAD = int(os.environ.get("SMS_CODES_PARTITIONS_AHEAD", "7"))
+SMS_CODES_RETENTION_DAYS = int(os.environ.get("SMS_CODES_RETENTION_DAYS", "2"))
+SMS_OUTBOX_RETENTION = int(os.environ.get("SMS_OUTBOX_RETENTION", "86400"))
+
+# messages секционирована по диапазонам id (V0016): секции создаются заранее, на MESSAGES_PARTITIONS_AHEAD вперёд
+MESSAGES_PARTITION_SIZE = int(os.environ.get("MESSAGES_PARTITION_SIZE", "5000000"))
+MESSAGES_PARTITIONS_AHEAD = int(os.environ.get("MESSAGES_PARTITIONS_AHEAD", "2"))
+MESSAGE_CLIENT_ID_TTL_DAYS = int(os.environ.get("MESSAGE_CLIENT_ID_TTL_DAYS", "7"))
+MESSAGES_BACKFILL_BATCH = int(os.environ.get("MESSAGES_BACKFILL_BATCH", "5000"))
+MESSAGES_ARCHIVE_AFTER_DAYS = int(os.environ.get("MESSAGES_ARCHIVE_AFTER_DAYS", "365"))
+
+# Пакетные удаления: каждая пачка — отдельная короткая транзакция, SKIP LOCKED не мешает живым запросам
+SWEEP_SQL = {
+    "sessions": """DELETE FROM sessions WHERE id IN (
+                     SELECT id FROM sessions WHERE expires_at < NOW()
+                     ORDER BY expires_at LIMIT %s FOR UPDATE SKIP LOCKED)""",
+    "sms_codes": """DELETE FROM sms_codes WHERE (id, created_at) IN (
+                      SELECT id, created_at FROM sms_codes WHERE used OR expires_at < NOW()
+                      LIMIT %s FOR UPDATE SKIP LOCKED)""",
+    "sms_outbox": f"""DELETE FROM sms_outbox WHERE id IN (
+                       SELECT id FROM sms_outbox
+                       WHERE status IN ('sent', 'failed', 'expired')
+                         AND created_at < NOW() - make_interval(secs => {SMS_OUTBOX_RETENTION})
+                       LIMIT %s FOR UPDATE SKIP LOCKED)""",
+    # Корзина, не тронутая сутки, всё равно была бы полной
+    "rate_limits": """DELETE FROM rate_limits WHERE key IN (
+                        SELECT key FROM rate_limits WHERE updated_at < NOW() - INTERVAL '1 day'
+                        LIMIT %s FOR UPDATE SKIP LOCKED)""",
+    # Повтор отправки приходит в течение минут; дальше ключ идемпотентности не нужен
+    "message_client_ids": f"""DELETE FROM message_client_ids WHERE (sender_id, client_msg_id) IN (
+                               SELECT sender_id, client_msg_id FROM message_client_ids
+                               WHERE created_at < NOW() - make_interval(days => {MESSAGE_CLIENT_ID_TTL_DAYS})
+                               LIMIT %s FOR UPDATE SKIP LOCKED)""",
+}
+
+MESSAGES_COLUMNS = "id, chat_id, sender_id, text, file_name, file_size, msg_type, created_at, seq, client_msg_id"
+
+# Пачка истории в messages_new. FOR SHARE: строку не удалят и не изменят между чтением и копией,
+# а изменения после копии догонит триггер messages_mirror (его upsert перезаписывает строку)
+BACKFILL_SQL = f"""WITH batch AS (
+                     SELECT {MESSAGES_COLUMNS} FROM messages
+                     WHERE id > %s AND id <= %s ORDER BY id LIMIT %s FOR SHARE
+                   ), copied AS (
+                     INSERT INTO messages_new ({MESSAGES_COLUMNS}) SELECT {MESSAGES_COLUMNS} FROM batch
+                     ON CONFLICT (id) DO NOTHING
+                   )
+                   UPDATE messages_backfill SET last_id = COALESCE((SELECT MAX(id) FROM batch), upto)
+                   RETURNING last_id, upto, (SELECT COUNT(*) FROM batch)"""
+
+
+# Ссылки на сообщения → BIGINT-колонки (V0020): таблица → колонка. Строки, изменённые после снимка,
+# UPDATE перечитывает (READ COMMITTED), поэтому копируется последнее значение; новые пишет триггер
+MESSAGE_REFS = {"chats": "last_message_id", "chat_members": "last_read_message_id"}
+BACKFILL_REFS_SQL = """WITH batch AS (
+                         UPDATE {table} t SET {column}_big = t.{column}
+                         WHERE t.id IN (SELECT id FROM {table} WHERE id > %s AND id <= %s ORDER BY id LIMIT %s)
+                         RETURNING t.id
+                       )
+                       UPDATE message_refs_backfill SET last_id = COALESCE((SELECT MAX(id) FROM batch), upto)
+                       WHERE table_name = %s
+                       RETURNING last_id, upto, (SELECT COUNT(*) FROM batch)"""
+
+
+def reconcile_unread_batch(cur, after_chat_id: int, batch: int):
+    """Сверяет message_count чатов и read_count участников для пачки чатов. Возвращает (последний id, сколько чатов)."""
+    # Строки чатов блокируются до коммита (в порядке id, как в отправке): иначе отправка, успевшая
+    # зарезервировать seq между чтением и записью счётчика, получит перезаписанный message_count
+    cur.execute("SELECT id FROM chats WHERE id > %s ORDER BY id LIMIT %s FOR UPDATE", (after_chat_id, batch))
+    chat_ids = [r[0] for r in cur.fetchall()]
+    if not chat_ids:
+        return None, 0
+
+    # Сообщениям без seq выдаём номера после текущего счётчика чата
+    cur.execute(
+        """UPDATE messages m SET seq = c.message_count + s.rn
+           FROM (
+             SELECT id, chat_id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY id) AS rn
+             FROM messages WHERE seq IS NULL AND chat_id = ANY(%s)
+           ) s
+           JOIN chats c ON c.id = s.chat_id
+           WHERE m.id = s.id""",
+        (chat_ids,)
+    )
+    cur.execute(
+        """UPDATE chats c SET message_count = COALESCE((
+             SELECT MAX(m.seq) FROM messages m WHERE m.chat_id = c.id
+           ), 0)
+           WHERE c.id = ANY(%s)""",
+        (chat_ids,)
+    )
+    cur.execute(
+        """UPDATE chat_members cm SET read_count = COALESCE((
+             SELECT m.seq FROM messages m WHERE m.id = cm.last_read_message_id
+           ), 0)
+           WHERE cm.chat_id = ANY(%s)""",
+        (chat_ids,)
+    )
+    return chat_ids[-1], len(chat_ids)
+
+
+def reconcile_unread(body: dict) -> dict:
+    batch = int(body.get("batch") or DEFAULT_BATCH)
+    cursor = int(body.get("after_chat_id") or 0)
+    deadline = time.monotonic() + MAINTENANCE_BUDGET
+    chats_done = 0
+    done = False
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        while time.monotonic() < deadline:
+            last_id, count = reconcile_unread_batch(cur, cursor, batch)
+            conn.commit()
+            if last_id is None:
+                done = True
+                break
+            chats_done += count
+            cursor = last_id
+    finally:
+        db.put_conn(conn)
+    return core.json_response(200, {"done": done, "after_chat_id": cursor, "chats": chats_done})
+
+
+def claim_sms(cur, limit: int):
+    """
+    Забирает готовые к отправке строки. SKIP LOCKED — параллельные диспетчеры не ждут друг друга.
+    Строка уходит в 'sending' с арендой SMS_LEASE: если диспетчер упал, она снова станет готовой.
+    """
+    cur.execute(
+        """UPDATE sms_outbox o SET status = 'sending', attempts = o.attempts + 1,
+                  next_attempt_at = NOW() + make_interval(secs => %s)
+           FROM (
+             SELECT id FROM sms_outbox
+             WHERE status IN ('pending', 'sending') AND next_attempt_at <= NOW() AND expires_at > NOW()
+             ORDER BY next_attempt_at
+             LIMIT %s
+             FOR UPDATE SKIP LOCKED
+           ) due
+           WHERE o.id = due.id
+           RETURNING o.id, o.phone, o.message, o.attempts""",
+        (SMS_LEASE, limit)
+    )
+    return cur.fetchall()
+
+
+def backoff(attempts: int) -> float:
+    return min(SMS_BACKOFF_BASE * 2 ** (attempts - 1), SMS_BACKOFF_MAX)
+
+
+def record_sms_results(cur, claimed, results: dict):
+    """Статусы доставки одной пачкой: sent / pending с отсрочкой / failed."""
+    sent_ids, sent_provider_ids = [], []
+    retry_ids, retry_delays, retry_errors = [], [], []
+    failed_ids, failed_errors = [], []
+    for outbox_id, _, _, attempts in claimed:
+        result = results.get(outbox_id) or sms.SendResult(False, None, "no result", False)
+        if result.ok:
+            sent_ids.append(outbox_id)
+            sent_provider_ids.append(result.provider_id)
+        elif result.permanent or attempts >= SMS_MAX_ATTEMPTS:
+            failed_ids.append(outbox_id)
+            failed_errors.append(result.error)
+        else:
+            retry_ids.append(outbox_id)
+            retry_delays.append(backoff(attempts))
+            retry_errors.append(result.error)
+
+    if sent_ids:
+        cur.execute(
+            """UPDATE sms_outbox o SET status = 'sent', sent_at = NOW(), provider_id = v.provider_id, last_error = NULL
+               FROM unnest(%s::bigint[], %s::text[]) AS v(id, provider_id)
+               WHERE o.id = v.id""",
+            (sent_ids, sent_provider_ids)
+        )
+    if retry_ids:
+        cur.execute(
+            """UPDATE sms_outbox o SET status = 'pending', last_error = v.error,
+                      next_attempt_at = NOW() + make_interval(secs => v.delay)
+               FROM unnest(%s::bigint[], %s::float8[], %s::text[]) AS v(id, delay, error)
+               WHERE o.id = v.id""",
+            (retry_ids, retry_delays, retry_errors)
+        )
+    if failed_ids:
+        cur.execute(
+            """UPDATE sms_outbox o SET status = 'failed', last_error = v.error
+               FROM unnest(%s::bigint[], %s::text[]) AS v(id, error)
+               WHERE o.id = v.id""",
+            (failed_ids, failed_errors)
+        )
+    return len(sent_ids), len(retry_ids), len(failed_ids)
+
+
+def dispatch_sms(body: dict) -> dict:
+    """
+    Отправляет очередь пачками по SMS_BATCH, пока не кончится бюджет.
+    Пустая очередь — ждём NOTIFY sms_outbox от sms-auth (или SMS_POLL секунд, чтобы подобрать повторы).
+    {"wait": false} — только разобрать то, что уже готово.
+    """
+    provider = sms.get_provider()
+    wait = body.get("wait", True)
+    deadline = time.monotonic() + MAINTENANCE_BUDGET
+    totals = {"sent": 0, "retried": 0, "failed": 0, "expired": 0}
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """UPDATE sms_outbox SET status = 'expired'
+               WHERE status IN ('pending', 'sending') AND expires_at <= NOW()"""
+        )
+        totals["expired"] = cur.rowcount
+        cur.execute("LISTEN sms_outbox")
+        conn.commit()
+        try:
+            while time.monotonic() < deadline:
+                claimed = claim_sms(cur, SMS_BATCH)
+                conn.commit()
+                if claimed:
+                    # Вызов провайдера — вне транзакции: строки уже «арендованы», блокировки не держим
+                    results = provider.send_batch([(r[0], r[1], r[2]) for r in claimed])
+                    sent, retried, failed = record_sms_results(cur, claimed, results)
+                    conn.commit()
+                    totals["sent"] += sent
+                    totals["retried"] += retried
+                    totals["failed"] += failed
+                    continue
+                if not wait:
+                    break
+                remaining = min(deadline - time.monotonic(), SMS_POLL)
+                if remaining > 0 and select.select([conn], [], [], remaining) != ([], [], []):
+                    conn.poll()
+                    conn.notifies.clear()
+        finally:
+            cur.execute("UNLISTEN *")
+            conn.commit()
+            conn.notifies.clear()
+    finally:
+        db.put_conn(conn)
+    return core.json_response(200, totals)
+
+
+def sms_codes_partition(day) -> str:
+    return f"sms_codes_p{day:%Y%m%d}"
+
+
+def rotate_sms_codes_partitions(cur):
+    """Создаёт дневные секции sms_codes на SMS_CODES_PARTITIONS_AHEAD дней вперёд и удаляет старше срока хранения."""
+    today = datetime.now(timezone.utc).date()
+    created = []
+    for offset in range(SMS_CODES_PARTITIONS_AHEAD + 1):
+        day = today + timedelta(days=offset)
+        name = sms_codes_partition(day)
+        cur.execute("SELECT to_regclass(%s)", (name,))
+        if cur.fetchone()[0] is None:
+            cur.execute(
+                f"CREATE TABLE {name} PARTITION OF sms_codes FOR VALUES FROM (%s) TO (%s)",
+                (f"{day} 00:00+00", f"{day + timedelta(days=1)} 00:00+00")
+            )
+            created.append(name)
+
+    cur.execute(
+        """SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+           WHERE i.inhparent = 'sms_codes'::regclass AND c.relname LIKE 'sms\\_codes\\_p%%'"""
+    )
+    oldest_kept = sms_codes_partition(today - timedelta(days=SMS_CODES_RETENTION_DAYS))
+    dropped = []
+    for (name,) in cur.fetchall():
+        # Имена sms_codes_pYYYYMMDD сравниваются как даты
+        if name < oldest_kept:
+            cur.execute("SET LOCAL lock_timeout = '2s'")
+            cur.execute(f"ALTER TABLE sms_codes DETACH PARTITION {name}")
+            cur.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+    return created, dropped
+
+
+def create_messages_partition(cur, lo: int, hi: int) -> str:
+    """
+    Секция messages на [lo, hi). Если id уже обогнали секции и строки легли в messages_default,
+    они переезжают в новую секцию до ATTACH (иначе ATTACH откажет из-за пересечения с default).
+    """
+    name = archive.partition_name(lo)
+    cur.execute("SET LOCAL lock_timeout = '2s'")
+    cur.execute("SELECT EXISTS (SELECT 1 FROM messages_default WHERE id >= %s AND id < %s)", (lo, hi))
+    if not cur.fetchone()[0]:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF messages FOR VALUES FROM (%s) TO (%s)", (lo, hi))
+        return name
+    cur.execute(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING GENERATED)")
+    cur.execute(
+        f"""WITH moved AS (DELETE FROM messages_default WHERE id >= %s AND id < %s RETURNING {MESSAGES_COLUMNS})
+            INSERT INTO {name} ({MESSAGES_COLUMNS}) SELECT {MESSAGES_COLUMNS} FROM moved""",
+        (lo, hi)
+    )
+    cur.execute(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (lo, hi))
+    return name
+
+
+def rotate_messages_partitions(cur):
+    """Держит секции messages на MESSAGES_PARTITIONS_AHEAD диапазонов впереди последовательности id."""
+    cur.execute("SELECT to_regclass('messages_default')")
+    if cur.fetchone()[0] is None:
+        return []  # messages ещё не секционирована (до V0017)
+    cur.execute("SELECT last_value FROM messages_id_seq")
+    top = cur.fetchone()[0]
+    bounds = archive.partitions(cur)
+    end = max((hi for _, hi in bounds.values()), default=0)
+    target = (top // MESSAGES_PARTITION_SIZE + 1 + MESSAGES_PARTITIONS_AHEAD) * MESSAGES_PARTITION_SIZE
+    created = []
+    while end < target:
+        created.append(create_messages_partition(cur, end, end + MESSAGES_PARTITION_SIZE))
+        end += MESSAGES_PARTITION_SIZE
+    return created
+
+
+def sweep_table(conn, cur, table: str, batch: int, deadline: float) -> dict:
+    deleted = batches = 0
+    started = time.monotonic()
+    while time.monotonic() < deadline:
+        cur.execute(SWEEP_SQL[table], (batch,))
+        conn.commit()
+        batches += 1
+        deleted += cur.rowcount
+        if cur.rowcount < batch:
+            break
+    elapsed = time.monotonic() - started
+    return {
+        "deleted": deleted,
+        "batches": batches,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(deleted / elapsed) if elapsed > 0 else 0,
+        "done": cur.rowcount < batch if batches else False,
+    }
+
+
+def sweep_expired(body: dict) -> dict:
+    batch = int(body.get("batch") or SWEEP_BATCH)
+    deadline = time.monotonic() + MAINTENANCE_BUDGET
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        # Секции — первыми: DROP старого дня дешевле любого DELETE
+        created, dropped = rotate_sms_codes_partitions(cur)
+        conn.commit()
+        created += rotate_messages_partitions(cur)
+        conn.commit()
+        # message_client_ids появляется только с V0017 — между V0016 и V0017 её ещё нет
+        cur.execute("SELECT to_regclass('message_client_ids')")
+        tables = [t for t in SWEEP_SQL if t != "message_client_ids"] if cur.fetchone()[0] is None else list(SWEEP_SQL)
+        conn.commit()
+        metrics = {table: sweep_table(conn, cur, table, batch, deadline) for table in tables}
+    finally:
+        db.put_conn(conn)
+    result = {"tables": metrics, "partitions_created": created, "partitions_dropped": dropped}
+    print(f"[SWEEP] {json.dumps(result)}")
+    return core.json_response(200, result)
+
+
+def backfill_messages(body: dict) -> dict:
+    """
+    Переносит историю messages в messages_new пачками по id (после V0016, до V0017).
+    Курсор хранится в messages_backfill, поэтому запуски продолжают друг друга; done — можно применять V0017.
+    """
+    batch = int(body.get("batch") or MESSAGES_BACKFILL_BATCH)
+    deadline = time.monotonic() + MAINTENANCE_BUDGET
+    copied = 0
+    done = False
+    last_id = None
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass('messages_backfill')")
+        if cur.fetchone()[0] is None:
+            return core.json_response(200, {"done": True, "copied": 0, "last_id": None})
+        while time.monotonic() < deadline:
+            cur.execute("SELECT last_id, upto FROM messages_backfill")
+            last_id, upto = cur.fetchone()
+            cur.execute(BACKFILL_SQL, (last_id, upto, batch))
+            last_id, upto, count = cur.fetchone()
+            conn.commit()
+            copied += count
+            if last_id >= upto:
+                done = True
+                break
+    finally:
+        db.put_conn(conn)
+    return core.json_response(200, {"done": done, "copied": copied, "last_id": last_id})
+
+
+def backfill_message_refs(body: dict) -> dict:
+    """
+    Копирует chats.last_message_id и chat_members.last_read_message_id в BIGINT-колонки пачками по id
+    (после V0020, до V0021). Курсоры — в message_refs_backfill; done — можно применять V0021.
+    """
+    batch = int(body.get("batch") or MESSAGES_BACKFILL_BATCH)
+    deadline = time.monotonic() + MAINTENANCE_BUDGET
+    copied = {}
+    done = False
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass('message_refs_backfill')")
+        if cur.fetchone()[0] is None:
+            return core.json_response(200, {"done": True, "copied": copied})
+        cur.execute("SELECT table_name, last_id, upto FROM message_refs_backfill WHERE last_id < upto ORDER BY table_name")
+        pending = cur.fetchall()
+        for table, last_id, upto in pending:
+            copied[table] = 0
+            sql = BACKFILL_REFS_SQL.format(table=table, column=MESSAGE_REFS[table])
+            while last_id < upto and time.monotonic() < deadline:
+                cur.execute(sql, (last_id, upto, batch, table))
+                last_id, upto, count = cur.fetchone()
+                conn.commit()
+                copied[table] += count
+            if last_id < upto:
+                break
+        else:
+            done = True
+    finally:
+        db.put_conn(conn)
+    return core.json_response(200, {"done": done, "copied": copied})
+
+
+def archive_messages(body: dict) -> dict:
+    """
+    Выгружает в MESSAGES_ARCHIVE_URL закрытые секции messages старше older_than_days дней
+    (MESSAGES_ARCHIVE_AFTER_DAYS) и отсоединяет их. Бюджет проверяется между секциями.
+    """
+    storage = archive.get_storage()
+    if storage is None:
+        return core.error(400, "archive_not_configured")
+    days = int(body.get("older_than_days") or MESSAGES_ARCHIVE_AFTER_DAYS)
+    deadline = time.monotonic() + MAINTENANCE_BUDGET
+    archived = []
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        candidates = archive.archive_candidates(cur, days)
+        conn.commit()
+        for name in candidates:
+            if time.monotonic() >= deadline:
+                break
+            archived.append(archive.export_partition(conn, name, storage))
+    finally:
+        db.put_conn(conn)
+    result = {"archived": archived, "remaining": len(candidates) - len(archived)}
+    print(f"[ARCHIVE] {json.dumps(result, ensure_ascii=False)}")
+    return core.json_response(200, result)
+
+
+ACTIONS = {"reconcile_unread": reconcile_unread, "dispatch_sms": dispatch_sms, "sweep_expired": sweep_expired,
+           "backfill_messages": backfill_messages, "backfill_message_refs": backfill_message_refs,
+           "archive_messages": archive_messages}
+
+
+@app.route("POST")
+def run_action(req):
+    expected = os.environ.get("MAINTENANCE_TOKEN", "")
+    if not expected or not hmac.compare_digest(req.headers.get("x-maintenance-token") or "", expected):
+        return core.error(401, "unauthorized")
+
+    body = req.json()
+    action = ACTIONS.get(body.get("action", ""))
+    if not action:
+        return core.error(400, "unknown_action")
+    return action(body)
+
+
+def handler(event: dict, context) -> dict:
+    return app(event, context)
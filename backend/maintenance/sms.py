@@ -0,0 +1,87 @@
+"""
+Провайдеры отправки СМС для диспетчера sms_outbox.
+Провайдер получает пачку [(outbox_id, phone, message), ...] и возвращает
+{outbox_id: SendResult}; одна пачка — по возможности один HTTP-вызов.
+
+Настройки (переменные окружения):
+SMS_PROVIDER  — smsc | console (по умолчанию smsc, а без SMSC_LOGIN/SMSC_PASSWORD — console)
+SMSC_URL      — адрес send.php; для тестов — локальный фейковый сервер (bench/fake_smsc.py)
+SMSC_SENDER   — имя отправителя (ddmaxisrs)
+SMSC_TIMEOUT  — таймаут вызова провайдера в секундах (10)
+"""
+import json
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import namedtuple
+
+SendResult = namedtuple("SendResult", "ok provider_id error permanent")
+
+# Коды ошибок smsc.ru, при которых повтор не поможет: запрещённый текст, неверный номер
+SMSC_PERMANENT_ERRORS = {6, 7}
+
+
+class ConsoleProvider:
+    """Для разработки: коды пишутся в лог функции."""
+
+    def send_batch(self, items) -> dict:
+        for outbox_id, phone, message in items:
+            print(f"[DEV] SMS to {phone}: {message} (SMSC credentials not set)")
+        return {outbox_id: SendResult(True, None, None, False) for outbox_id, _, _ in items}
+
+
+class SmscProvider:
+    """
+    smsc.ru: разные тексты на разные номера одним вызовом через параметр list
+    («телефон:текст» построчно).
+    """
+
+    def __init__(self, login: str, password: str, url: str = None, sender: str = None, timeout: float = None):
+        self.login = login
+        self.password = password
+        self.url = url or os.environ.get("SMSC_URL", "https://smsc.ru/sys/send.php")
+        self.sender = sender or os.environ.get("SMSC_SENDER", "ddmaxisrs")
+        self.timeout = timeout or float(os.environ.get("SMSC_TIMEOUT", "10"))
+
+    def _call(self, params: dict) -> dict:
+        data = urllib.parse.urlencode({
+            "login": self.login,
+            "psw": self.password,
+            "sender": self.sender,
+            "fmt": 3,
+            "charset": "utf-8",
+            **params,
+        }).encode()
+        with urllib.request.urlopen(self.url, data=data, timeout=self.timeout) as r:
+            return json.loads(r.read().decode())
+
+    def send_batch(self, items) -> dict:
+        if len(items) == 1:
+            params = {"phones": items[0][1], "mes": items[0][2]}
+        else:
+            params = {"list": "\n".join(f"{phone}:{message.replace(chr(10), ' ')}" for _, phone, message in items)}
+        try:
+            resp = self._call(params)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            print(f"[SMS EXCEPTION] {e}")
+            return {outbox_id: SendResult(False, None, str(e), False) for outbox_id, _, _ in items}
+
+        print(f"[SMS] batch={len(items)} smsc_response={resp}")
+        if "error" in resp:
+            permanent = resp.get("error_code") in SMSC_PERMANENT_ERRORS
+            error = f"{resp.get('error_code')}: {resp.get('error')}"
+            return {outbox_id: SendResult(False, None, error, permanent) for outbox_id, _, _ in items}
+        provider_id = str(resp.get("id")) if resp.get("id") is not None else None
+        return {outbox_id: SendResult(True, provider_id, None, False) for outbox_id, _, _ in items}
+
+
+def get_provider():
+    name = os.environ.get("SMS_PROVIDER", "smsc")
+    login = os.environ.get("SMSC_LOGIN", "")
+    password = os.environ.get("SMSC_PASSWORD", "")
+    if name == "console" or not login or not password:
+        return ConsoleProvider()
+    if name == "smsc":
+        return SmscProvider(login, password)
+    raise ValueError(f"unknown SMS_PROVIDER: {name}")
@@ -1,133 +1,692 @@
 """
 API сообщений мессенджера Друг.
-GET /?chat_id=X - сообщения чата
-POST / - отправить сообщение
+GET /?chat_id=X - сообщения чата (before_id / after_id / limit — постраничная загрузка)
+GET /sync?cursor=C[&chat_id=X][&timeout=S] - новые сообщения после курсора (long-poll); без cursor — текущая позиция
+GET /search?q=...[&chat_id=X] - полнотекстовый поиск по своим чатам (limit / cursor — постранично)
+POST / - отправить сообщение или пачку ({"messages": [...]}); client_msg_id делает повтор безопасным
+POST /read - сдвинуть отметку «прочитано» (по одному или пачкой чатов)
 """
-import json
 import os
+import select
+import threading
+import time
 import psycopg2
+import core
+import db
+import presence
+import sessions
 
-CORS = {
-    "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-    "Access-Control-Allow-Headers": "Content-Type, X-Session-Id",
-}
+app = core.App("GET, POST, OPTIONS")
 
+DEFAULT_PAGE = 100
+MAX_PAGE = 200
 
-def get_conn():
-    return psycopg2.connect(os.environ["DATABASE_URL"])
+PAGE_SQL = """SELECT m.id, m.text, m.msg_type, m.file_name, m.file_size,
+                     m.created_at, m.sender_id,
+                     u.display_name, u.avatar_initials
+              FROM messages m JOIN users u ON u.id = m.sender_id
+              WHERE m.chat_id = %s {cond}
+              ORDER BY m.id {order}
+              LIMIT %s"""
+# Три формы страницы — константы, чтобы каждая готовилась на соединении один раз (db.register)
+PAGE_LATEST_SQL = db.register("messages_page_latest", PAGE_SQL.format(cond="", order="DESC"))
+PAGE_BEFORE_SQL = db.register("messages_page_before", PAGE_SQL.format(cond="AND m.id < %s", order="DESC"))
+PAGE_AFTER_SQL = db.register("messages_page_after", PAGE_SQL.format(cond="AND m.id > %s", order="ASC"))
 
 
-def get_user_by_session(cur, session_id):
-    if not session_id:
-        return None
-    cur.execute(
-        """SELECT u.id, u.display_name, u.avatar_initials
-           FROM sessions s JOIN users u ON u.id = s.user_id
-           WHERE s.token = %s AND s.expires_at > NOW()""",
-        (session_id,)
-    )
-    return cur.fetchone()
+MAX_SEND_BATCH = 100
 
+# Идемпотентность отправки: client_msg_id отправителя → id сообщения (messages секционирована по id,
+# уникального индекса по (sender_id, client_msg_id) на ней быть не может)
+SEND_EXISTING_SQL = """SELECT c.client_msg_id, m.id, m.created_at, m.text
+                       FROM message_client_ids c JOIN messages m ON m.id = c.message_id
+                       WHERE c.sender_id = %s AND c.client_msg_id = ANY(%s)"""
+# id выделяются под блокировкой строк чатов (после SEND_RESERVE_SQL): внутри чата порядок id совпадает с seq
+SEND_IDS_SQL = "SELECT nextval('messages_id_seq') FROM generate_series(1, %s)"
+SEND_CLAIM_SQL = """INSERT INTO message_client_ids (sender_id, client_msg_id, message_id)
+                    SELECT %s::int, client_msg_id, id FROM unnest(%s::varchar[], %s::bigint[]) AS v(client_msg_id, id)
+                    ON CONFLICT (sender_id, client_msg_id) DO NOTHING
+                    RETURNING client_msg_id"""
+SEND_RESERVE_SQL = """UPDATE chats c SET message_count = c.message_count + n.k
+                      FROM unnest(%s::int[], %s::int[]) AS n(chat_id, k)
+                      WHERE c.id = n.chat_id
+                        AND c.id IN (SELECT id FROM chats WHERE id = ANY(%s::int[]) ORDER BY id FOR UPDATE)
+                      RETURNING c.id, c.message_count"""
+# Возврат номеров, зарезервированных под сообщения, которые уже сохранил параллельный повтор
+# (строки чатов ещё заблокированы этой транзакцией, поэтому номера после нас никто не занял)
+SEND_REFUND_SQL = """UPDATE chats c SET message_count = c.message_count - n.k
+                     FROM unnest(%s::int[], %s::int[]) AS n(chat_id, k)
+                     WHERE c.id = n.chat_id"""
+SEND_INSERT_SQL = """INSERT INTO messages (id, chat_id, sender_id, text, msg_type, seq, client_msg_id)
+                     SELECT id, chat_id, %s::int, text, 'text', seq, client_msg_id
+                     FROM unnest(%s::bigint[], %s::int[], %s::text[], %s::int[], %s::varchar[])
+                          AS v(id, chat_id, text, seq, client_msg_id)
+                     RETURNING id, created_at, text, chat_id, seq, client_msg_id"""
+# Сводка для списка чатов: последнее сообщение и время активности
+SEND_SUMMARY_SQL = """UPDATE chats c SET last_message_id = v.id, last_message_text = v.text, last_message_at = v.created_at,
+                                         last_sender_id = %s, last_activity_at = v.created_at
+                      FROM unnest(%s::int[], %s::bigint[], %s::text[], %s::timestamptz[]) AS v(chat_id, id, text, created_at)
+                      WHERE c.id = v.chat_id AND (c.last_message_id IS NULL OR c.last_message_id < v.id)"""
+# Свои сообщения отправитель уже прочитал
+SEND_SELF_READ_SQL = """UPDATE chat_members cm SET last_read_message_id = v.id, read_count = v.seq
+                        FROM unnest(%s::int[], %s::bigint[], %s::int[]) AS v(chat_id, id, seq)
+                        WHERE cm.chat_id = v.chat_id AND cm.user_id = %s AND cm.read_count < v.seq"""
+# NOTIFY доставляется подписчикам /sync в момент коммита (канал — как в notify_channel)
+SEND_NOTIFY_SQL = """SELECT pg_notify('chat_' || v.chat_id, v.id::text)
+                     FROM unnest(%s::int[], %s::bigint[]) AS v(chat_id, id)"""
+MEMBER_SQL = db.register("messages_member", "SELECT 1 FROM chat_members WHERE chat_id = %s AND user_id = %s")
+MEMBER_OF_SQL = "SELECT chat_id FROM chat_members WHERE user_id = %s AND chat_id = ANY(%s::int[])"
 
-def handler(event: dict, context) -> dict:
-    if event.get("httpMethod") == "OPTIONS":
-        return {"statusCode": 200, "headers": CORS, "body": ""}
+SYNC_TIMEOUT = float(os.environ.get("SYNC_TIMEOUT", "25"))
+SYNC_LISTEN_PING = 30  # как часто поток LISTEN просыпается без уведомлений (проверка соединения)
+SYNC_LIMIT = 200
+
+# Курсор /sync — seq по каждому чату: seq выдаётся под блокировкой строки чата и коммитится по порядку,
+# поэтому сообщение с меньшим seq не может появиться после уже отданного (с id такой гарантии нет)
+SYNC_SQL = """SELECT m.id, m.text, m.msg_type, m.file_name, m.file_size,
+                     m.created_at, m.sender_id,
+                     u.display_name, u.avatar_initials, m.chat_id, m.seq
+              FROM unnest(%s::int[], %s::int[]) AS w(chat_id, seq)
+              CROSS JOIN LATERAL (
+                SELECT m.id, m.text, m.msg_type, m.file_name, m.file_size, m.created_at, m.sender_id, m.chat_id, m.seq
+                FROM messages m
+                WHERE m.chat_id = w.chat_id AND m.seq > w.seq
+                ORDER BY m.seq
+                LIMIT %s
+              ) m
+              JOIN users u ON u.id = m.sender_id
+              ORDER BY m.chat_id, m.seq
+              LIMIT %s"""
+
+
+SEARCH_PAGE = 20
+SEARCH_MAX_PAGE = 50
+SEARCH_MAX_QUERY = 200
+
+# Совпадения ищутся по GIN (chat_id, search_tsv), подсветка ts_headline — только для строк страницы
+SEARCH_SQL = """WITH q AS (
+                  SELECT websearch_to_tsquery('russian', %(q)s) || websearch_to_tsquery('simple', %(q)s) AS query
+                ),
+                page AS (
+                  SELECT m.id, m.chat_id, m.sender_id, m.text, m.created_at,
+                         ts_rank(m.search_tsv, q.query)::float8 AS rank
+                  FROM messages m, q
+                  WHERE m.chat_id = ANY(%(chat_ids)s) AND m.search_tsv @@ q.query
+                    {cond}
+                  ORDER BY rank DESC, m.id DESC
+                  LIMIT %(limit)s
+                )
+                SELECT p.id, p.chat_id, p.sender_id, u.display_name, p.created_at, p.rank,
+                       ts_headline('russian', p.text, q.query,
+                                   'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20, MinWords=5')
+                FROM page p JOIN users u ON u.id = p.sender_id, q
+                ORDER BY p.rank DESC, p.id DESC"""
+
+
+def notify_channel(chat_id) -> str:
+    return f"chat_{int(chat_id)}"
+
+
+def message_from_row(r, user_id):
+    return {
+        "id": r[0],
+        "text": r[1],
+        "type": r[2],
+        "file_name": r[3],
+        "file_size": r[4],
+        "time": r[5].strftime("%H:%M"),
+        "sender_id": r[6],
+        "sender_name": r[7],
+        "sender_avatar": r[8],
+        "own": r[6] == user_id,
+    }
+
+
+def require_member(cur, chat_id, user_id):
+    db.execute(cur, MEMBER_SQL, (chat_id, user_id))
+    if not cur.fetchone():
+        raise core.HttpError(403, "forbidden")
+
+
+def parse_sync_cursor(raw: str) -> dict:
+    """'chat_id:seq,chat_id:seq' → {chat_id: seq}."""
+    watermarks = {}
+    try:
+        for part in filter(None, raw.split(",")):
+            chat_id, seq = part.split(":")
+            watermarks[int(chat_id)] = int(seq)
+    except ValueError:
+        raise core.HttpError(400, "invalid_cursor")
+    return watermarks
+
+
+def format_sync_cursor(watermarks: dict) -> str:
+    return ",".join(f"{chat_id}:{seq}" for chat_id, seq in sorted(watermarks.items()))
+
+
+def fetch_since(conn, cur, watermarks, user_id):
+    """
+    Сообщения после seq-отметок чатов. Отдаются префиксом по seq в каждом чате (лимит режет
+    в порядке (chat_id, seq)), поэтому отметки можно двигать до последнего отданного seq.
+    """
+    chat_ids = list(watermarks)
+    cur.execute(SYNC_SQL, (chat_ids, [watermarks[c] for c in chat_ids], SYNC_LIMIT, SYNC_LIMIT))
+    rows = cur.fetchall()
+    conn.commit()  # не держим транзакцию открытой, пока ждём NOTIFY
+    messages = []
+    for r in rows:
+        message = message_from_row(r, user_id)
+        message["chat_id"] = r[9]
+        message["seq"] = r[10]
+        watermarks[r[9]] = max(watermarks[r[9]], r[10])
+        messages.append(message)
+    messages.sort(key=lambda m: m["id"])
+    return messages
+
+
+class SyncWaiter:
+    __slots__ = ("event", "lost")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lost = False  # соединение LISTEN оборвалось — подписка больше не действует
+
+
+class NotifyHub:
+    """
+    Одно соединение процесса (вне пула) слушает каналы чатов, которых ждут /sync, и будит ожидающих.
+    Ожидание не занимает соединение из пула: DB_POOL_MAX не ограничивает число висящих long-poll.
+    Соединение открывается при первой подписке; оборвалось — ожидающие просыпаются с lost
+    и возвращают ответ, следующая подписка откроет новое.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._waiters = {}  # chat_id -> {SyncWaiter}
+
+    def subscribe(self, chat_ids) -> SyncWaiter:
+        """После возврата LISTEN уже действует: NOTIFY любого следующего коммита разбудит waiter."""
+        waiter = SyncWaiter()
+        with self._lock:
+            conn = self._connection()
+            new = [c for c in chat_ids if c not in self._waiters]
+            for c in chat_ids:
+                self._waiters.setdefault(c, set()).add(waiter)
+            if new:
+                try:
+                    conn.cursor().execute("; ".join(f"LISTEN {notify_channel(c)}" for c in new))
+                except psycopg2.Error:
+                    self._reset()
+                    raise
+                self._dispatch()
+        return waiter
+
+    def unsubscribe(self, chat_ids, waiter: SyncWaiter):
+        with self._lock:
+            idle = []
+            for c in chat_ids:
+                waiters = self._waiters.get(c)
+                if waiters is None:
+                    continue
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[c]
+                    idle.append(c)
+            if idle and self._conn is not None:
+                try:
+                    self._conn.cursor().execute("; ".join(f"UNLISTEN {notify_channel(c)}" for c in idle))
+                    self._dispatch()
+                except psycopg2.Error:
+                    self._reset()
+
+    def _connection(self):
+        if self._conn is None:
+            conn = psycopg2.connect(os.environ["DATABASE_URL"])
+            conn.autocommit = True
+            self._conn = conn
+            threading.Thread(target=self._run, args=(conn,), name="sync-listen", daemon=True).start()
+        return self._conn
+
+    def _dispatch(self):
+        """Будит ожидающих по уже полученным уведомлениям (под self._lock)."""
+        for notify in self._conn.notifies:
+            for waiter in self._waiters.get(int(notify.channel.split("_", 1)[1]), ()):
+                waiter.event.set()
+        self._conn.notifies.clear()
+
+    def _reset(self):
+        """Закрывает соединение и будит всех ожидающих с lost (под self._lock)."""
+        conn, self._conn = self._conn, None
+        for waiters in self._waiters.values():
+            for waiter in waiters:
+                waiter.lost = True
+                waiter.event.set()
+        self._waiters = {}
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _run(self, conn):
+        while True:
+            try:
+                # Без блокировки: LISTEN из subscribe может идти параллельно, conn.poll — уже под ней
+                select.select([conn], [], [], SYNC_LISTEN_PING)
+                with self._lock:
+                    if conn is not self._conn:
+                        return
+                    conn.poll()
+                    self._dispatch()
+            except Exception as e:
+                with self._lock:
+                    if conn is self._conn:
+                        print(f"[SYNC] listen connection lost: {type(e).__name__}: {e}")
+                        self._reset()
+                return
+
+
+_hub = NotifyHub()
+
+
+def fetch_fresh(watermarks, user_id):
+    """fetch_since на соединении из пула, которое сразу возвращается."""
+    conn = db.get_conn()
+    try:
+        return fetch_since(conn, conn.cursor(), watermarks, user_id)
+    finally:
+        db.put_conn(conn)
+
+
+def wait_for_messages(watermarks, user_id, timeout):
+    """
+    Ждёт NOTIFY из POST по чатам watermarks до timeout секунд и отдаёт сообщения после seq-отметок
+    (сдвигает их). Подписка ставится до повторной проверки, поэтому сообщение между первой выборкой
+    и ожиданием не теряется. Соединение из пула берётся только на время каждой выборки.
+    """
+    chat_ids = list(watermarks)
+    waiter = _hub.subscribe(chat_ids)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            waiter.event.clear()
+            messages = fetch_fresh(watermarks, user_id)
+            remaining = deadline - time.monotonic()
+            if messages or waiter.lost or remaining <= 0:
+                return messages
+            waiter.event.wait(remaining)
+    finally:
+        _hub.unsubscribe(chat_ids, waiter)
+
+
+def run_plan(cur, plan):
+    """Выполняет план (генератор, отдающий (sql, args) и получающий строки) на курсоре psycopg2."""
+    try:
+        sql, args = next(plan)
+        while True:
+            cur.execute(sql, args)
+            sql, args = plan.send(cur.fetchall() if cur.description else [])
+    except StopIteration as done:
+        return done.value
+
+
+def send_messages(cur, user_id, items):
+    """Вставляет пачку сообщений одной транзакцией (коммит — на вызывающем). См. send_messages_plan."""
+    return run_plan(cur, send_messages_plan(user_id, items))
 
-    method = event.get("httpMethod", "GET")
-    headers = event.get("headers") or {}
-    session_id = headers.get("x-session-id") or headers.get("X-Session-Id")
 
-    conn = get_conn()
+def send_messages_plan(user_id, items):
+    """
+    План вставки пачки сообщений без привязки к драйверу: yield (sql, args) → строки результата.
+    Его выполняют и синхронный send_messages, и асинхронная версия в backend/aio.
+    Повтор с тем же client_msg_id не создаёт дубль, а возвращает уже сохранённую строку.
+    Возвращает [(id, created_at, text)] в порядке items.
+    """
+    results = [None] * len(items)
+
+    # Повторы: уже сохранённые client_msg_id этого отправителя
+    client_ids = [item["client_msg_id"] for item in items if item["client_msg_id"]]
+    existing = {}
+    if client_ids:
+        rows = yield SEND_EXISTING_SQL, (user_id, client_ids)
+        existing = {r[0]: (r[1], r[2], r[3]) for r in rows}
+
+    pending = []
+    seen = {}
+    for i, item in enumerate(items):
+        key = item["client_msg_id"]
+        if key and key in existing:
+            results[i] = existing[key]
+        elif key and key in seen:
+            continue  # дубль внутри пачки — заполним после вставки
+        else:
+            if key:
+                seen[key] = i
+            pending.append(i)
+
+    if pending:
+        # Сначала резервируем порядковые номера (seq) и блокируем строки чатов (в порядке id, без дедлоков),
+        # и только потом берём id: параллельная отправка в тот же чат ждёт нашего коммита,
+        # поэтому внутри чата порядок id совпадает с порядком seq
+        per_chat = {}
+        for i in pending:
+            per_chat[items[i]["chat_id"]] = per_chat.get(items[i]["chat_id"], 0) + 1
+        rows = yield SEND_RESERVE_SQL, (list(per_chat.keys()), list(per_chat.values()), list(per_chat.keys()))
+        first_seq = {r[0]: r[1] - per_chat[r[0]] + 1 for r in rows}
+
+        # По id занимаются client_msg_id и сопоставляются вставленные строки
+        rows = yield SEND_IDS_SQL, (len(pending),)
+        ids = dict(zip(pending, (r[0] for r in rows)))
+
+        # Занимаем client_msg_id. Занятые параллельным повтором (его транзакция уже закоммичена —
+        # вставка ждёт её на конфликте ключа) берём из его строк, не вставляем и возвращаем их номера
+        keyed = [i for i in pending if items[i]["client_msg_id"]]
+        if keyed:
+            rows = yield SEND_CLAIM_SQL, (user_id, [items[i]["client_msg_id"] for i in keyed], [ids[i] for i in keyed])
+            claimed = {r[0] for r in rows}
+            lost = [items[i]["client_msg_id"] for i in keyed if items[i]["client_msg_id"] not in claimed]
+            if lost:
+                rows = yield SEND_EXISTING_SQL, (user_id, lost)
+                existing.update({r[0]: (r[1], r[2], r[3]) for r in rows})
+                refund = {}
+                for i in keyed:
+                    if items[i]["client_msg_id"] not in claimed:
+                        results[i] = existing[items[i]["client_msg_id"]]
+                        refund[items[i]["chat_id"]] = refund.get(items[i]["chat_id"], 0) + 1
+                pending = [i for i in pending if results[i] is None]
+                yield SEND_REFUND_SQL, (list(refund.keys()), list(refund.values()))
+
+    if pending:
+        next_seq = dict(first_seq)
+        seqs = []
+        for i in pending:
+            chat_id = items[i]["chat_id"]
+            seqs.append(next_seq[chat_id])
+            next_seq[chat_id] += 1
+
+        rows = yield SEND_INSERT_SQL, (
+            user_id,
+            [ids[i] for i in pending],
+            [items[i]["chat_id"] for i in pending],
+            [items[i]["text"] for i in pending],
+            seqs,
+            [items[i]["client_msg_id"] for i in pending],
+        )
+        inserted = {r[0]: r for r in rows}
+        for i in pending:
+            r = inserted[ids[i]]
+            results[i] = (r[0], r[1], r[2])
+
+        # Сводка, своё «прочитано» и NOTIFY — по последнему вставленному сообщению каждого чата
+        last = {}
+        for r in inserted.values():
+            if r[3] not in last or r[0] > last[r[3]][0]:
+                last[r[3]] = r
+        last_rows = list(last.values())
+        yield SEND_SUMMARY_SQL, (user_id, [r[3] for r in last_rows], [r[0] for r in last_rows],
+                                 [r[2] for r in last_rows], [r[1] for r in last_rows])
+        yield SEND_SELF_READ_SQL, ([r[3] for r in last_rows], [r[0] for r in last_rows],
+                                   [r[4] for r in last_rows], user_id)
+        yield SEND_NOTIFY_SQL, ([r[3] for r in last_rows], [r[0] for r in last_rows])
+
+    # Дубли внутри пачки получают строку первого вхождения
+    for i, item in enumerate(items):
+        if results[i] is None:
+            results[i] = results[seen[item["client_msg_id"]]]
+    return results
+
+
+# GET /sync — новые сообщения после курсора: по одному чату или по всем чатам пользователя.
+# Курсор — seq-отметки чатов ('chat_id:seq,...'); чат, которого в курсоре нет (новый), начинается
+# с отметки «прочитано» участника
+@app.route("GET", "sync")
+def sync(req):
+    token = req.session_token
+    if not token:
+        return core.error(401, "unauthorized")
+    chat_id = req.int_param("chat_id")
+    raw_cursor = req.query.get("cursor")
+    try:
+        timeout = min(max(float(req.query.get("timeout") or SYNC_TIMEOUT), 0), SYNC_TIMEOUT)
+    except ValueError:
+        raise core.HttpError(400, "invalid_timeout")
+
+    # Соединение из пула — только на проверку сессии и первую выборку; ожидание идёт без него
+    conn = db.get_conn()
     try:
         cur = conn.cursor()
-        user = get_user_by_session(cur, session_id)
+        user = sessions.get_user_by_session(cur, token)
         if not user:
-            return {"statusCode": 401, "headers": CORS, "body": json.dumps({"error": "unauthorized"})}
-
-        user_id, user_name, user_avatar = user[0], user[1], user[2]
-
-        # GET — получить сообщения
-        if method == "GET":
-            params = event.get("queryStringParameters") or {}
-            chat_id = params.get("chat_id")
-            if not chat_id:
-                return {"statusCode": 400, "headers": CORS, "body": json.dumps({"error": "chat_id required"})}
-
-            # Проверить что пользователь член чата
-            cur.execute(
-                "SELECT 1 FROM chat_members WHERE chat_id = %s AND user_id = %s",
-                (chat_id, user_id)
-            )
-            if not cur.fetchone():
-                return {"statusCode": 403, "headers": CORS, "body": json.dumps({"error": "forbidden"})}
-
-            cur.execute(
-                """SELECT m.id, m.text, m.msg_type, m.file_name, m.file_size,
-                          m.created_at, m.sender_id,
-                          u.display_name, u.avatar_initials
-                   FROM messages m JOIN users u ON u.id = m.sender_id
-                   WHERE m.chat_id = %s
-                   ORDER BY m.created_at ASC
-                   LIMIT 100""",
-                (chat_id,)
-            )
-            rows = cur.fetchall()
-            messages = [
-                {
-                    "id": r[0],
-                    "text": r[1],
-                    "type": r[2],
-                    "file_name": r[3],
-                    "file_size": r[4],
-                    "time": r[5].strftime("%H:%M"),
-                    "sender_id": r[6],
-                    "sender_name": r[7],
-                    "sender_avatar": r[8],
-                    "own": r[6] == user_id,
-                }
-                for r in rows
-            ]
-            return {"statusCode": 200, "headers": CORS, "body": json.dumps({"messages": messages})}
-
-        # POST — отправить сообщение
-        if method == "POST":
-            body = json.loads(event.get("body") or "{}")
-            chat_id = body.get("chat_id")
-            text = (body.get("text") or "").strip()
-
-            if not chat_id or not text:
-                return {"statusCode": 400, "headers": CORS, "body": json.dumps({"error": "chat_id and text required"})}
-
-            # Проверить членство
-            cur.execute(
-                "SELECT 1 FROM chat_members WHERE chat_id = %s AND user_id = %s",
-                (chat_id, user_id)
-            )
-            if not cur.fetchone():
-                return {"statusCode": 403, "headers": CORS, "body": json.dumps({"error": "forbidden"})}
-
-            cur.execute(
-                """INSERT INTO messages (chat_id, sender_id, text, msg_type)
-                   VALUES (%s, %s, %s, 'text') RETURNING id, created_at""",
-                (chat_id, user_id, text)
-            )
-            row = cur.fetchone()
-            conn.commit()
-
-            message = {
-                "id": row[0],
-                "text": text,
-                "type": "text",
-                "time": row[1].strftime("%H:%M"),
-                "sender_id": user_id,
-                "sender_name": user_name,
-                "sender_avatar": user_avatar,
-                "own": True,
-            }
-            return {"statusCode": 200, "headers": CORS, "body": json.dumps({"message": message})}
+            return core.error(401, "unauthorized")
+        user_id = user["id"]
+        # Клиент, который ждёт новых сообщений, — в сети
+        presence.heartbeat(user_id)
+
+        if chat_id:
+            cur.execute("SELECT chat_id, read_count FROM chat_members WHERE user_id = %s AND chat_id = %s",
+                        (user_id, chat_id))
+            joined = dict(cur.fetchall())
+            if not joined:
+                return core.error(403, "forbidden")
+        else:
+            cur.execute("SELECT chat_id, read_count FROM chat_members WHERE user_id = %s", (user_id,))
+            joined = dict(cur.fetchall())
+
+        # Без курсора — только выдаём текущую позицию, с которой клиент начнёт синхронизацию
+        if raw_cursor is None:
+            cur.execute("SELECT id, message_count FROM chats WHERE id = ANY(%s)", (list(joined),))
+            return core.json_response(200, {"messages": [], "cursor": format_sync_cursor(dict(cur.fetchall()))})
 
+        seen = parse_sync_cursor(raw_cursor)
+        watermarks = {c: seen.get(c, read_count) for c, read_count in joined.items()}
+        messages = fetch_since(conn, cur, watermarks, user_id) if watermarks else []
     finally:
-        conn.close()
+        db.put_conn(conn)
+
+    if not messages and watermarks and timeout > 0:
+        messages = wait_for_messages(watermarks, user_id, timeout)
+    return core.json_response(200, {"messages": messages, "cursor": format_sync_cursor(watermarks)})
+
+
+# GET /search — поиск по сообщениям чатов, где пользователь состоит
+@app.route("GET", "search")
+@sessions.authenticated(read_only=True)
+def search(req, conn, cur, user):
+    user_id = user["id"]
+    q = (req.query.get("q") or "").strip()[:SEARCH_MAX_QUERY]
+    if not q:
+        return core.error(400, "q required")
+    limit = req.limit_param(SEARCH_PAGE, SEARCH_MAX_PAGE)
+    chat_id = req.int_param("chat_id")
+    after = None
+    if req.query.get("cursor"):
+        try:
+            rank, message_id = req.query["cursor"].rsplit(":", 1)
+            after = (float(rank), int(message_id))
+        except ValueError:
+            raise core.HttpError(400, "invalid_cursor")
+
+    cur.execute("SELECT chat_id FROM chat_members WHERE user_id = %s", (user_id,))
+    chat_ids = [r[0] for r in cur.fetchall()]
+    if chat_id is not None:
+        if chat_id not in chat_ids:
+            return core.error(403, "forbidden")
+        chat_ids = [chat_id]
+
+    args = {"q": q, "chat_ids": chat_ids, "limit": limit + 1}
+    cond = ""
+    if after:
+        cond = "AND (ts_rank(m.search_tsv, q.query)::float8, m.id) < (%(rank)s, %(id)s)"
+        args.update(rank=after[0], id=after[1])
+    cur.execute(SEARCH_SQL.format(cond=cond), args)
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    results = [
+        {
+            "id": r[0],
+            "chat_id": r[1],
+            "sender_id": r[2],
+            "sender_name": r[3],
+            "date": r[4].strftime("%d.%m.%Y"),
+            "time": r[4].strftime("%H:%M"),
+            "snippet": r[6],
+            "own": r[2] == user_id,
+        }
+        for r in rows
+    ]
+    cursor = f"{rows[-1][5]!r}:{rows[-1][0]}" if has_more else None
+    return core.json_response(200, {"results": results, "cursor": cursor})
+
+
+def page_query(chat_id, before_id, after_id, limit):
+    """
+    Keyset-пагинация по (chat_id, id): диапазонное чтение индекса без сортировки всего чата.
+    after_id — догрузка новых сообщений по возрастанию, иначе — страница самых свежих
+    (или более старых, чем before_id) по убыванию.
+    """
+    if after_id is not None:
+        return PAGE_AFTER_SQL, (chat_id, after_id, limit + 1)
+    if before_id is not None:
+        return PAGE_BEFORE_SQL, (chat_id, before_id, limit + 1)
+    return PAGE_LATEST_SQL, (chat_id, limit + 1)
+
+
+def page_response(rows, user_id, before_id, after_id, limit) -> dict:
+    rows = list(rows)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is None:
+        rows.reverse()
+    messages = [message_from_row(r, user_id) for r in rows]
+    return {
+        "messages": messages,
+        "has_more": has_more,
+        "before_id": messages[0]["id"] if messages else before_id,
+        "after_id": messages[-1]["id"] if messages else after_id,
+    }
 
-    return {"statusCode": 405, "headers": CORS, "body": json.dumps({"error": "method_not_allowed"})}
\ No newline at end of file
+
+# GET — получить сообщения
+@app.route("GET")
+@sessions.authenticated(read_only=True)
+def list_messages(req, conn, cur, user):
+    user_id = user["id"]
+    if not req.query.get("chat_id"):
+        return core.error(400, "chat_id required")
+    chat_id = req.int_param("chat_id", error="invalid_chat_id")
+    limit = req.limit_param(DEFAULT_PAGE, MAX_PAGE)
+    before_id = req.int_param("before_id")
+    after_id = req.int_param("after_id")
+
+    # Проверить что пользователь член чата
+    require_member(cur, chat_id, user_id)
+
+    sql, args = page_query(chat_id, before_id, after_id, limit)
+    db.execute(cur, sql, args)
+    return core.json_response(200, page_response(cur.fetchall(), user_id, before_id, after_id, limit))
+
+
+# POST /read — отметка «прочитано до message_id»; только вперёд (по seq), пачкой за один UPDATE
+@app.route("POST", "read")
+@sessions.authenticated
+def mark_read(req, conn, cur, user):
+    body = req.json()
+    reads = body.get("reads") or [body]
+    watermarks = {}
+    try:
+        for item in reads:
+            chat_id, message_id = int(item["chat_id"]), int(item["message_id"])
+            watermarks[chat_id] = max(message_id, watermarks.get(chat_id, 0))
+    except (KeyError, TypeError, ValueError):
+        return core.error(400, "chat_id and message_id required")
+
+    cur.execute(
+        """UPDATE chat_members cm
+           SET last_read_message_id = m.id, read_count = m.seq
+           FROM unnest(%s::int[], %s::bigint[]) AS r(chat_id, message_id)
+           JOIN messages m ON m.id = r.message_id AND m.chat_id = r.chat_id
+           WHERE cm.chat_id = r.chat_id AND cm.user_id = %s
+             AND cm.read_count < m.seq
+           RETURNING cm.chat_id""",
+        (list(watermarks.keys()), list(watermarks.values()), user["id"])
+    )
+    updated = [r[0] for r in cur.fetchall()]
+    conn.commit()
+    return core.json_response(200, {"updated": updated})
+
+
+def parse_send_items(body: dict) -> list:
+    """Тело POST (одно сообщение или {"messages": [...]}) → [{chat_id, text, client_msg_id}]."""
+    raw_items = (body.get("messages") or []) if "messages" in body else [body]
+    if not isinstance(raw_items, list):
+        raw_items = []
+
+    items = []
+    for raw in raw_items:
+        if not isinstance(raw, dict):
+            items = []
+            break
+        text = (raw.get("text") or "").strip()
+        client_msg_id = raw.get("client_msg_id")
+        try:
+            chat_id = int(raw.get("chat_id") or 0)
+        except (TypeError, ValueError):
+            chat_id = 0
+        if not chat_id or not text:
+            items = []
+            break
+        items.append({
+            "chat_id": chat_id,
+            "text": text,
+            "client_msg_id": str(client_msg_id)[:64] if client_msg_id else None,
+        })
+
+    if not items:
+        raise core.HttpError(400, "chat_id and text required")
+    if len(items) > MAX_SEND_BATCH:
+        raise core.HttpError(400, "too_many_messages")
+    return items
+
+
+def sent_message(item: dict, row, user: dict) -> dict:
+    return {
+        "id": row[0],
+        "chat_id": item["chat_id"],
+        "client_msg_id": item["client_msg_id"],
+        "text": row[2],
+        "type": "text",
+        "time": row[1].strftime("%H:%M"),
+        "sender_id": user["id"],
+        "sender_name": user["display_name"],
+        "sender_avatar": user["avatar_initials"],
+        "own": True,
+    }
+
+
+# POST — отправить сообщение (или пачку: {"messages": [...]}, в том числе в разные чаты)
+@app.route("POST")
+@sessions.authenticated
+def post_messages(req, conn, cur, user):
+    user_id = user["id"]
+    body = req.json()
+    batch = "messages" in body
+    items = parse_send_items(body)
+
+    # Проверить членство во всех чатах пачки одним запросом
+    chat_ids = sorted({item["chat_id"] for item in items})
+    cur.execute(MEMBER_OF_SQL, (user_id, chat_ids))
+    if len(cur.fetchall()) != len(chat_ids):
+        return core.error(403, "forbidden")
+
+    rows = send_messages(cur, user_id, items)
+    conn.commit()
+
+    messages = [sent_message(item, row, user) for item, row in zip(items, rows)]
+    if batch:
+        return core.json_response(200, {"messages": messages})
+    return core.json_response(200, {"message": messages[0]})
+
+
+def handler(event: dict, context) -> dict:
+    return app(event, context)
@@ -0,0 +1,202 @@
+"""
+Проверка сессии по токену с кэшем в памяти процесса (LRU + TTL).
+Горячий путь (опрос сообщений) перестаёт ходить в sessions JOIN users на каждый вызов.
+Функции деплоятся независимо, поэтому одинаковая копия файла лежит в каждой.
+
+Кэш живёт в рамках контейнера: сброс через forget_session / forget_user виден
+только этому процессу, в остальных запись доживает максимум SESSION_CACHE_TTL секунд.
+
+Настройки (переменные окружения):
+SESSION_CACHE_SIZE — сколько токенов держать в кэше (по умолчанию 10000)
+SESSION_CACHE_TTL  — сколько секунд доверять записи без похода в БД (30)
+"""
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+import core
+import db
+import presence
+
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "10000"))
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "30"))
+STATS_LOG_EVERY = 1000
+
+USER_FIELDS = (
+    "id", "username", "display_name", "position", "department",
+    "phone", "avatar_initials", "online", "avatar_url",
+)
+# «В сети» — вычисляемое по last_seen (см. presence), колонка users.online больше не используется
+USER_COLUMNS = (
+    "id, username, display_name, position, department, phone, avatar_initials, "
+    f"{presence.online_sql()} AS online, avatar_url"
+)
+
+
+def user_from_row(row) -> dict:
+    """Строка с колонками USER_COLUMNS (SELECT/RETURNING) → dict пользователя для ответа."""
+    return dict(zip(USER_FIELDS, row))
+
+
+class SessionCache:
+    def __init__(self, maxsize: int = SESSION_CACHE_SIZE, ttl: float = SESSION_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()  # token -> (user, годен до по time.time())
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str):
+        now = time.time()
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                self.misses += 1
+                return None
+            user, valid_until = item
+            if valid_until <= now:
+                del self._items[token]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._items.move_to_end(token)
+            self.hits += 1
+            return dict(user)
+
+    def put(self, token: str, user: dict, expires_at: float):
+        # Не держим запись дольше, чем живёт сама сессия
+        valid_until = min(time.time() + self.ttl, expires_at)
+        with self._lock:
+            self._items[token] = (dict(user), valid_until)
+            self._items.move_to_end(token)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def forget_session(self, token: str):
+        with self._lock:
+            if self._items.pop(token, None) is not None:
+                self.evictions += 1
+
+    def forget_user(self, user_id: int):
+        with self._lock:
+            stale = [t for t, (u, _) in self._items.items() if u["id"] == user_id]
+            for token in stale:
+                del self._items[token]
+            self.evictions += len(stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+_cache = SessionCache()
+
+
+SESSION_SQL = db.register("session_user", f"""SELECT u.id, u.username, u.display_name, u.position, u.department,
+                         u.phone, u.avatar_initials, {presence.online_sql("u")}, u.avatar_url,
+                         EXTRACT(EPOCH FROM s.expires_at)
+                  FROM sessions s JOIN users u ON u.id = s.user_id
+                  WHERE s.token = %s AND s.expires_at > NOW()""")
+
+
+def cached_user(token):
+    """Пользователь из кэша процесса или None (без обращения к БД)."""
+    user = _cache.get(token)
+    if (_cache.hits + _cache.misses) % STATS_LOG_EVERY == 0:
+        print(f"[SESSION CACHE] {_cache.stats()}")
+    return user
+
+
+def remember_session(token, row) -> dict:
+    """Строка SESSION_SQL → dict пользователя; кладёт его в кэш до expires_at сессии."""
+    user = user_from_row(row)
+    _cache.put(token, user, float(row[-1]))
+    return user
+
+
+def get_user_by_session(cur, token):
+    """Пользователь сессии как dict с полями USER_FIELDS или None."""
+    if not token:
+        return None
+    user = cached_user(token)
+    if user is None:
+        db.execute(cur, SESSION_SQL, (token,))
+        row = cur.fetchone()
+        if row:
+            user = remember_session(token, row)
+    return user
+
+
+def forget_session(token: str):
+    _cache.forget_session(token)
+
+
+def forget_user(user_id: int):
+    """Сбросить кэш после изменения строки users (профиль, аватар)."""
+    _cache.forget_user(user_id)
+
+
+def stats() -> dict:
+    return _cache.stats()
+
+
+def pin_writes(resp: dict, token, conn) -> dict:
+    """
+    После записи: сессия читает с primary, пока реплики не догонят (db.record_write),
+    а LSN записи уходит клиенту в X-Write-LSN — он вернёт его в X-Min-LSN другим функциям.
+    Без реплик ответ не меняется.
+    """
+    lsn = db.record_write(token, conn)
+    if lsn:
+        resp["headers"] = {**(resp.get("headers") or {}), "X-Write-LSN": lsn}
+    return resp
+
+
+def authenticated(fn=None, *, missing_error="unauthorized", invalid_error="unauthorized", read_only=False):
+    """
+    Декоратор маршрута core.App: открывает соединение из пула, проверяет сессию
+    и вызывает fn(req, conn, cur, user). Без токена в БД не ходит.
+    read_only=True — маршрут только читает, соединение берётся с реплики (db.get_read_conn);
+    после остальных маршрутов, кроме GET, сессия закрепляется за primary (pin_writes).
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(req):
+            if not req.session_token:
+                return core.error(401, missing_error)
+            if read_only:
+                conn = db.get_read_conn(req.session_token, req.headers.get("x-min-lsn"))
+            else:
+                conn = db.get_conn()
+            try:
+                cur = conn.cursor()
+                user = get_user_by_session(cur, req.session_token)
+                if not user and db.is_replica(conn):
+                    # Только что созданная сессия могла ещё не дойти до реплики — проверяем на primary
+                    db.put_conn(conn)
+                    conn = None  # если get_conn упадёт, finally не вернёт соединение реплики второй раз
+                    conn = db.get_conn()
+                    cur = conn.cursor()
+                    user = get_user_by_session(cur, req.session_token)
+                if not user:
+                    return core.error(401, invalid_error)
+                resp = fn(req, conn, cur, user)
+                if not read_only and req.method != "GET":
+                    resp = pin_writes(resp, req.session_token, conn)
+                return resp
+            finally:
+                if conn is not None:
+                    db.put_conn(conn)
+        return wrapper
+    return decorate(fn) if fn else decorate
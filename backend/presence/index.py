@@ -0,0 +1,39 @@
+"""
+Присутствие пользователей мессенджера Друг.
+POST / — heartbeat: отметить текущего пользователя «в сети»
+GET /?ids=1,2,3 — статус «в сети» и last_seen для списка пользователей
+"""
+import core
+import presence
+import sessions
+
+app = core.App("GET, POST, OPTIONS")
+
+MAX_LOOKUP_IDS = 500
+
+
+# POST / — heartbeat; last_seen пишется в БД пачкой, а не на каждый вызов.
+# Сам маршрут в БД не пишет (только буфер в памяти) — read_only: не закрепляет сессию за primary
+@app.route("POST")
+@sessions.authenticated(read_only=True)
+def heartbeat(req, conn, cur, user):
+    presence.heartbeat(user["id"])
+    return core.json_response(200, {"ok": True, "window": presence.PRESENCE_WINDOW})
+
+
+# GET /?ids= — пакетный запрос статусов
+@app.route("GET")
+@sessions.authenticated(read_only=True)
+def lookup(req, conn, cur, user):
+    try:
+        ids = {int(x) for x in (req.query.get("ids") or "").split(",") if x.strip()}
+    except ValueError:
+        return core.error(400, "invalid_ids")
+    if len(ids) > MAX_LOOKUP_IDS:
+        return core.error(400, "too_many_ids")
+    statuses = presence.lookup(cur, ids)
+    return core.json_response(200, {"presence": {str(uid): s for uid, s in statuses.items()}})
+
+
+def handler(event: dict, context) -> dict:
+    return app(event, context)
@@ -0,0 +1,162 @@
+"""
+Присутствие пользователей: «в сети» вычисляется по свежести users.last_seen,
+а не хранится флагом. Отметки heartbeat копятся в памяти процесса и
+пишутся в БД пачкой — одним UPDATE раз в PRESENCE_FLUSH_INTERVAL секунд.
+В облачной функции контейнер между вызовами заморожен, поэтому сброс делает
+сам запрос, если буфер старше интервала. В backend/server.py (и aio) процесс
+живёт постоянно — там start_flusher() запускает фоновый поток, и последняя
+пачка не ждёт следующего heartbeat. В обоих случаях сброс идёт на отдельном
+соединении из пула: ошибка записи логируется и не роняет запрос.
+Функции деплоятся независимо, поэтому одинаковая копия файла лежит в каждой.
+
+Настройки (переменные окружения):
+PRESENCE_WINDOW         — сколько секунд после последней отметки пользователь «в сети» (90)
+PRESENCE_FLUSH_INTERVAL — как часто сбрасывать накопленные отметки в БД (15)
+PRESENCE_FLUSH_MAX      — сбросить раньше, если накопилось столько пользователей (500)
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import db
+
+PRESENCE_WINDOW = int(os.environ.get("PRESENCE_WINDOW", "90"))
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get("PRESENCE_FLUSH_INTERVAL", "15"))
+PRESENCE_FLUSH_MAX = int(os.environ.get("PRESENCE_FLUSH_MAX", "500"))
+
+
+def online_sql(alias: str = "") -> str:
+    """SQL-выражение «в сети» для users (с алиасом таблицы или без)."""
+    column = f"{alias}.last_seen" if alias else "last_seen"
+    return f"({column} > NOW() - make_interval(secs => {PRESENCE_WINDOW}))"
+
+
+class PresenceBuffer:
+    def __init__(self):
+        self._pending = {}  # user_id -> datetime последней отметки
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._wake = threading.Event()
+        self._flusher = None
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.errors = 0
+
+    def touch(self, user_id: int):
+        with self._lock:
+            self._pending[user_id] = datetime.now(timezone.utc)
+            full = len(self._pending) >= PRESENCE_FLUSH_MAX
+            background = self._flusher is not None
+        if not background:
+            # Облачная функция: фонового потока нет, сбрасывает сам запрос
+            if self.due():
+                self._flush_pooled()
+        elif full:
+            self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name="presence-flush", daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(PRESENCE_FLUSH_INTERVAL)
+            self._wake.clear()
+            if self.due():
+                self._flush_pooled()
+
+    def _flush_pooled(self):
+        conn = None
+        try:
+            conn = db.get_conn()
+            self.flush(conn)
+        except Exception as e:
+            # Отметки вернулись в буфер (см. flush) — уйдут со следующей попыткой
+            self.errors += 1
+            print(f"[PRESENCE] flush failed: {type(e).__name__}: {e}")
+        finally:
+            if conn is not None:
+                db.put_conn(conn)
+
+    def pending(self, user_ids) -> dict:
+        with self._lock:
+            return {uid: self._pending[uid] for uid in user_ids if uid in self._pending}
+
+    def due(self) -> bool:
+        with self._lock:
+            return bool(self._pending) and (
+                len(self._pending) >= PRESENCE_FLUSH_MAX
+                or time.monotonic() - self._last_flush >= PRESENCE_FLUSH_INTERVAL
+            )
+
+    def flush(self, conn) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not batch:
+            return 0
+        cur = conn.cursor()
+        try:
+            # Отметка не откатывает last_seen назад, если параллельный процесс записал более свежую
+            cur.execute(
+                """UPDATE users u SET last_seen = v.ts
+                   FROM unnest(%s::int[], %s::timestamptz[]) AS v(id, ts)
+                   WHERE u.id = v.id AND (u.last_seen IS NULL OR u.last_seen < v.ts)""",
+                (list(batch.keys()), list(batch.values()))
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            with self._lock:
+                for uid, ts in batch.items():
+                    if uid not in self._pending or self._pending[uid] < ts:
+                        self._pending[uid] = ts
+            raise
+        with self._lock:
+            self.flushes += 1
+            self.flushed_rows += len(batch)
+        return len(batch)
+
+
+_buffer = PresenceBuffer()
+
+
+def heartbeat(user_id: int):
+    """Отметить пользователя «в сети»; в БД попадёт со следующим пакетным сбросом."""
+    _buffer.touch(user_id)
+
+
+def start_flusher():
+    """Сбрасывать отметки фоновым потоком — только для долгоживущего процесса (backend/server.py)."""
+    _buffer.start()
+
+
+def flush(conn) -> int:
+    return _buffer.flush(conn)
+
+
+def lookup(cur, user_ids) -> dict:
+    """{user_id: {"online": bool, "last_seen": iso}} для списка пользователей одним запросом."""
+    if not user_ids:
+        return {}
+    cur.execute("SELECT id, last_seen FROM users WHERE id = ANY(%s)", (list(user_ids),))
+    rows = {r[0]: r[1] for r in cur.fetchall()}
+    # Ещё не сброшенные отметки этого процесса свежее того, что в БД
+    for uid, ts in _buffer.pending(rows.keys()).items():
+        if rows[uid] is None or rows[uid] < ts:
+            rows[uid] = ts
+    now = datetime.now(timezone.utc)
+    return {
+        uid: {
+            "online": bool(ts and (now - ts).total_seconds() < PRESENCE_WINDOW),
+            "last_seen": ts.isoformat() if ts else None,
+        }
+        for uid, ts in rows.items()
+    }
+
+
+def stats() -> dict:
+    return {"flushes": _buffer.flushes, "flushed_rows": _buffer.flushed_rows, "errors": _buffer.errors}
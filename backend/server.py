@@ -0,0 +1,323 @@
+"""
+Единый процесс для всех функций мессенджера Друг — для развёртывания на своих хостах.
+Каждая функция из backend/<имя>/index.py монтируется под /<имя>/…; HTTP-запрос
+переводится в тот же event, что даёт облачная платформа, ответ handler'а — обратно в HTTP.
+
+Общие модули (db, core, sessions, presence, instrument, ratelimit) во всех папках —
+одинаковые копии, поэтому в процессе загружается один экземпляр каждого: пул соединений,
+кэш сессий, буфер присутствия и ограничители частоты общие для всех функций.
+
+Настройки (переменные окружения):
+SERVER_HOST           — адрес (0.0.0.0)
+SERVER_PORT           — порт (8000)
+SERVER_WORKERS        — потоков-обработчиков (16); пулу БД стоит дать DB_POOL_MAX не меньше (по умолчанию
+                        у пула 4): каждый поток держит соединение на время запроса, кроме ожидания /sync
+SERVER_QUEUE          — сколько соединений может ждать свободного потока, дальше — 503 (64)
+SERVER_BACKLOG        — очередь ещё не принятых соединений в ядре (1024; у socketserver по умолчанию 5)
+SERVER_FUNCTIONS      — какие функции монтировать, через запятую (по умолчанию все)
+SERVER_MAX_BODY       — максимальный размер тела запроса в байтах (10 МБ)
+SERVER_KEEPALIVE      — сколько секунд держать простаивающее keep-alive соединение (5)
+SERVER_DRAIN_TIMEOUT  — сколько секунд ждать завершения запросов при остановке (30)
+SERVER_ACCESS_LOG     — 1, чтобы писать строку на каждый запрос
+
+Запуск: DATABASE_URL=postgres://... python backend/server.py
+Остановка — SIGTERM / SIGINT: новые соединения не принимаются, начатые запросы
+дорабатывают, отметки присутствия сбрасываются в БД, пул закрывается.
+"""
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "16"))
+SERVER_QUEUE = int(os.environ.get("SERVER_QUEUE", "64"))
+SERVER_BACKLOG = int(os.environ.get("SERVER_BACKLOG", "1024"))
+SERVER_MAX_BODY = int(os.environ.get("SERVER_MAX_BODY", str(10 * 1024 * 1024)))
+SERVER_KEEPALIVE = float(os.environ.get("SERVER_KEEPALIVE", "5"))
+SERVER_DRAIN_TIMEOUT = float(os.environ.get("SERVER_DRAIN_TIMEOUT", "30"))
+SERVER_ACCESS_LOG = os.environ.get("SERVER_ACCESS_LOG", "0") == "1"
+
+# Тела этих типов отдаются handler'у строкой, остальные — base64 с isBase64Encoded
+TEXT_TYPES = ("application/json", "text/", "application/x-www-form-urlencoded")
+
+
+class Context:
+    """Минимальный аналог context облачной функции."""
+
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.request_id = uuid.uuid4().hex
+
+
+def discover_functions() -> list:
+    only = {f.strip() for f in os.environ.get("SERVER_FUNCTIONS", "").split(",") if f.strip()}
+    names = sorted(
+        name for name in os.listdir(BACKEND_DIR)
+        if os.path.isfile(os.path.join(BACKEND_DIR, name, "index.py")) and (not only or name in only)
+    )
+    missing = only - set(names)
+    if missing:
+        raise SystemExit(f"unknown functions in SERVER_FUNCTIONS: {', '.join(sorted(missing))}")
+    return names
+
+
+def check_shared_modules(names):
+    """Одно имя модуля в разных функциях должно быть одной и той же копией — иначе загрузится только первая."""
+    seen = {}
+    for name in names:
+        function_dir = os.path.join(BACKEND_DIR, name)
+        for filename in os.listdir(function_dir):
+            if not filename.endswith(".py") or filename == "index.py":
+                continue
+            with open(os.path.join(function_dir, filename), "rb") as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            first = seen.setdefault(filename, (name, digest))
+            if first[1] != digest:
+                raise SystemExit(f"{filename} differs between {first[0]} and {name}; copy the same version into both")
+
+
+def load_functions(names) -> dict:
+    for name in names:
+        function_dir = os.path.join(BACKEND_DIR, name)
+        if function_dir not in sys.path:
+            sys.path.append(function_dir)
+    handlers = {}
+    for name in names:
+        # Уникальное имя модуля: у всех функций файл называется index.py
+        spec = importlib.util.spec_from_file_location(
+            f"friend_{name.replace('-', '_')}_index", os.path.join(BACKEND_DIR, name, "index.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module  # backend/aio берёт отсюда общие помощники функций
+        spec.loader.exec_module(module)
+        handlers[name] = module.handler
+    return handlers
+
+
+def make_event(method: str, headers: dict, path: str, query: str, body: bytes, client_ip: str) -> dict:
+    content_type = next((v for k, v in headers.items() if k.lower() == "content-type"), "").lower()
+    is_text = not body or content_type.startswith(TEXT_TYPES)
+    return {
+        "httpMethod": method,
+        "path": path,
+        "headers": headers,
+        "queryStringParameters": {k: v[-1] for k, v in urllib.parse.parse_qs(query).items()},
+        "requestContext": {"identity": {"sourceIp": client_ip}},
+        "body": body.decode("utf-8", errors="replace") if is_text else base64.b64encode(body).decode(),
+        "isBase64Encoded": not is_text,
+    }
+
+
+def content_length(value) -> int:
+    """Значение Content-Length → число байт; -1 — заголовок не число или отрицательный."""
+    if not value:
+        return 0
+    value = value.strip()
+    return int(value) if value.isascii() and value.isdigit() else -1
+
+
+class FunctionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FriendServer"
+    timeout = SERVER_KEEPALIVE
+
+    def do_GET(self):
+        self.dispatch()
+
+    do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = do_GET
+
+    def dispatch(self):
+        started = time.perf_counter()
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.lstrip("/").split("/", 1)
+        function_name, rest = parts[0], "/" + (parts[1] if len(parts) > 1 else "")
+
+        # Тело читается только по Content-Length: chunked без длины не принимаем
+        if "Transfer-Encoding" in self.headers:
+            self.send_raw(411, {"Content-Type": "application/json"}, b'{"error":"length_required"}')
+            self.close_connection = True
+            return
+        length = content_length(self.headers.get("Content-Length"))
+        if length < 0:
+            self.send_raw(400, {"Content-Type": "application/json"}, b'{"error":"invalid_content_length"}')
+            self.close_connection = True
+            return
+        if length > SERVER_MAX_BODY:
+            self.send_raw(413, {"Content-Type": "application/json"}, b'{"error":"payload_too_large"}')
+            self.close_connection = True
+            return
+        body = self.rfile.read(length) if length else b""
+
+        if function_name == "healthz":
+            return self.send_raw(200, {"Content-Type": "application/json"}, self.server.health().encode())
+        handler = self.server.handlers.get(function_name)
+        if handler is None:
+            return self.send_raw(404, {"Content-Type": "application/json"}, b'{"error":"unknown_function"}')
+
+        try:
+            event = make_event(self.command, dict(self.headers.items()), rest, url.query, body, self.client_address[0])
+            resp = handler(event, Context(function_name))
+        except Exception:
+            print(f"[SERVER ERROR] {self.command} {self.path}\n{traceback.format_exc()}")
+            return self.send_raw(500, {"Content-Type": "application/json"}, b'{"error":"internal_error"}')
+
+        raw = resp.get("body") or ""
+        if resp.get("isBase64Encoded"):
+            raw = base64.b64decode(raw)
+        elif isinstance(raw, str):
+            raw = raw.encode()
+        headers = {"Content-Type": "application/json", **(resp.get("headers") or {})}
+        self.send_raw(resp.get("statusCode", 200), headers, raw)
+        if SERVER_ACCESS_LOG:
+            ms = (time.perf_counter() - started) * 1000
+            print(f"[ACCESS] {self.command} {self.path} {resp.get('statusCode')} {ms:.1f}ms")
+
+    def send_raw(self, status: int, headers: dict, body: bytes):
+        self.send_response(status)
+        for key, value in headers.items():
+            if key.lower() not in ("content-length", "connection"):
+                self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.draining:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class FunctionServer(HTTPServer):
+    """
+    HTTP-сервер с ограниченным пулом потоков: соединение обрабатывается потоком пула,
+    а при переполнении очереди сразу получает 503 вместо неограниченного роста потоков.
+    """
+
+    # Иначе при всплеске подключений ядро отбрасывает рукопожатия, и клиенты ждут повторов SYN секундами
+    request_queue_size = SERVER_BACKLOG
+
+    def __init__(self, address, handlers: dict, workers: int = SERVER_WORKERS, queue: int = SERVER_QUEUE):
+        super().__init__(address, FunctionRequestHandler)
+        self.handlers = handlers
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="worker")
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.draining = False
+        self.rejected = 0
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self.rejected += 1
+            try:
+                request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            finally:
+                self.shutdown_request(request)
+            return
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def health(self) -> str:
+        info = {"functions": sorted(self.handlers), "workers": self.workers, "rejected": self.rejected,
+                "draining": self.draining, **shared_stats()}
+        return json.dumps(info, ensure_ascii=False, default=str)
+
+    def drain(self, timeout: float = SERVER_DRAIN_TIMEOUT):
+        """Дождаться начатых запросов, сбросить присутствие в БД и закрыть пул."""
+        self.draining = True
+        done = threading.Event()
+        threading.Thread(target=lambda: (self.executor.shutdown(wait=True), done.set()), daemon=True).start()
+        if not done.wait(timeout):
+            print(f"[SERVER] drain timeout after {timeout}s, exiting with requests in flight")
+        close_shared_state()
+
+
+def shared_stats() -> dict:
+    """Состояние общих модулей процесса: пул, кэш сессий, присутствие, ограничители, инструментирование."""
+    info = {}
+    for module_name in ("db", "sessions", "presence", "ratelimit", "instrument"):
+        module = sys.modules.get(module_name)
+        if module is None:
+            continue
+        if module_name == "db":
+            if module._pool is not None:
+                info["db_pool"] = module.get_pool().stats()
+            if module._replicas:
+                info["db_replicas"] = module.replica_stats()
+        elif hasattr(module, "stats"):
+            info[module_name] = module.stats()
+    return info
+
+
+def start_shared_state():
+    """Процесс живёт постоянно — присутствие сбрасывает фоновый поток, а не запросы."""
+    presence = sys.modules.get("presence")
+    if presence is not None:
+        presence.start_flusher()
+
+
+def close_shared_state():
+    """Сбросить отметки присутствия в БД и закрыть пулы primary и реплик — последний шаг остановки."""
+    db = sys.modules.get("db")
+    presence = sys.modules.get("presence")
+    if db is not None and db._pool is not None:
+        if presence is not None:
+            conn = db.get_conn()
+            try:
+                print(f"[SERVER] flushed presence for {presence.flush(conn)} users")
+            finally:
+                db.put_conn(conn)
+        db.get_pool().closeall()
+    for replica in (db._replicas if db is not None else None) or ():
+        replica.pool.closeall()
+
+
+def main():
+    names = discover_functions()
+    check_shared_modules(names)
+    handlers = load_functions(names)
+    server = FunctionServer((SERVER_HOST, SERVER_PORT), handlers)
+    start_shared_state()
+
+    def stop(signum, frame):
+        print(f"[SERVER] signal {signum}, shutting down")
+        # shutdown() ждёт выхода из serve_forever — вызывать его из того же потока нельзя
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"[SERVER] listening on {SERVER_HOST}:{SERVER_PORT} workers={SERVER_WORKERS} "
+          f"functions={','.join(names)}")
+    try:
+        server.serve_forever(poll_interval=0.5)
+    finally:
+        server.server_close()
+        server.drain()
+        print("[SERVER] stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+"""
+Пул соединений с БД мессенджера Друг.
+Живёт на уровне модуля и переживает тёплые вызовы функции, поэтому
+TCP+TLS+auth рукопожатие с Postgres делается один раз на контейнер.
+Функции деплоятся независимо, поэтому одинаковая копия файла лежит в каждой.
+
+Настройки (переменные окружения):
+DB_POOL_MIN          — сколько соединений открыть сразу (по умолчанию 1)
+DB_POOL_MAX          — максимум соединений на контейнер (по умолчанию 4). В backend/server.py пул общий
+                       для SERVER_WORKERS потоков: при DB_POOL_MAX меньше SERVER_WORKERS лишние запросы
+                       ждут соединение до DB_POOL_WAIT и получают ошибку. Long-poll /sync соединение
+                       из пула на время ожидания не держит (LISTEN — на отдельном соединении процесса)
+DB_POOL_IDLE_TIMEOUT — через сколько секунд простоя закрывать соединение (300)
+DB_POOL_PING_AFTER   — после скольких секунд простоя проверять соединение SELECT 1 (30)
+DB_POOL_WAIT         — сколько секунд ждать свободного соединения (5)
+
+Реплики (необязательно):
+DATABASE_REPLICA_URLS — DSN реплик через запятую; без них все запросы идут в DATABASE_URL
+DB_REPLICA_PIN        — сколько секунд после своей записи сессия читает с primary (5)
+DB_REPLICA_MAX_LAG    — реплика, отставшая больше стольких секунд, не получает чтения (10)
+DB_REPLICA_LAG_CHECK  — как часто перемерять отставание реплики, в секундах (1)
+
+Подготовленные запросы:
+DB_PREPARED           — 1 (по умолчанию): запросы из реестра (register) готовятся на сервере один раз
+                        на соединение и выполняются по имени; 0 — обычный execute (нужно за pgbouncer
+                        в режиме transaction, где соединение с сервером меняется между транзакциями)
+
+Чтение идёт на реплику, если она уже воспроизвела WAL до последней записи этой сессии
+(LSN записи — из пина процесса или из заголовка X-Min-LSN клиента); иначе — на primary.
+"""
+import itertools
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import psycopg2
+from psycopg2 import extensions
+import instrument
+
+POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.environ.get("DB_POOL_MAX", "4"))
+POOL_IDLE_TIMEOUT = float(os.environ.get("DB_POOL_IDLE_TIMEOUT", "300"))
+POOL_PING_AFTER = float(os.environ.get("DB_POOL_PING_AFTER", "30"))
+POOL_WAIT = float(os.environ.get("DB_POOL_WAIT", "5"))
+
+REPLICA_URLS = [u.strip() for u in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+REPLICA_PIN = float(os.environ.get("DB_REPLICA_PIN", "5"))
+REPLICA_MAX_LAG = float(os.environ.get("DB_REPLICA_MAX_LAG", "10"))
+REPLICA_LAG_CHECK = float(os.environ.get("DB_REPLICA_LAG_CHECK", "1"))
+PREPARED = os.environ.get("DB_PREPARED", "1") == "1"
+
+REPLICA_PINS_MAX = 10000
+REPLICA_STATS_LOG_EVERY = 1000
+
+# Реплика, получившая всё, что прислал primary, не отстаёт, даже если последняя транзакция была давно
+REPLICA_LAG_SQL = """SELECT pg_last_wal_replay_lsn()::text,
+                            CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                                 ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+                            END"""
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class TracingCursor(extensions.cursor):
+    """Курсор, пишущий каждый execute в трассу текущего вызова (только при INSTRUMENT=1)."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            instrument.record(query, (time.perf_counter() - started) * 1000, self.rowcount)
+
+
+class PreparedConnection(extensions.connection):
+    """Соединение пула; помнит, какие запросы реестра уже подготовлены на его сервере."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.deallocate = False  # подготовленное на сервере устарело: сбросить перед следующим PREPARE
+
+
+# Реестр подготавливаемых запросов: текст → Statement. Тексты — константы модулей функций,
+# поэтому вызывающий код и aio/ продолжают работать со строками SQL.
+_statements = {}
+_PARAM = re.compile(r"%s")
+# Подготовленное больше не годится: сменился тип результата после миграции (0A000 cached plan must
+# not change result type), на сервере нет такого имени (26000) или оно уже занято (42P05) —
+# последние два бывают, когда соединение с сервером подменили (DISCARD ALL, балансировщик)
+_REPREPARE_CODES = ("0A000", "26000", "42P05")
+
+
+class Statement:
+    __slots__ = ("name", "sql", "prepare_sql", "execute_sql")
+
+    def __init__(self, name: str, sql: str):
+        counter = itertools.count(1)
+        params = _PARAM.sub(lambda m: f"${next(counter)}", sql)
+        count = next(counter) - 1
+        self.name = name
+        self.sql = sql
+        # Имя в кавычках: session_user и подобные — ключевые слова SQL
+        self.prepare_sql = f'PREPARE "{name}" AS {params}'
+        self.execute_sql = f'EXECUTE "{name}" ({", ".join(["%s"] * count)})' if count else f'EXECUTE "{name}"'
+
+
+def register(name: str, sql: str) -> str:
+    """Добавляет запрос в реестр под именем name; возвращает тот же текст для констант модуля."""
+    _statements[sql] = Statement(name, sql)
+    return sql
+
+
+def _execute_prepared(cur, conn, stmt, args):
+    head = ""
+    if conn.deallocate:
+        head = "DEALLOCATE ALL; "
+    if stmt.name not in conn.prepared:
+        head += stmt.prepare_sql + "; "
+    try:
+        # PREPARE и EXECUTE уходят одним обращением к серверу
+        cur.execute(head + stmt.execute_sql, tuple(args))
+    except psycopg2.Error as e:
+        if head or e.pgcode in _REPREPARE_CODES:
+            # Неизвестно, что из подготовленного осталось на сервере: следующий вызов начнёт с чистого листа
+            conn.prepared.clear()
+            conn.deallocate = True
+        raise
+    conn.deallocate = False
+    conn.prepared.add(stmt.name)
+
+
+def execute(cur, sql: str, args):
+    """
+    cur.execute для запросов реестра: на этом соединении — PREPARE при первом вызове,
+    дальше EXECUTE по имени без повторного разбора и планирования. Текст вне реестра
+    (и DB_PREPARED=0) выполняется как обычно.
+
+    Если подготовленное устарело и запрос первый в транзакции, он сразу повторяется
+    с новым PREPARE; посреди транзакции откатить нельзя — ошибка уходит наверх,
+    а следующий вызов на этом соединении подготовит запросы заново.
+    """
+    stmt = _statements.get(sql)
+    conn = cur.connection
+    if stmt is None or not PREPARED or not isinstance(conn, PreparedConnection):
+        return cur.execute(sql, args)
+    first = conn.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+    try:
+        return _execute_prepared(cur, conn, stmt, args)
+    except psycopg2.Error as e:
+        if e.pgcode not in _REPREPARE_CODES or not first:
+            raise
+        print(f"[DB] re-prepare {stmt.name}: {e.pgcode}")
+        conn.rollback()
+        return _execute_prepared(cur, conn, stmt, args)
+
+
+class ConnectionPool:
+    def __init__(self, dsn: str, minconn: int = POOL_MIN, maxconn: int = POOL_MAX,
+                 idle_timeout: float = POOL_IDLE_TIMEOUT, ping_after: float = POOL_PING_AFTER):
+        self.dsn = dsn
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self._idle = []  # [(conn, время возврата в пул)], последний — самый свежий
+        self._used = set()
+        self._opening = 0
+        self._cond = threading.Condition()
+        for _ in range(self.minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn, connection_factory=PreparedConnection)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, idle_for: float) -> bool:
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if idle_for < self.ping_after:
+            return True
+        # Долго простаивавшее соединение могли закрыть сервер или балансировщик
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _take_idle(self):
+        """Берёт живое соединение из пула, выкидывая протухшие. Вызывать под локом."""
+        now = time.monotonic()
+        while self._idle:
+            conn, returned_at = self._idle.pop()
+            idle_for = now - returned_at
+            if idle_for > self.idle_timeout or not self._healthy(conn, idle_for):
+                self._close(conn)
+                continue
+            return conn
+        return None
+
+    def _prune(self):
+        """Закрывает соединения, простоявшие дольше idle_timeout (сверх minconn)."""
+        now = time.monotonic()
+        fresh = [(c, t) for c, t in self._idle if now - t <= self.idle_timeout]
+        stale = [c for c, t in self._idle if now - t > self.idle_timeout]
+        keep = max(0, self.minconn - len(fresh))
+        for conn in stale[:keep]:
+            fresh.insert(0, (conn, now - self.ping_after))  # проверим перед выдачей
+        for conn in stale[keep:]:
+            self._close(conn)
+        self._idle = fresh
+
+    def getconn(self):
+        deadline = time.monotonic() + POOL_WAIT
+        with self._cond:
+            while True:
+                conn = self._take_idle()
+                if conn is not None:
+                    self._used.add(conn)
+                    return conn
+                if len(self._used) + self._opening < self.maxconn:
+                    self._opening += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted(f"all {self.maxconn} connections are busy")
+                self._cond.wait(remaining)
+
+        # Новое соединение открываем вне лока, чтобы не держать остальные потоки на рукопожатии
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opening -= 1
+            self._used.add(conn)
+        return conn
+
+    def putconn(self, conn):
+        with self._cond:
+            self._used.discard(conn)
+            if not conn.closed:
+                # Сбрасываем незакоммиченное состояние, чтобы следующий вызов начал с чистой транзакции
+                status = conn.get_transaction_status()
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    self._close(conn)
+                else:
+                    if status != extensions.TRANSACTION_STATUS_IDLE:
+                        try:
+                            conn.rollback()
+                        except Exception:
+                            self._close(conn)
+                    if not conn.closed:
+                        self._idle.append((conn, time.monotonic()))
+            self._prune()
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close(conn)
+            for conn in self._used:
+                self._close(conn)
+            self._idle = []
+            self._used = set()
+
+    def owns(self, conn) -> bool:
+        with self._cond:
+            return conn in self._used
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"idle": len(self._idle), "used": len(self._used), "max": self.maxconn}
+
+
+def parse_lsn(lsn) -> int:
+    """'16/B374D848' → число; пустое или битое значение — 0."""
+    try:
+        hi, lo = str(lsn).split("/")
+        return (int(hi, 16) << 32) | int(lo, 16)
+    except (TypeError, ValueError):
+        return 0
+
+
+class Replica:
+    """Пул соединений реплики и последний замер её отставания."""
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.pool = ConnectionPool(dsn, minconn=0)
+        self.replay_lsn = 0
+        self.lag_seconds = None
+        self.checked_at = 0.0
+        self.reads = 0
+        self.fallbacks = 0
+        self.errors = 0
+
+    def measure(self, conn):
+        cur = conn.cursor()
+        cur.execute(REPLICA_LAG_SQL)
+        lsn, lag = cur.fetchone()
+        conn.rollback()
+        self.replay_lsn = parse_lsn(lsn)
+        self.lag_seconds = float(lag)
+        self.checked_at = time.monotonic()
+
+    def usable(self) -> bool:
+        return self.lag_seconds is None or self.lag_seconds <= REPLICA_MAX_LAG
+
+    def stats(self) -> dict:
+        return {
+            "lag_seconds": None if self.lag_seconds is None else round(self.lag_seconds, 3),
+            "replay_lsn": self.replay_lsn,
+            "reads": self.reads,
+            "fallbacks": self.fallbacks,
+            "errors": self.errors,
+            **self.pool.stats(),
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ["DATABASE_URL"])
+    return _pool
+
+
+_replicas = None
+_replica_lock = threading.Lock()
+_replica_turn = 0
+_pins = OrderedDict()  # ключ сессии -> (LSN записи, до какого time.monotonic() читать с primary)
+_pin_lock = threading.Lock()
+_read_calls = 0
+
+
+def get_replicas() -> list:
+    global _replicas
+    if _replicas is None:
+        with _replica_lock:
+            if _replicas is None:
+                _replicas = [Replica(dsn) for dsn in REPLICA_URLS]
+    return _replicas
+
+
+def pin(key, lsn: int):
+    """После записи сессия key читает с primary, пока реплика не воспроизведёт lsn (но не дольше REPLICA_PIN)."""
+    if not key:
+        return
+    with _pin_lock:
+        _pins[key] = (lsn, time.monotonic() + REPLICA_PIN)
+        _pins.move_to_end(key)
+        while len(_pins) > REPLICA_PINS_MAX:
+            _pins.popitem(last=False)
+
+
+def required_lsn(key, min_lsn=None) -> int:
+    """LSN, который реплика должна воспроизвести для этой сессии: из пина процесса или от клиента."""
+    needed = parse_lsn(min_lsn) if min_lsn else 0
+    if key:
+        with _pin_lock:
+            item = _pins.get(key)
+            if item is not None:
+                if item[1] <= time.monotonic():
+                    del _pins[key]
+                else:
+                    needed = max(needed, item[0])
+    return needed
+
+
+def record_write(key, conn) -> str:
+    """
+    Вызывать после коммита записи на primary: запоминает текущий LSN как пин сессии.
+    Возвращает LSN для заголовка X-Write-LSN (клиент вернёт его в X-Min-LSN). Без реплик — None.
+    """
+    if not REPLICA_URLS:
+        return None
+    cur = conn.cursor()
+    cur.execute("SELECT pg_current_wal_lsn()::text")
+    lsn = cur.fetchone()[0]
+    conn.rollback()
+    pin(key, parse_lsn(lsn))
+    return lsn
+
+
+def get_read_conn(key=None, min_lsn=None):
+    """
+    Соединение для чтения: реплика по кругу, если она догнала записи этой сессии и не отстаёт
+    больше REPLICA_MAX_LAG; иначе (и без реплик) — primary. Возвращать через put_conn.
+    """
+    global _replica_turn, _read_calls
+    # Отставшую реплику тоже перемеряем раз в REPLICA_LAG_CHECK — так она вернётся, когда догонит
+    now = time.monotonic()
+    replicas = [r for r in get_replicas() if r.usable() or now - r.checked_at >= REPLICA_LAG_CHECK]
+    if not replicas:
+        return get_conn()
+    needed = required_lsn(key, min_lsn)
+    with _replica_lock:
+        _replica_turn += 1
+        _read_calls += 1
+        replica = replicas[_replica_turn % len(replicas)]
+        log = _read_calls % REPLICA_STATS_LOG_EVERY == 0
+    if log:
+        print(f"[REPLICA] {replica_stats()}")
+
+    try:
+        conn = replica.pool.getconn()
+    except Exception:
+        replica.errors += 1
+        replica.fallbacks += 1
+        return get_conn()
+    try:
+        stale = time.monotonic() - replica.checked_at >= REPLICA_LAG_CHECK
+        if stale or (needed and replica.replay_lsn < needed):
+            replica.measure(conn)
+    except Exception:
+        replica.errors += 1
+        replica.pool.putconn(conn)
+        replica.fallbacks += 1
+        return get_conn()
+    if not replica.usable() or replica.replay_lsn < needed:
+        replica.pool.putconn(conn)
+        replica.fallbacks += 1
+        return get_conn()
+    replica.reads += 1
+    if instrument.ENABLED:
+        conn.cursor_factory = TracingCursor
+    return conn
+
+
+def is_replica(conn) -> bool:
+    return any(r.pool.owns(conn) for r in _replicas or ())
+
+
+def replica_stats() -> dict:
+    """Отставание и счётчики по каждой реплике — метрика для /healthz и логов."""
+    return {r.dsn.rsplit("@", 1)[-1]: r.stats() for r in _replicas or ()}
+
+
+def get_conn():
+    if not instrument.ENABLED:
+        return get_pool().getconn()
+    started = time.perf_counter()
+    conn = get_pool().getconn()
+    instrument.phase("conn", (time.perf_counter() - started) * 1000)
+    conn.cursor_factory = TracingCursor
+    return conn
+
+
+def put_conn(conn):
+    for replica in _replicas or ():
+        if replica.pool.owns(conn):
+            replica.pool.putconn(conn)
+            return
+    get_pool().putconn(conn)
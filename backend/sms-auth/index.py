@@ -1,27 +1,19 @@
 """
 СМС-авторизация мессенджера Друг.
-POST /send   — отправить код на телефон (login или register)
+POST /send   — отправить код на телефон (login или register): код ставится в sms_outbox,
+               саму отправку делает диспетчер backend/maintenance (dispatch_sms)
 POST /verify — проверить код и войти / завершить регистрацию
 GET  /       — проверить текущую сессию по X-Session-Id
 """
-import json
-import os
 import random
 import secrets
 import re
-import urllib.request
-import urllib.parse
-import psycopg2
+import core
+import db
+import ratelimit
+import sessions
 
-CORS = {
-    "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-    "Access-Control-Allow-Headers": "Content-Type, X-Session-Id",
-}
-
-
-def get_conn():
-    return psycopg2.connect(os.environ["DATABASE_URL"])
+app = core.App("GET, POST, OPTIONS", expose_headers="Retry-After")
 
 
 def normalize_phone(raw: str) -> str:
@@ -33,50 +25,6 @@ def normalize_phone(raw: str) -> str:
     return "+" + digits
 
 
-def send_sms(phone: str, code: str) -> bool:
-    login = os.environ.get("SMSC_LOGIN", "")
-    password = os.environ.get("SMSC_PASSWORD", "")
-    if not login or not password:
-        print(f"[DEV] SMS to {phone}: code={code} (SMSC credentials not set)")
-        return True
-    message = f"Ваш код Друг: {code}"
-    params = urllib.parse.urlencode({
-        "login": login,
-        "psw": password,
-        "phones": phone,
-        "mes": message,
-        "sender": "ddmaxisrs",
-        "fmt": 3,
-        "charset": "utf-8",
-    })
-    url = f"https://smsc.ru/sys/send.php?{params}"
-    try:
-        with urllib.request.urlopen(url, timeout=10) as r:
-            raw = r.read().decode()
-            resp = json.loads(raw)
-            print(f"[SMS] phone={phone} smsc_response={resp}")
-            if "error" in resp:
-                print(f"[SMS ERROR] code={resp.get('error_code')} msg={resp.get('error')}")
-                return False
-            return True
-    except Exception as e:
-        print(f"[SMS EXCEPTION] {e}")
-        return False
-
-
-def get_user_by_session(cur, token):
-    if not token:
-        return None
-    cur.execute(
-        """SELECT u.id, u.username, u.display_name, u.position,
-                  u.department, u.phone, u.avatar_initials, u.online
-           FROM sessions s JOIN users u ON u.id = s.user_id
-           WHERE s.token = %s AND s.expires_at > NOW()""",
-        (token,)
-    )
-    return cur.fetchone()
-
-
 def make_initials(name: str) -> str:
     parts = name.strip().split()
     if len(parts) >= 2:
@@ -84,155 +32,148 @@ def make_initials(name: str) -> str:
     return name[:2].upper() if name else "??"
 
 
-def handler(event: dict, context) -> dict:
-    if event.get("httpMethod") == "OPTIONS":
-        return {"statusCode": 200, "headers": CORS, "body": ""}
-
-    method = event.get("httpMethod", "GET")
-    path = event.get("path", "/")
-    headers = event.get("headers") or {}
-    session_id = headers.get("x-session-id") or headers.get("X-Session-Id")
-
-    # GET — проверка сессии
-    if method == "GET":
-        if not session_id:
-            return {"statusCode": 401, "headers": CORS, "body": json.dumps({"error": "no_session"})}
-        conn = get_conn()
-        try:
-            cur = conn.cursor()
-            row = get_user_by_session(cur, session_id)
-            if not row:
-                return {"statusCode": 401, "headers": CORS, "body": json.dumps({"error": "invalid_session"})}
-            user = {
-                "id": row[0], "username": row[1], "display_name": row[2],
-                "position": row[3], "department": row[4], "phone": row[5],
-                "avatar_initials": row[6], "online": row[7],
-            }
-            return {"statusCode": 200, "headers": CORS, "body": json.dumps({"user": user})}
-        finally:
-            conn.close()
-
-    if method != "POST":
-        return {"statusCode": 405, "headers": CORS, "body": json.dumps({"error": "method_not_allowed"})}
-
-    body = json.loads(event.get("body") or "{}")
-    action = body.get("action", "")
-
-    # POST /send — отправить СМС-код
-    if action == "send":
-        raw_phone = body.get("phone", "").strip()
-        if not raw_phone:
-            return {"statusCode": 400, "headers": CORS, "body": json.dumps({"error": "phone_required"})}
-
-        phone = normalize_phone(raw_phone)
-        if len(re.sub(r"\D", "", phone)) < 11:
-            return {"statusCode": 400, "headers": CORS, "body": json.dumps({"error": "invalid_phone"})}
-
-        conn = get_conn()
-        try:
-            cur = conn.cursor()
-
-            # Антиспам: не чаще 1 раза в 60 секунд
-            cur.execute(
-                "SELECT COUNT(*) FROM sms_codes WHERE phone = %s AND created_at > NOW() - INTERVAL '60 seconds'",
-                (phone,)
-            )
-            if cur.fetchone()[0] > 0:
-                return {"statusCode": 429, "headers": CORS, "body": json.dumps({"error": "too_many_requests", "message": "Подождите 60 секунд перед повторной отправкой"})}
+# GET — проверка сессии
+@app.route("GET")
+@sessions.authenticated(missing_error="no_session", invalid_error="invalid_session", read_only=True)
+def check_session(req, conn, cur, user):
+    return core.json_response(200, {"user": user})
 
-            # Проверяем — пользователь существует?
-            cur.execute("SELECT id FROM users WHERE phone = %s", (phone,))
-            existing = cur.fetchone()
-            purpose = "login" if existing else "register"
 
-            code = str(random.randint(100000, 999999))
-            cur.execute(
-                "INSERT INTO sms_codes (phone, code, purpose, expires_at) VALUES (%s, %s, %s, NOW() + INTERVAL '10 minutes')",
-                (phone, code, purpose)
-            )
-            conn.commit()
-
-            ok = send_sms(phone, code)
-            if not ok:
-                return {"statusCode": 500, "headers": CORS, "body": json.dumps({"error": "sms_failed", "message": "Не удалось отправить СМС"})}
-
-            return {"statusCode": 200, "headers": CORS, "body": json.dumps({
-                "purpose": purpose,
-                "phone": phone,
-                "message": f"Код отправлен на {phone}"
-            })}
-        finally:
-            conn.close()
-
-    # POST /verify — проверить код
-    if action == "verify":
-        phone = normalize_phone(body.get("phone", "").strip())
-        code = body.get("code", "").strip()
-        display_name = body.get("display_name", "").strip()
-
-        if not phone or not code:
-            return {"statusCode": 400, "headers": CORS, "body": json.dumps({"error": "phone_and_code_required"})}
-
-        conn = get_conn()
-        try:
-            cur = conn.cursor()
-
-            # Найти активный код
+# POST /send — отправить СМС-код
+def send_code(req, body: dict) -> dict:
+    raw_phone = body.get("phone", "").strip()
+    if not raw_phone:
+        return core.error(400, "phone_required")
+
+    phone = normalize_phone(raw_phone)
+    if len(re.sub(r"\D", "", phone)) < 11:
+        return core.error(400, "invalid_phone")
+
+    # Антиспам: не чаще 1 раза в 60 секунд на номер — до соединения с БД
+    limits = [("sms_send_phone", phone), ("sms_send_ip", req.client_ip)]
+    retry_after = ratelimit.check(limits)
+    if retry_after:
+        return ratelimit.rejected(retry_after, "Подождите 60 секунд перед повторной отправкой")
+
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        retry_after = ratelimit.check_shared(conn, cur, limits)
+        if retry_after:
+            return ratelimit.rejected(retry_after, "Подождите 60 секунд перед повторной отправкой")
+
+        # Проверяем — пользователь существует?
+        cur.execute("SELECT id FROM users WHERE phone = %s", (phone,))
+        existing = cur.fetchone()
+        purpose = "login" if existing else "register"
+
+        code = str(random.randint(100000, 999999))
+        cur.execute(
+            "INSERT INTO sms_codes (phone, code, purpose, expires_at) VALUES (%s, %s, %s, NOW() + INTERVAL '10 minutes')",
+            (phone, code, purpose)
+        )
+        # Провайдер не вызывается в запросе: медленный smsc.ru не держит ни ответ, ни соединение с БД
+        cur.execute(
+            "INSERT INTO sms_outbox (phone, message, expires_at) VALUES (%s, %s, NOW() + INTERVAL '10 minutes')",
+            (phone, f"Ваш код Друг: {code}")
+        )
+        cur.execute("NOTIFY sms_outbox")
+        conn.commit()
+
+        return core.json_response(200, {
+            "purpose": purpose,
+            "phone": phone,
+            "message": f"Код отправлен на {phone}"
+        })
+    finally:
+        db.put_conn(conn)
+
+
+# POST /verify — проверить код
+def verify_code(req, body: dict) -> dict:
+    phone = normalize_phone(body.get("phone", "").strip())
+    code = body.get("code", "").strip()
+    display_name = body.get("display_name", "").strip()
+
+    if not phone or not code:
+        return core.error(400, "phone_and_code_required")
+
+    # Перебор кодов: ограничение попыток на номер и на IP
+    limits = [("sms_verify_phone", phone), ("sms_verify_ip", req.client_ip)]
+    retry_after = ratelimit.check(limits)
+    if retry_after:
+        return ratelimit.rejected(retry_after, "Слишком много попыток, попробуйте позже")
+
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        retry_after = ratelimit.check_shared(conn, cur, limits)
+        if retry_after:
+            return ratelimit.rejected(retry_after, "Слишком много попыток, попробуйте позже")
+
+        # Найти активный код; условие по created_at отсекает все секции, кроме последних
+        cur.execute(
+            """SELECT id, purpose, created_at FROM sms_codes
+               WHERE phone = %s AND code = %s AND used = false AND expires_at > NOW()
+                 AND created_at > NOW() - INTERVAL '10 minutes'
+               ORDER BY created_at DESC LIMIT 1""",
+            (phone, code)
+        )
+        code_row = cur.fetchone()
+        if not code_row:
+            return core.error(401, "invalid_code", "Неверный или устаревший код")
+
+        code_id, purpose = code_row[0], code_row[1]
+
+        # Отметить код использованным (ключ секционированной таблицы — id + created_at)
+        cur.execute("UPDATE sms_codes SET used = true WHERE id = %s AND created_at = %s", (code_id, code_row[2]))
+
+        # Найти или создать пользователя
+        cur.execute("SELECT id FROM users WHERE phone = %s", (phone,))
+        existing = cur.fetchone()
+
+        if existing:
             cur.execute(
-                """SELECT id, purpose FROM sms_codes
-                   WHERE phone = %s AND code = %s AND used = false AND expires_at > NOW()
-                   ORDER BY created_at DESC LIMIT 1""",
-                (phone, code)
+                f"UPDATE users SET last_seen = NOW() WHERE id = %s RETURNING {sessions.USER_COLUMNS}",
+                (existing[0],)
             )
-            code_row = cur.fetchone()
-            if not code_row:
-                return {"statusCode": 401, "headers": CORS, "body": json.dumps({"error": "invalid_code", "message": "Неверный или устаревший код"})}
-
-            code_id, purpose = code_row[0], code_row[1]
-
-            # Отметить код использованным
-            cur.execute("UPDATE sms_codes SET used = true WHERE id = %s", (code_id,))
-
-            # Найти или создать пользователя
-            cur.execute("SELECT id FROM users WHERE phone = %s", (phone,))
-            existing = cur.fetchone()
-
-            if existing:
-                user_id = existing[0]
-                cur.execute("UPDATE users SET online = true, last_seen = NOW() WHERE id = %s", (user_id,))
-            else:
-                # Новый пользователь
-                if not display_name:
-                    return {"statusCode": 400, "headers": CORS, "body": json.dumps({"error": "display_name_required"})}
-                initials = make_initials(display_name)
-                username = re.sub(r"\D", "", phone)[-10:]
-                cur.execute(
-                    """INSERT INTO users (username, display_name, password_hash, phone, avatar_initials, online, phone_verified)
-                       VALUES (%s, %s, %s, %s, %s, true, true) RETURNING id""",
-                    (username, display_name, secrets.token_hex(16), phone, initials)
-                )
-                user_id = cur.fetchone()[0]
-
-            # Создать сессию
-            token = secrets.token_hex(32)
+        else:
+            # Новый пользователь
+            if not display_name:
+                return core.error(400, "display_name_required")
+            initials = make_initials(display_name)
+            username = re.sub(r"\D", "", phone)[-10:]
             cur.execute(
-                "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL '30 days')",
-                (user_id, token)
+                f"""INSERT INTO users (username, display_name, password_hash, phone, avatar_initials, phone_verified)
+                    VALUES (%s, %s, %s, %s, %s, true) RETURNING {sessions.USER_COLUMNS}""",
+                (username, display_name, secrets.token_hex(16), phone, initials)
             )
-            conn.commit()
+        user = sessions.user_from_row(cur.fetchone())
 
-            cur.execute(
-                "SELECT id, username, display_name, position, department, phone, avatar_initials, online FROM users WHERE id = %s",
-                (user_id,)
-            )
-            u = cur.fetchone()
-            user = {
-                "id": u[0], "username": u[1], "display_name": u[2],
-                "position": u[3], "department": u[4], "phone": u[5],
-                "avatar_initials": u[6], "online": u[7],
-            }
-            return {"statusCode": 200, "headers": CORS, "body": json.dumps({"token": token, "user": user, "is_new": not existing})}
-        finally:
-            conn.close()
-
-    return {"statusCode": 400, "headers": CORS, "body": json.dumps({"error": "unknown_action"})}
\ No newline at end of file
+        # Создать сессию
+        token = secrets.token_hex(32)
+        cur.execute(
+            "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL '30 days')",
+            (user["id"], token)
+        )
+        conn.commit()
+        return sessions.pin_writes(core.json_response(200, {"token": token, "user": user, "is_new": not existing}),
+                                   token, conn)
+    finally:
+        db.put_conn(conn)
+
+
+ACTIONS = {"send": send_code, "verify": verify_code}
+
+
+@app.route("POST")
+def post_action(req):
+    body = req.json()
+    action = ACTIONS.get(body.get("action", ""))
+    if not action:
+        return core.error(400, "unknown_action")
+    return action(req, body)
+
+
+def handler(event: dict, context) -> dict:
+    return app(event, context)
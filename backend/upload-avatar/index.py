@@ -1,97 +1,268 @@
 """
 Загрузка аватара пользователя.
-POST / — загрузить изображение (base64 в JSON), сохранить в S3, обновить avatar_url.
+POST / — загрузить изображение: сырое тело с Content-Type image/* или base64 в JSON.
+Сохраняет оригинал и WebP-миниатюры в S3 по хэшу содержимого, обновляет avatar_url.
+POST /presign — выдать presigned POST для загрузки напрямую в бакет
+POST /finalize — проверить загруженный объект, построить миниатюры и обновить avatar_url
 """
-import json
+import hashlib
+import io
 import os
-import base64
+import re
 import uuid
-import psycopg2
+import base64
+import binascii
+import threading
+import core
+import db
+import sessions
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from PIL import Image, ImageOps, UnidentifiedImageError
 
 
-CORS = {
-    "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Methods": "POST, OPTIONS",
-    "Access-Control-Allow-Headers": "Content-Type, X-Session-Id",
-}
+app = core.App("POST, OPTIONS")
 
 ALLOWED_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif"}
 MAX_SIZE_BYTES = 5 * 1024 * 1024  # 5 MB
+THUMB_SIZES = (256, 128, 64)  # от большего к меньшему: каждая уменьшается из предыдущей
+LIST_THUMB_SIZE = 128
+# Сколько пикселей готовы развернуть в память (после draft): 5 МБ PNG/WebP может описывать
+# картинку в сотни мегапикселей, а растр RGBA — по 4 байта на пиксель
+MAX_DECODE_PIXELS = 25_000_000
+
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "https://bucket.poehali.dev")
+S3_BUCKET = os.environ.get("S3_BUCKET", "files")
+PRESIGN_TTL = int(os.environ.get("AVATAR_PRESIGN_TTL", "600"))
 
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
 
-def get_conn():
-    return psycopg2.connect(os.environ["DATABASE_URL"])
+_s3 = None
+_s3_lock = threading.Lock()
 
 
 def get_s3():
-    return boto3.client(
-        "s3",
-        endpoint_url="https://bucket.poehali.dev",
-        aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
-        aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
+    """Клиент создаётся один раз на процесс: сборка boto3.client и загрузка моделей botocore — десятки мс."""
+    global _s3
+    if _s3 is None:
+        with _s3_lock:
+            if _s3 is None:
+                _s3 = boto3.client(
+                    "s3",
+                    endpoint_url=S3_ENDPOINT_URL,
+                    aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
+                    aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
+                    config=Config(signature_version="s3v4", retries={"max_attempts": 3}),
+                )
+    return _s3
+
+
+def cdn_url(key: str) -> str:
+    base = os.environ.get("S3_CDN_BASE") or f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket"
+    return f"{base}/{key}"
+
+
+def object_exists(s3, key: str) -> bool:
+    try:
+        s3.head_object(Bucket=S3_BUCKET, Key=key)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+def make_thumbnails(image_data: bytes) -> dict:
+    """Один проход декодирования: квадратная обрезка и каскад уменьшений в WebP."""
+    img = Image.open(io.BytesIO(image_data))
+    # JPEG можно декодировать сразу в уменьшенном масштабе — не разворачиваем полный растр
+    img.draft("RGB", (THUMB_SIZES[0] * 2, THUMB_SIZES[0] * 2))
+    # draft уменьшает только JPEG; PNG/WebP/GIF декодируются в полном размере — проверяем до convert
+    if img.size[0] * img.size[1] > MAX_DECODE_PIXELS:
+        raise core.HttpError(400, "image_too_large", "Слишком большое разрешение изображения")
+    img = ImageOps.exif_transpose(img)
+    img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+    current = ImageOps.fit(img, (THUMB_SIZES[0], THUMB_SIZES[0]), Image.LANCZOS)
+    thumbs = {}
+    for size in THUMB_SIZES:
+        if current.size[0] != size:
+            current = current.resize((size, size), Image.LANCZOS)
+        out = io.BytesIO()
+        current.save(out, "WEBP", quality=82, method=4)
+        thumbs[size] = out.getvalue()
+    return thumbs
+
+
+def store_avatar(image_data: bytes, content_type: str) -> dict:
+    """
+    Кладёт оригинал и миниатюры под avatars/<sha256>/…; повторная загрузка
+    того же файла ничего не пишет. Возвращает {"original": url, 256: url, …}.
+    """
+    digest = hashlib.sha256(image_data).hexdigest()
+    ext = EXTENSIONS[content_type]
+    prefix = f"avatars/{digest}"
+    keys = {"original": f"{prefix}/orig.{ext}"}
+    keys.update({size: f"{prefix}/{size}.webp" for size in THUMB_SIZES})
+
+    s3 = get_s3()
+    # Последней пишется самая маленькая миниатюра — её наличие значит, что набор полный
+    if not object_exists(s3, keys[THUMB_SIZES[-1]]):
+        thumbs = make_thumbnails(image_data)
+        s3.upload_fileobj(io.BytesIO(image_data), S3_BUCKET, keys["original"],
+                          ExtraArgs={"ContentType": content_type, "CacheControl": "public, max-age=31536000, immutable"})
+        for size in THUMB_SIZES:
+            s3.put_object(Bucket=S3_BUCKET, Key=keys[size], Body=thumbs[size], ContentType="image/webp",
+                          CacheControl="public, max-age=31536000, immutable")
+    return {name: cdn_url(key) for name, key in keys.items()}
+
+
+def upload_key_pattern(user_id: int):
+    return re.compile(rf"avatars/{user_id}/[0-9a-f]{{32}}\.(jpg|png|webp|gif)")
+
+
+def set_avatar(conn, cur, user_id: int, avatar_url: str, thumb_url: str) -> dict:
+    cur.execute(
+        f"UPDATE users SET avatar_url = %s, avatar_thumb_url = %s WHERE id = %s RETURNING {sessions.USER_COLUMNS}",
+        (avatar_url, thumb_url, user_id)
     )
+    user = sessions.user_from_row(cur.fetchone())
+    conn.commit()
+    sessions.forget_user(user_id)
+    return user
 
 
-def handler(event: dict, context) -> dict:
-    if event.get("httpMethod") == "OPTIONS":
-        return {"statusCode": 200, "headers": CORS, "body": ""}
+def session_user_or_none(token: str):
+    """Проверка сессии на коротком соединении: S3 и Pillow работают уже без него."""
+    if not token:
+        return None
+    conn = db.get_conn()
+    try:
+        return sessions.get_user_by_session(conn.cursor(), token)
+    finally:
+        db.put_conn(conn)
 
-    if event.get("httpMethod") != "POST":
-        return {"statusCode": 405, "headers": CORS, "body": json.dumps({"error": "method_not_allowed"})}
 
-    headers = event.get("headers") or {}
-    session_token = headers.get("x-session-id") or headers.get("X-Session-Id")
-    if not session_token:
-        return {"statusCode": 401, "headers": CORS, "body": json.dumps({"error": "unauthorized"})}
+def avatar_response(token: str, user_id: int, urls: dict) -> dict:
+    """UPDATE аватара на primary; сессия закрепляется за ним (X-Write-LSN), чтобы чтения видели новый аватар."""
+    conn = db.get_conn()
+    try:
+        user = set_avatar(conn, conn.cursor(), user_id, urls["original"], urls[LIST_THUMB_SIZE])
+        resp = core.json_response(200, {
+            "user": user,
+            "avatar_url": urls["original"],
+            "thumbnails": {str(size): urls[size] for size in THUMB_SIZES},
+        })
+        return sessions.pin_writes(resp, token, conn)
+    finally:
+        db.put_conn(conn)
+
+
+# POST /presign — политика presigned POST ограничивает тип и размер на стороне бакета,
+# сами байты в функцию не попадают
+@app.route("POST", "presign")
+@sessions.authenticated
+def presign_upload(req, conn, cur, user):
+    content_type = req.json().get("content_type", "image/jpeg")
+    if content_type not in ALLOWED_TYPES:
+        return core.error(400, "invalid_type", "Допустимы jpeg, png, webp, gif")
+
+    key = f"avatars/{user['id']}/{uuid.uuid4().hex}.{EXTENSIONS[content_type]}"
+    upload = get_s3().generate_presigned_post(
+        Bucket=S3_BUCKET,
+        Key=key,
+        Fields={"Content-Type": content_type},
+        Conditions=[
+            {"Content-Type": content_type},
+            ["content-length-range", 1, MAX_SIZE_BYTES],
+        ],
+        ExpiresIn=PRESIGN_TTL,
+    )
+    return core.json_response(200, {"key": key, "upload": upload, "expires_in": PRESIGN_TTL})
+
+
+# POST /finalize — сначала HEAD (размер и тип), затем объект скачивается один раз
+# и раскладывается как при обычной загрузке: оригинал и WebP-миниатюры по хэшу содержимого
+@app.route("POST", "finalize")
+def finalize_upload(req):
+    session_user = session_user_or_none(req.session_token)
+    if not session_user:
+        return core.error(401, "unauthorized")
+
+    key = req.json().get("key") or ""
+    if not upload_key_pattern(session_user["id"]).fullmatch(key):
+        return core.error(400, "invalid_key")
+
+    s3 = get_s3()
+    try:
+        meta = s3.head_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return core.error(404, "upload_not_found")
+        raise
 
-    body = json.loads(event.get("body") or "{}")
-    image_b64 = body.get("image")
-    content_type = body.get("content_type", "image/jpeg")
+    content_type = (meta.get("ContentType") or "").lower()
+    size = meta.get("ContentLength") or 0
+    if content_type not in ALLOWED_TYPES or EXTENSIONS[content_type] != key.rsplit(".", 1)[1]:
+        s3.delete_object(Bucket=S3_BUCKET, Key=key)
+        return core.error(400, "invalid_type", "Допустимы jpeg, png, webp, gif")
+    if not 0 < size <= MAX_SIZE_BYTES:
+        s3.delete_object(Bucket=S3_BUCKET, Key=key)
+        return core.error(400, "too_large", "Файл не должен превышать 5 МБ")
 
-    if not image_b64:
-        return {"statusCode": 400, "headers": CORS, "body": json.dumps({"error": "image_required"})}
+    image_data = s3.get_object(Bucket=S3_BUCKET, Key=key)["Body"].read(MAX_SIZE_BYTES + 1)
+    try:
+        urls = store_avatar(image_data, content_type)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        s3.delete_object(Bucket=S3_BUCKET, Key=key)
+        return core.error(400, "invalid_image")
+    # Временный ключ больше не нужен: оригинал лежит под avatars/<sha256>/
+    s3.delete_object(Bucket=S3_BUCKET, Key=key)
+
+    return avatar_response(req.session_token, session_user["id"], urls)
+
+
+@app.route("POST")
+def upload_avatar(req):
+    session_token = req.session_token
+    if not session_token:
+        return core.error(401, "unauthorized")
+
+    request_type = (req.headers.get("content-type") or "").split(";")[0].strip().lower()
+    if request_type.startswith("image/"):
+        # Сырое тело: без JSON-обёртки и лишней base64-копии в body
+        content_type = request_type
+        image_data = req.raw_body()
+        if not image_data:
+            return core.error(400, "image_required")
+    else:
+        body = req.json()
+        image_b64 = body.get("image")
+        content_type = body.get("content_type", "image/jpeg")
+        if not image_b64:
+            return core.error(400, "image_required")
+        try:
+            image_data = base64.b64decode(image_b64)
+        except (binascii.Error, ValueError):
+            return core.error(400, "invalid_image")
 
     if content_type not in ALLOWED_TYPES:
-        return {"statusCode": 400, "headers": CORS, "body": json.dumps({"error": "invalid_type", "message": "Допустимы jpeg, png, webp, gif"})}
+        return core.error(400, "invalid_type", "Допустимы jpeg, png, webp, gif")
 
-    image_data = base64.b64decode(image_b64)
     if len(image_data) > MAX_SIZE_BYTES:
-        return {"statusCode": 400, "headers": CORS, "body": json.dumps({"error": "too_large", "message": "Файл не должен превышать 5 МБ"})}
+        return core.error(400, "too_large", "Файл не должен превышать 5 МБ")
 
-    conn = get_conn()
+    session_user = session_user_or_none(session_token)
+    if not session_user:
+        return core.error(401, "invalid_session")
+
+    # Миниатюры и запись в S3 — без соединения из пула: оно нужно только для UPDATE
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT user_id FROM sessions WHERE token = %s AND expires_at > NOW()",
-            (session_token,)
-        )
-        row = cur.fetchone()
-        if not row:
-            return {"statusCode": 401, "headers": CORS, "body": json.dumps({"error": "invalid_session"})}
-
-        user_id = row[0]
-
-        ext = content_type.split("/")[-1].replace("jpeg", "jpg")
-        key = f"avatars/{user_id}/{uuid.uuid4().hex}.{ext}"
-
-        s3 = get_s3()
-        s3.put_object(Bucket="files", Key=key, Body=image_data, ContentType=content_type)
-
-        cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
-
-        cur.execute(
-            "UPDATE users SET avatar_url = %s WHERE id = %s RETURNING id, username, display_name, position, department, phone, avatar_initials, online, avatar_url",
-            (cdn_url, user_id)
-        )
-        u = cur.fetchone()
-        conn.commit()
-
-        user = {
-            "id": u[0], "username": u[1], "display_name": u[2],
-            "position": u[3], "department": u[4], "phone": u[5],
-            "avatar_initials": u[6], "online": u[7], "avatar_url": u[8],
-        }
-        return {"statusCode": 200, "headers": CORS, "body": json.dumps({"user": user, "avatar_url": cdn_url})}
-    finally:
-        conn.close()
+        urls = store_avatar(image_data, content_type)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return core.error(400, "invalid_image")
+    return avatar_response(req.session_token, session_user["id"], urls)
+
+
+def handler(event: dict, context) -> dict:
+    return app(event, context)
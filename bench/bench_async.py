@@ -0,0 +1,237 @@
+"""
+Синхронный backend/server.py против асинхронного backend/aio/server.py при 1000+
+одновременных keep-alive клиентов на горячих эндпоинтах (страница сообщений, список
+чатов, отправка).
+
+Оба сервера запускаются подпроцессами на одних данных (bench/loadtest.py: схема
+и синтетика). Синхронному нужен поток на каждое открытое соединение, поэтому
+SERVER_WORKERS = число клиентов; соединений с БД у обоих одинаково (--db-conns).
+Клиент — asyncio, по одному постоянному соединению на виртуального пользователя.
+
+По каждому серверу: rps, p50/p99, ошибки (не 200, включая 503), RSS процесса
+в простое и под нагрузкой, потоки и прирост памяти на одно клиентское соединение.
+
+Запуск:
+DATABASE_URL=postgres://... python bench/bench_async.py --clients 1000 --duration 20
+DATABASE_URL=postgres://... python bench/bench_async.py --skip-setup --clients 2000 --mix read
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import BACKEND_DIR, load_handler, summarize  # noqa: E402
+from datagen import Config, generate  # noqa: E402
+from loadtest import Traffic, load_dataset  # noqa: E402
+from schema import apply_migrations, use_schema_env  # noqa: E402
+
+MIXES = {
+    "read": {"messages.page": 60, "chats.list": 40},
+    "mixed": {"messages.page": 50, "chats.list": 30, "messages.send": 20},
+}
+
+SERVERS = {
+    "sync": [sys.executable, os.path.join(BACKEND_DIR, "server.py")],
+    "async": [sys.executable, "-m", "aio.server"],
+}
+
+
+def proc_status(pid: int) -> dict:
+    """VmRSS (КБ) и число потоков процесса из /proc."""
+    info = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "Threads"):
+                info[key] = int(value.split()[0])
+    return info
+
+
+def start_server(kind: str, port: int, clients: int, db_conns: int) -> subprocess.Popen:
+    env = dict(os.environ, SERVER_HOST="127.0.0.1", SERVER_PORT=str(port), SERVER_BACKLOG=str(max(clients, 128)),
+               SERVER_FUNCTIONS="auth,chats,messages", SERVER_KEEPALIVE="60")
+    if kind == "sync":
+        env.update(SERVER_WORKERS=str(clients), SERVER_QUEUE="0",
+                   DB_POOL_MAX=str(db_conns), DB_POOL_WAIT="30")
+    else:
+        env.update(SERVER_WORKERS="4", AIO_POOL_MIN=str(db_conns), AIO_POOL_MAX=str(db_conns), AIO_POOL_WAIT="30")
+    proc = subprocess.Popen(SERVERS[kind], cwd=BACKEND_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1):
+                return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise SystemExit(f"{kind} server exited with {proc.returncode}")
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit(f"{kind} server did not start")
+
+
+def encode_request(function_name: str, event: dict) -> bytes:
+    path = f"/{function_name}{event['path']}"
+    if event["queryStringParameters"]:
+        path += "?" + urllib.parse.urlencode(event["queryStringParameters"])
+    body = (event.get("body") or "").encode()
+    headers = {"Host": "bench", **event["headers"], "Content-Length": str(len(body))}
+    if body:
+        headers["Content-Type"] = "application/json"
+    head = f"{event['httpMethod']} {path} HTTP/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+    return (head + "\r\n").encode() + body
+
+
+async def read_response(reader: asyncio.StreamReader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def client(n: int, port: int, ds, mix: dict, started: asyncio.Event, stop_at, samples: list, ready):
+    traffic = Traffic(ds, 1000 + n)
+    endpoints = list(mix)
+    weights = list(itertools.accumulate(mix[e] for e in endpoints))
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        samples.append(("connect", 0.0, 0))
+        ready()
+        return
+    ready()
+    await started.wait()
+    try:
+        while time.monotonic() < stop_at[0]:
+            endpoint = traffic.rng.choices(endpoints, cum_weights=weights)[0]
+            function_name, event = traffic.build(endpoint)
+            t0 = time.perf_counter()
+            writer.write(encode_request(function_name, event))
+            status = await read_response(reader)
+            samples.append((endpoint, (time.perf_counter() - t0) * 1000, status))
+    except (OSError, asyncio.IncompleteReadError):
+        samples.append(("disconnect", 0.0, 0))
+    finally:
+        writer.close()
+
+
+async def measure(kind: str, port: int, pid: int, ds, mix: dict, clients: int, duration: float, warmup: float):
+    idle = proc_status(pid)
+    samples = []
+    started = asyncio.Event()
+    stop_at = [float("inf")]
+    connected = itertools.count(1)
+    all_connected = asyncio.Event()
+
+    def ready():
+        if next(connected) == clients:
+            all_connected.set()
+
+    tasks = [asyncio.create_task(client(n, port, ds, mix, started, stop_at, samples, ready)) for n in range(clients)]
+    await all_connected.wait()
+    connected_status = proc_status(pid)
+    stop_at[0] = time.monotonic() + warmup + duration
+    started.set()
+    await asyncio.sleep(warmup)
+    samples.clear()
+    peak = proc_status(pid)
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < duration:
+        await asyncio.sleep(min(1.0, duration))
+        current = proc_status(pid)
+        if current["VmRSS"] > peak["VmRSS"]:
+            peak = current
+    measured = list(samples)
+    await asyncio.gather(*tasks)
+
+    ok = [ms for endpoint, ms, status in measured if status == 200]
+    # Прирост RSS на соединение: только открытые соединения и под нагрузкой (буферы, стеки, кэши)
+    kb_connected = (connected_status["VmRSS"] - idle["VmRSS"]) / clients
+    kb_loaded = (peak["VmRSS"] - idle["VmRSS"]) / clients
+    return {
+        "server": kind,
+        "clients": clients,
+        "rps": round(len(ok) / duration, 1),
+        "errors": sum(1 for _, _, status in measured if status != 200),
+        "latency": summarize(ok),
+        "idle_rss_mb": round(idle["VmRSS"] / 1024, 1),
+        "connected_rss_mb": round(connected_status["VmRSS"] / 1024, 1),
+        "peak_rss_mb": round(peak["VmRSS"] / 1024, 1),
+        "threads": peak["Threads"],
+        "kb_per_connection": round(kb_connected, 1),
+        "kb_per_connection_loaded": round(kb_loaded, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--messages-max", type=int, default=5000)
+    parser.add_argument("--skip-setup", action="store_true", help="не пересоздавать схему и данные")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--db-conns", type=int, default=20, help="соединений с БД у каждого сервера")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="read")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--only", choices=sorted(SERVERS))
+    args = parser.parse_args()
+
+    # Клиентских соединений и потоков синхронного сервера — тысячи, лимита файлов по умолчанию не хватит
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.clients * 4 + 256)), hard))
+
+    use_schema_env()
+    load_handler("auth")
+    import db  # noqa: E402
+
+    conn = db.get_conn()
+    try:
+        if args.skip_setup:
+            ds = load_dataset(conn)
+        else:
+            apply_migrations(conn, reset=True)
+            ds = generate(conn, Config(users=args.users, groups=args.groups, messages_max=args.messages_max))
+    finally:
+        db.put_conn(conn)
+    db.get_pool().closeall()
+
+    results = []
+    for offset, kind in enumerate(sorted(SERVERS, reverse=True)):
+        if args.only and kind != args.only:
+            continue
+        port = args.port + offset
+        proc = start_server(kind, port, args.clients, args.db_conns)
+        try:
+            result = asyncio.run(measure(kind, port, proc.pid, ds, MIXES[args.mix], args.clients,
+                                         args.duration, args.warmup))
+        finally:
+            proc.terminate()
+            proc.wait(timeout=60)
+        results.append(result)
+        lat = result["latency"]
+        print(f"{kind:<6} clients={result['clients']} rps={result['rps']} errors={result['errors']} "
+              f"p50={lat.get('p50', 0):.1f}ms p99={lat.get('p99', 0):.1f}ms threads={result['threads']} "
+              f"rss idle/connected/peak={result['idle_rss_mb']}/{result['connected_rss_mb']}/"
+              f"{result['peak_rss_mb']} MB ({result['kb_per_connection']}/{result['kb_per_connection_loaded']} "
+              f"KB per connection idle/loaded)")
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Бенчмарк кодирования ответов: json.dumps (как было) против core.dumps + сжатие
+на синтетических страницах сообщений и списке чатов. БД не нужна.
+
+Запуск: python bench/bench_encoding.py [повторов]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend", "messages"))
+
+import core  # noqa: E402
+
+
+def message_page(n=100):
+    return {"messages": [
+        {"id": 1000 + i, "text": f"Коллеги, встреча по отчёту за квартал перенесена на пятницу, пункт {i}",
+         "type": "text", "file_name": None, "file_size": None, "time": "14:05",
+         "sender_id": i % 7, "sender_name": "Алексей Морозов", "sender_avatar": "АМ", "own": i % 3 == 0}
+        for i in range(n)
+    ], "has_more": True, "before_id": 1000, "after_id": 1000 + n - 1}
+
+
+def chat_list(n=300):
+    return {"chats": [
+        {"id": i, "type": "personal" if i % 4 else "group", "name": "Мария Белова", "avatar": "МБ",
+         "online": bool(i % 2), "last_message": "Документы подписаны и отправлены.", "last_time": "09:41",
+         "unread": i % 5}
+        for i in range(n)
+    ], "cursor": None}
+
+
+def measure(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    req = core.Request({"httpMethod": "GET", "headers": {"Accept-Encoding": "gzip"}})
+    print(f"encoder: {'orjson' if core.orjson else 'json (stdlib)'}, repeat={repeat}")
+    for name, payload in (("messages page", message_page()), ("chat list", chat_list())):
+        old_ms, old_body = measure(lambda: json.dumps(payload), repeat)
+        new_ms, new_body = measure(lambda: core.dumps(payload), repeat)
+        gz_ms, gz_resp = measure(lambda: core.compress(core.json_response(200, payload), req), repeat)
+        print(f"{name:<14} json.dumps: {old_ms:.3f}ms {len(old_body.encode())}B | "
+              f"core.dumps: {new_ms:.3f}ms {len(new_body.encode())}B | "
+              f"+gzip: {gz_ms:.3f}ms {len(gz_resp['body'])}B (base64)")
+
+
+if __name__ == "__main__":
+    main()
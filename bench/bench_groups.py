@@ -0,0 +1,118 @@
+"""
+Бенчмарк больших групп: создание группы на 10 000 участников одним запросом, добавление
+и удаление пачкой, постраничный список участников, отправка в группу и чтение её истории,
+список чатов участника. Отправка, проверка членства и список чатов не должны зависеть
+от размера группы — для сравнения те же запросы идут в чат из двух человек.
+
+Запуск на пустой/тестовой БД с применёнными db_migrations:
+DATABASE_URL=postgres://... python bench/bench_groups.py [участников] [запросов на точку]
+"""
+import json
+import os
+import secrets
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import format_summary, load_handler, make_event, summarize, timed  # noqa: E402
+
+BATCH = 1_000
+
+
+def setup(cur, members: int):
+    suffix = secrets.token_hex(4)
+    cur.execute(
+        """INSERT INTO users (username, display_name, password_hash, avatar_initials)
+           SELECT %s || g, 'Бенч Участник ' || g, 'x', 'БУ' FROM generate_series(0, %s) g
+           RETURNING id""",
+        (f"bench_g_{suffix}_", members)
+    )
+    user_ids = sorted(r[0] for r in cur.fetchall())
+    tokens = {uid: secrets.token_hex(32) for uid in user_ids[:2] + user_ids[-1:]}
+    cur.execute(
+        """INSERT INTO sessions (user_id, token, expires_at)
+           SELECT u, t, NOW() + INTERVAL '1 day' FROM unnest(%s::int[], %s::text[]) AS v(u, t)""",
+        (list(tokens), list(tokens.values()))
+    )
+    return user_ids, tokens
+
+
+def run(name: str, handler, event, requests: int):
+    samples = []
+    for _ in range(requests):
+        resp, ms = timed(handler, event, None)
+        assert resp["statusCode"] == 200, resp
+        samples.append(ms)
+    summary = summarize(samples)
+    print(format_summary(name, summary))
+    return summary
+
+
+def main():
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    chats = load_handler("chats")
+    messages = load_handler("messages")
+    import db  # из backend/chats, путь добавил load_handler
+
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        user_ids, tokens = setup(cur, members)
+        conn.commit()
+    finally:
+        db.put_conn(conn)
+    owner, peer, member = user_ids[0], user_ids[1], user_ids[-1]
+    others = user_ids[1:]
+
+    # Группа со всеми участниками — один запрос, один INSERT по массиву
+    event = make_event("POST", "/", token=tokens[owner],
+                       body={"type": "group", "name": "Бенч группа", "user_ids": others})
+    resp, ms = timed(chats, event, None)
+    assert resp["statusCode"] == 200, resp
+    group_id = json.loads(resp["body"])["chat_id"]
+    print(f"{'create group':<28} members={members + 1} {ms:.1f}ms")
+
+    resp = chats(make_event("POST", "/", token=tokens[owner], body={"user_id": peer}), None)
+    assert resp["statusCode"] == 200, resp
+    pair_id = json.loads(resp["body"])["chat_id"]
+
+    # Удаление и возвращение пачки по BATCH участников
+    batch = others[-BATCH - 1:-1]
+    for path in ("/members/remove", "/members"):
+        event = make_event("POST", path, token=tokens[owner], body={"chat_id": group_id, "user_ids": batch})
+        resp, ms = timed(chats, event, None)
+        assert resp["statusCode"] == 200, resp
+        print(f"{'POST ' + path:<28} batch={len(batch)} {ms:.1f}ms")
+
+    # Весь список участников страницами по 1000
+    samples = []
+    cursor = None
+    pages = 0
+    while True:
+        query = {"chat_id": str(group_id), "limit": "1000", **({"cursor": cursor} if cursor else {})}
+        resp, ms = timed(chats, make_event("GET", "/members", token=tokens[member], query=query), None)
+        assert resp["statusCode"] == 200, resp
+        samples.append(ms)
+        pages += 1
+        cursor = json.loads(resp["body"])["cursor"]
+        if cursor is None:
+            break
+    print(format_summary(f"members pages={pages}", summarize(samples)))
+
+    send = {}
+    for label, chat_id in (("group", group_id), ("pair", pair_id)):
+        send[label] = run(f"send {label}", messages,
+                          make_event("POST", "/", token=tokens[owner], body={"chat_id": chat_id, "text": "бенч"}),
+                          requests)
+        run(f"page {label}", messages,
+            make_event("GET", "/", token=tokens[peer], query={"chat_id": str(chat_id), "limit": "50"}), requests)
+    run("chat list (group member)", chats, make_event("GET", "/", token=tokens[member]), requests)
+    run("chat list (owner)", chats, make_event("GET", "/", token=tokens[owner]), requests)
+    # Отправка не разворачивается по участникам: p95 группы и пары должны быть одного порядка
+    print(f"{'send p95 group/pair':<28} {send['group']['p95'] / send['pair']['p95']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Бенчмарк списка чатов: задержка GET /chats при росте истории одного из чатов.
+Непрочитанное считается по счётчикам, поэтому время не должно расти с размером истории.
+
+Запуск на пустой/тестовой БД с применёнными db_migrations:
+DATABASE_URL=postgres://... python bench/bench_inbox.py [чатов] [запросов на точку]
+"""
+import os
+import secrets
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import format_summary, load_handler, make_event, summarize, timed  # noqa: E402
+
+HISTORY_SIZES = (1_000, 100_000, 1_000_000)
+
+
+def setup(cur, chats: int):
+    suffix = secrets.token_hex(4)
+    cur.execute(
+        """INSERT INTO users (username, display_name, password_hash, avatar_initials)
+           VALUES (%s, 'Бенч Читатель', 'x', 'БЧ'), (%s, 'Бенч Писатель', 'x', 'БП') RETURNING id""",
+        (f"bench_r_{suffix}", f"bench_w_{suffix}")
+    )
+    reader_id, writer_id = [r[0] for r in cur.fetchall()]
+    token = secrets.token_hex(32)
+    cur.execute(
+        "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL '1 day')",
+        (reader_id, token)
+    )
+    cur.execute(
+        "INSERT INTO chats (type, name) SELECT 'group', 'Бенч ' || g FROM generate_series(1, %s) g RETURNING id",
+        (chats,)
+    )
+    chat_ids = [r[0] for r in cur.fetchall()]
+    cur.execute(
+        """INSERT INTO chat_members (chat_id, user_id)
+           SELECT c, u FROM unnest(%s::int[]) c CROSS JOIN unnest(%s::int[]) u""",
+        (chat_ids, [reader_id, writer_id])
+    )
+    return token, writer_id, chat_ids[0]
+
+
+def grow_history(cur, chat_id: int, writer_id: int, target: int):
+    cur.execute("SELECT message_count FROM chats WHERE id = %s", (chat_id,))
+    current = cur.fetchone()[0]
+    if target <= current:
+        return
+    cur.execute(
+        """INSERT INTO messages (chat_id, sender_id, text, msg_type, seq)
+           SELECT %s, %s, 'сообщение ' || g, 'text', g FROM generate_series(%s, %s) g""",
+        (chat_id, writer_id, current + 1, target)
+    )
+    cur.execute(
+        """UPDATE chats SET message_count = %s, last_activity_at = NOW(),
+                            last_message_id = (SELECT MAX(id) FROM messages WHERE chat_id = %s)
+           WHERE id = %s""",
+        (target, chat_id, chat_id)
+    )
+
+
+def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    handler = load_handler("chats")
+    import db  # из backend/chats, путь добавил load_handler
+
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        token, writer_id, hot_chat = setup(cur, chats)
+        conn.commit()
+        for size in HISTORY_SIZES:
+            grow_history(cur, hot_chat, writer_id, size)
+            conn.commit()
+            cur.execute("ANALYZE messages")
+            conn.commit()
+            event = make_event("GET", "/", token=token)
+            samples = []
+            for _ in range(requests):
+                resp, ms = timed(handler, event, None)
+                assert resp["statusCode"] == 200, resp
+                samples.append(ms)
+            print(format_summary(f"chats history={size}", summarize(samples)))
+    finally:
+        db.put_conn(conn)
+
+
+if __name__ == "__main__":
+    main()
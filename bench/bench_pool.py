@@ -0,0 +1,76 @@
+"""
+Бенчмарк пула соединений: задержка одного «запроса» при подключении на каждый
+вызов (как было) и при работе через db.ConnectionPool.
+
+Запуск: DATABASE_URL=postgres://... python bench/bench_pool.py [итераций] [потоков]
+"""
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "auth"))
+
+import psycopg2  # noqa: E402
+import db  # noqa: E402
+
+QUERY = """SELECT u.id, u.display_name FROM sessions s JOIN users u ON u.id = s.user_id
+           WHERE s.token = %s AND s.expires_at > NOW()"""
+
+
+def connect_per_call(dsn):
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute(QUERY, ("bench",))
+        cur.fetchone()
+    finally:
+        conn.close()
+
+
+def pooled(pool):
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        cur.execute(QUERY, ("bench",))
+        cur.fetchone()
+    finally:
+        pool.putconn(conn)
+
+
+def measure(fn, iterations, threads):
+    def one(_):
+        started = time.perf_counter()
+        fn()
+        return (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        samples = sorted(ex.map(one, range(iterations)))
+    return {
+        "p50": statistics.median(samples),
+        "p95": samples[int(len(samples) * 0.95) - 1],
+        "p99": samples[int(len(samples) * 0.99) - 1],
+        "mean": statistics.fmean(samples),
+    }
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    dsn = os.environ["DATABASE_URL"]
+    pool = db.ConnectionPool(dsn, minconn=threads, maxconn=threads)
+
+    results = {
+        "connect_per_call": measure(lambda: connect_per_call(dsn), iterations, threads),
+        "pool": measure(lambda: pooled(pool), iterations, threads),
+    }
+    pool.closeall()
+
+    print(f"iterations={iterations} threads={threads}")
+    for name, r in results.items():
+        print(f"{name:<18} p50={r['p50']:.2f}ms p95={r['p95']:.2f}ms p99={r['p99']:.2f}ms mean={r['mean']:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Бенчмарк подготовленных запросов (db.register / db.execute): сколько планирования экономит
+EXECUTE по имени на горячих запросах — сессия, членство в чате, страница сообщений, список чатов.
+
+Две части:
+- Planning Time из EXPLAIN ANALYZE: обычный текст запроса против EXECUTE подготовленного
+  (после прогрева, когда у Postgres уже есть закэшированный общий план);
+- задержка GET /messages и GET /chats через handler'ы при DB_PREPARED=0 и 1.
+Кэш сессий выключен (SESSION_CACHE_TTL=0), чтобы запрос сессии шёл в каждом вызове.
+
+Запуск на пустой/тестовой БД с применёнными db_migrations:
+DATABASE_URL=postgres://... python bench/bench_prepared.py [чатов] [запросов на точку]
+"""
+import os
+import secrets
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("SESSION_CACHE_TTL", "0")
+
+from common import format_summary, load_handler, make_event, summarize, timed  # noqa: E402
+
+HISTORY = 10_000
+WARMUP = 10  # Postgres переходит на общий план после пяти выполнений подготовленного запроса
+
+
+def setup(cur, chats: int):
+    suffix = secrets.token_hex(4)
+    cur.execute(
+        """INSERT INTO users (username, display_name, password_hash, avatar_initials)
+           VALUES (%s, 'Бенч Читатель', 'x', 'БЧ'), (%s, 'Бенч Писатель', 'x', 'БП') RETURNING id""",
+        (f"bench_p_{suffix}", f"bench_q_{suffix}")
+    )
+    reader_id, writer_id = [r[0] for r in cur.fetchall()]
+    token = secrets.token_hex(32)
+    cur.execute(
+        "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL '1 day')",
+        (reader_id, token)
+    )
+    cur.execute(
+        """INSERT INTO chats (type, name, member_count)
+           SELECT 'group', 'Бенч ' || g, 2 FROM generate_series(1, %s) g RETURNING id""",
+        (chats,)
+    )
+    chat_ids = [r[0] for r in cur.fetchall()]
+    cur.execute(
+        """INSERT INTO chat_members (chat_id, user_id)
+           SELECT c, u FROM unnest(%s::int[]) c CROSS JOIN unnest(%s::int[]) u""",
+        (chat_ids, [reader_id, writer_id])
+    )
+    hot_chat = chat_ids[0]
+    cur.execute(
+        """INSERT INTO messages (chat_id, sender_id, text, msg_type, seq)
+           SELECT %s, %s, 'сообщение ' || g, 'text', g FROM generate_series(1, %s) g""",
+        (hot_chat, writer_id, HISTORY)
+    )
+    cur.execute(
+        """UPDATE chats SET message_count = %s, last_activity_at = NOW(),
+                            last_message_id = (SELECT MAX(id) FROM messages WHERE chat_id = %s)
+           WHERE id = %s""",
+        (HISTORY, hot_chat, hot_chat)
+    )
+    return token, reader_id, hot_chat
+
+
+def planning_ms(cur, sql: str, args) -> float:
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, args)
+    return cur.fetchone()[0][0]["Planning Time"]
+
+
+def compare_planning(db, conn, cases, requests: int):
+    """Planning Time текста запроса и EXECUTE того же запроса на одном соединении."""
+    cur = conn.cursor()
+    for name, sql, args in cases:
+        stmt = db._statements[sql]
+        plain = [planning_ms(cur, sql, args) for _ in range(requests)]
+        for _ in range(WARMUP):
+            db.execute(cur, sql, args)
+            cur.fetchall()
+        prepared = [planning_ms(cur, stmt.execute_sql, tuple(args)) for _ in range(requests)]
+        conn.rollback()
+        print(f"{'plan ' + name:<28} text={statistics.fmean(plain):.3f}ms "
+              f"prepared={statistics.fmean(prepared):.3f}ms")
+
+
+def compare_endpoints(db, endpoints, requests: int):
+    for prepared in (False, True):
+        db.PREPARED = prepared
+        for name, handler, event in endpoints:
+            for _ in range(WARMUP):
+                handler(event, None)
+            samples = []
+            for _ in range(requests):
+                resp, ms = timed(handler, event, None)
+                assert resp["statusCode"] == 200, resp
+                samples.append(ms)
+            print(format_summary(f"{name} prepared={int(prepared)}", summarize(samples)))
+
+
+def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    chats_handler = load_handler("chats")
+    messages_handler = load_handler("messages")
+    import db  # из backend/chats, путь добавил load_handler
+    statements = {s.name: s.sql for s in db._statements.values()}
+
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        token, reader_id, hot_chat = setup(cur, chats)
+        conn.commit()
+        cur.execute("ANALYZE chats")
+        cur.execute("ANALYZE chat_members")
+        cur.execute("ANALYZE messages")
+        conn.commit()
+
+        compare_planning(db, conn, [
+            ("session", statements["session_user"], (token,)),
+            ("member", statements["messages_member"], (hot_chat, reader_id)),
+            ("messages page", statements["messages_page_latest"], (hot_chat, 51)),
+            ("chat list", statements["chats_list_first"], (reader_id, reader_id, 51)),
+        ], requests)
+    finally:
+        db.put_conn(conn)
+
+    compare_endpoints(db, [
+        ("GET /messages", messages_handler,
+         make_event("GET", "/", token=token, query={"chat_id": str(hot_chat), "limit": "50"})),
+        ("GET /chats", chats_handler, make_event("GET", "/", token=token)),
+    ], requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Нагрузочный тест ограничения частоты: поток повторных отправок СМС, проверок кода
+и входов по паролю с одного номера / логина / IP. Корзины заранее исчерпаны,
+поэтому каждый запрос должен получить 429 — и не взять ни одного соединения из пула.
+
+До ratelimit антиспам отправки был SELECT COUNT(*) по sms_codes (соединение + запрос
+на каждый отклонённый запрос), а verify и вход по паролю не ограничивались вовсе.
+
+Запуск: python bench/bench_ratelimit.py [запросов на сценарий] [потоков]
+"""
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import format_summary, load_handler, make_event, summarize, timed  # noqa: E402
+
+PHONE = "+79990001122"
+USERNAME = "bench_bruteforce"
+IP = "203.0.113.7"
+
+SCENARIOS = {
+    "sms send": ("sms-auth", {"action": "send", "phone": PHONE}),
+    "sms verify": ("sms-auth", {"action": "verify", "phone": PHONE, "code": "000000"}),
+    "password login": ("auth", {"username": USERNAME, "password": "guess"}),
+}
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    handlers = {name: load_handler(name) for name in ("sms-auth", "auth")}
+    import db  # noqa: E402
+    import ratelimit  # noqa: E402
+
+    # Каждое взятие соединения из пула — считаем
+    acquired = [0]
+    lock = threading.Lock()
+    real_get_conn = db.get_conn
+
+    def counting_get_conn():
+        with lock:
+            acquired[0] += 1
+        return real_get_conn()
+
+    db.get_conn = counting_get_conn
+
+    # Исчерпать корзины так, как это сделали бы предыдущие запросы атакующего
+    for rules in (("sms_send_phone", PHONE), ("sms_verify_phone", PHONE), ("login_username", USERNAME)):
+        while not ratelimit.check([rules]):
+            pass
+
+    headers = {"X-Forwarded-For": IP}
+    for name, (function_name, body) in SCENARIOS.items():
+        handler = handlers[function_name]
+        event = make_event("POST", "/", body=body, headers=headers)
+        acquired[0] = 0
+
+        def one(_):
+            resp, ms = timed(handler, event, None)
+            return resp["statusCode"], ms
+
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(one, range(requests)))
+        statuses = {status for status, _ in results}
+        print(format_summary(name, summarize([ms for _, ms in results])))
+        print(f"{'':<28} статусы={sorted(statuses)} соединений из пула={acquired[0]} "
+              f"запросов к БД на отказ={acquired[0] / requests:.2f}")
+
+    print(f"ratelimit: {ratelimit.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Бенчмарк полнотекстового поиска: задержка GET /messages/search на синтетической
+таблице в несколько миллионов сообщений. Пользователь состоит в небольшой части чатов,
+поэтому время должно определяться индексом, а не размером messages.
+
+Запуск на тестовой БД с применёнными db_migrations:
+DATABASE_URL=postgres://... python bench/bench_search.py [сообщений] [чатов] [запросов на слово]
+"""
+import os
+import secrets
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import format_summary, load_handler, make_event, summarize, timed  # noqa: E402
+
+WORDS = [
+    "отчёт", "бюджет", "встреча", "договор", "релиз", "сервер", "квартал", "инвестор",
+    "презентация", "счёт", "задача", "deploy", "invoice", "meeting", "backup", "приказ",
+]
+QUERIES = ["отчёт", "договоры", "встреча инвестор", "deploy", "\"квартальный бюджет\"", "редкоеслово"]
+
+
+def setup(cur, messages: int, chats: int):
+    suffix = secrets.token_hex(4)
+    cur.execute(
+        """INSERT INTO users (username, display_name, password_hash, avatar_initials)
+           VALUES (%s, 'Бенч Поиск', 'x', 'БП') RETURNING id""",
+        (f"bench_s_{suffix}",)
+    )
+    user_id = cur.fetchone()[0]
+    token = secrets.token_hex(32)
+    cur.execute(
+        "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL '1 day')",
+        (user_id, token)
+    )
+    cur.execute(
+        "INSERT INTO chats (type, name) SELECT 'group', 'Поиск ' || g FROM generate_series(1, %s) g RETURNING id",
+        (chats,)
+    )
+    chat_ids = [r[0] for r in cur.fetchall()]
+    # Пользователь состоит в каждом десятом чате
+    cur.execute(
+        "INSERT INTO chat_members (chat_id, user_id) SELECT c, %s FROM unnest(%s::int[]) c",
+        (user_id, chat_ids[::10])
+    )
+    cur.execute(
+        """INSERT INTO messages (chat_id, sender_id, text, msg_type)
+           SELECT (%s::int[])[1 + (g %% %s)], %s,
+                  (%s::text[])[1 + (g * 7 %% %s)] || ' ' || (%s::text[])[1 + (g * 13 %% %s)] || ' №' || g,
+                  'text'
+           FROM generate_series(1, %s) g""",
+        (chat_ids, len(chat_ids), user_id, WORDS, len(WORDS), WORDS, len(WORDS), messages)
+    )
+    return token
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 3_000_000
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    handler = load_handler("messages")
+    import db  # из backend/messages, путь добавил load_handler
+
+    conn = db.get_conn()
+    try:
+        cur = conn.cursor()
+        token = setup(cur, messages, chats)
+        conn.commit()
+        cur.execute("ANALYZE messages")
+        conn.commit()
+    finally:
+        db.put_conn(conn)
+
+    for q in QUERIES:
+        samples = []
+        for _ in range(requests):
+            resp, ms = timed(handler, make_event("GET", "/search", token=token, query={"q": q}), None)
+            assert resp["statusCode"] == 200, resp
+            samples.append(ms)
+        print(format_summary(f"search {q!r}", summarize(samples)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Общие помощники бенчмарков: загрузка handler'ов функций из backend/,
+сборка event в формате облачной функции и сводка задержек.
+"""
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+_handlers = {}
+
+
+def load_handler(function_name: str):
+    """handler из backend/<function_name>/index.py; соседние модули (db, sessions) берутся из той же папки."""
+    if function_name not in _handlers:
+        function_dir = os.path.join(BACKEND_DIR, function_name)
+        if function_dir not in sys.path:
+            sys.path.insert(0, function_dir)
+        spec = importlib.util.spec_from_file_location(
+            f"{function_name.replace('-', '_')}_index", os.path.join(function_dir, "index.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _handlers[function_name] = module.handler
+    return _handlers[function_name]
+
+
+def make_event(method="GET", path="/", token=None, query=None, body=None, headers=None) -> dict:
+    event_headers = dict(headers or {})
+    if token:
+        event_headers["X-Session-Id"] = token
+    return {
+        "httpMethod": method,
+        "path": path,
+        "headers": event_headers,
+        "queryStringParameters": query or {},
+        "body": json.dumps(body) if body is not None else "",
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def summarize(samples_ms) -> dict:
+    samples = sorted(samples_ms)
+    if not samples:
+        return {"n": 0}
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+    return {
+        "n": len(samples),
+        "p50": round(statistics.median(samples), 3),
+        "p95": round(pct(0.95), 3),
+        "p99": round(pct(0.99), 3),
+        "mean": round(statistics.fmean(samples), 3),
+    }
+
+
+def format_summary(name: str, s: dict) -> str:
+    if not s.get("n"):
+        return f"{name:<28} no samples"
+    return f"{name:<28} n={s['n']} p50={s['p50']:.2f}ms p95={s['p95']:.2f}ms p99={s['p99']:.2f}ms mean={s['mean']:.2f}ms"
@@ -0,0 +1,192 @@
+"""
+Генератор синтетических данных для нагрузочных тестов: пользователи, личные и
+групповые чаты, сообщения. Всё грузится через COPY, сводки чатов и счётчики
+непрочитанного досчитываются одним UPDATE на таблицу.
+
+Распределения скошенные, как в живом мессенджере: размер групп и длина истории
+чата — по Парето (много маленьких, немного огромных), активность пользователей — по Ципфу.
+
+Запуск: DATABASE_URL=postgres://... python bench/datagen.py [пользователей] [групп]
+"""
+import hashlib
+import io
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_NAMES = ["Иван", "Алексей", "Мария", "Сергей", "Анна", "Дмитрий", "Елена", "Ольга",
+               "Павел", "Наталья", "Андрей", "Татьяна", "Михаил", "Юлия", "Николай", "Ирина"]
+LAST_NAMES = ["Иванов", "Морозов", "Белов", "Кузнецов", "Смирнов", "Попов", "Волков", "Соколов",
+              "Лебедев", "Козлов", "Новиков", "Фёдоров", "Орлов", "Зайцев", "Павлов", "Семёнов"]
+DEPARTMENTS = ["Руководство", "Финансы", "Персонал", "Продажи", "Разработка", "Логистика", "Юристы"]
+POSITIONS = ["Менеджер", "Аналитик", "Инженер", "Руководитель отдела", "Специалист", "Стажёр"]
+WORDS = ["отчёт", "бюджет", "встреча", "договор", "релиз", "сервер", "квартал", "клиент", "задача",
+         "презентация", "счёт", "сегодня", "завтра", "срочно", "проверь", "согласовано", "deploy",
+         "invoice", "meeting", "созвон", "документы", "план", "итоги", "спасибо", "готово"]
+
+
+class Config:
+    def __init__(self, users=2000, personal_per_user=3, groups=200, group_size_min=3, group_size_max=2000,
+                 group_alpha=1.3, messages_min=20, messages_max=50_000, messages_alpha=1.2, seed=42):
+        self.users = users
+        self.personal_per_user = personal_per_user
+        self.groups = groups
+        self.group_size_min = group_size_min
+        self.group_size_max = group_size_max
+        self.group_alpha = group_alpha
+        self.messages_min = messages_min
+        self.messages_max = messages_max
+        self.messages_alpha = messages_alpha
+        self.seed = seed
+
+
+class Dataset:
+    """То, что нужно генератору трафика: пользователи, их токены и чаты."""
+
+    def __init__(self):
+        self.user_ids = []
+        self.tokens = {}        # user_id -> токен сессии
+        self.user_chats = {}    # user_id -> [chat_id]
+        self.chat_last = {}     # chat_id -> id последнего сообщения
+
+
+def session_token(user_id: int) -> str:
+    return hashlib.sha256(f"load:{user_id}".encode()).hexdigest()
+
+
+def pareto(rng, minimum: int, alpha: float, maximum: int) -> int:
+    return min(int(minimum * rng.paretovariate(alpha)), maximum)
+
+
+def copy_rows(cur, table: str, columns, rows, chunk: int = 50_000):
+    """COPY ... FROM STDIN порциями, чтобы не держать в памяти весь CSV."""
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT text)"
+    buf = io.StringIO()
+    n = 0
+    for row in rows:
+        buf.write("\t".join("\\N" if v is None else str(v).replace("\\", "\\\\").replace("\t", " ").replace("\n", " ")
+                            for v in row))
+        buf.write("\n")
+        n += 1
+        if n % chunk == 0:
+            buf.seek(0)
+            cur.copy_expert(sql, buf)
+            buf = io.StringIO()
+    if buf.tell():
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+    return n
+
+
+def generate(conn, cfg: Config) -> Dataset:
+    rng = random.Random(cfg.seed)
+    cur = conn.cursor()
+    ds = Dataset()
+    now = datetime.now(timezone.utc)
+
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+    users_before = cur.fetchone()[0]
+    copy_rows(cur, "users", ("username", "display_name", "password_hash", "position", "department",
+                             "phone", "avatar_initials", "last_seen"), (
+        (f"load_{i}", f"{first} {last}", "load", rng.choice(POSITIONS), rng.choice(DEPARTMENTS),
+         f"+7900{i:07d}", first[0] + last[0], now - timedelta(seconds=rng.randint(0, 86400)))
+        for i in range(cfg.users)
+        for first, last in [(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))]
+    ))
+    cur.execute("SELECT id FROM users WHERE id > %s ORDER BY id", (users_before,))
+    ds.user_ids = [r[0] for r in cur.fetchall()]
+    ds.user_chats = {uid: [] for uid in ds.user_ids}
+
+    copy_rows(cur, "sessions", ("user_id", "token", "expires_at"), (
+        (uid, session_token(uid), now + timedelta(days=30)) for uid in ds.user_ids
+    ))
+    ds.tokens = {uid: session_token(uid) for uid in ds.user_ids}
+
+    # Чаты: сначала личные (пара пользователей), затем группы со скошенным размером
+    pairs = set()
+    for uid in ds.user_ids:
+        for _ in range(cfg.personal_per_user):
+            other = rng.choice(ds.user_ids)
+            if other != uid:
+                pairs.add((min(uid, other), max(uid, other)))
+    pairs = sorted(pairs)
+    group_members = []
+    for _ in range(cfg.groups):
+        size = min(pareto(rng, cfg.group_size_min, cfg.group_alpha, cfg.group_size_max), len(ds.user_ids))
+        group_members.append(rng.sample(ds.user_ids, size))
+
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM chats")
+    chats_before = cur.fetchone()[0]
+    copy_rows(cur, "chats", ("type", "name", "member_count", "pair_low", "pair_high"),
+              [("personal", None, 2, low, high) for low, high in pairs] +
+              [("group", f"Группа {g + 1}", len(m), None, None) for g, m in enumerate(group_members)])
+    cur.execute("SELECT id FROM chats WHERE id > %s ORDER BY id", (chats_before,))
+    chat_ids = [r[0] for r in cur.fetchall()]
+    members = dict(zip(chat_ids, [list(p) for p in pairs] + group_members))
+    for chat_id, member_ids in members.items():
+        for uid in member_ids:
+            ds.user_chats[uid].append(chat_id)
+    # Владелец группы — её первый участник
+    owners = set(chat_ids[len(pairs):])
+    copy_rows(cur, "chat_members", ("chat_id", "user_id", "role"),
+              ((chat_id, uid, "owner" if chat_id in owners and n == 0 else "member")
+               for chat_id, member_ids in members.items() for n, uid in enumerate(member_ids)))
+
+    # История: длина по Парето, отправитель — случайный участник, время растёт с seq
+    def message_rows():
+        for chat_id, member_ids in members.items():
+            count = pareto(rng, cfg.messages_min, cfg.messages_alpha, cfg.messages_max)
+            started = now - timedelta(days=30)
+            step = timedelta(days=30) / (count + 1)
+            for seq in range(1, count + 1):
+                text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 12)))
+                yield chat_id, rng.choice(member_ids), text, "text", seq, started + step * seq
+
+    total = copy_rows(cur, "messages", ("chat_id", "sender_id", "text", "msg_type", "seq", "created_at"),
+                      message_rows())
+
+    cur.execute(
+        """UPDATE chats c SET message_count = s.seq, last_message_id = s.id, last_message_text = s.text,
+                              last_message_at = s.created_at, last_sender_id = s.sender_id,
+                              last_activity_at = s.created_at
+           FROM (SELECT DISTINCT ON (chat_id) chat_id, id, seq, text, created_at, sender_id
+                 FROM messages WHERE chat_id > %s ORDER BY chat_id, id DESC) s
+           WHERE c.id = s.chat_id""",
+        (chats_before,)
+    )
+    # Вся сгенерированная история прочитана — непрочитанное появится от трафика
+    cur.execute(
+        """UPDATE chat_members cm SET read_count = c.message_count, last_read_message_id = c.last_message_id
+           FROM chats c WHERE c.id = cm.chat_id AND c.id > %s""",
+        (chats_before,)
+    )
+    cur.execute("SELECT id, COALESCE(last_message_id, 0) FROM chats WHERE id > %s", (chats_before,))
+    ds.chat_last = dict(cur.fetchall())
+    conn.commit()
+    for table in ("users", "sessions", "chats", "chat_members", "messages"):
+        cur.execute(f"ANALYZE {table}")
+    conn.commit()
+    print(f"generated users={len(ds.user_ids)} chats={len(chat_ids)} "
+          f"(personal={len(pairs)}, groups={cfg.groups}) messages={total}")
+    return ds
+
+
+def main():
+    import psycopg2
+    from schema import use_schema_env
+
+    use_schema_env()
+    cfg = Config(users=int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+                 groups=int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    try:
+        generate(conn, cfg)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Фейковый smsc.ru (send.php) для проверки диспетчера sms_outbox без реального провайдера.
+Отвечает как smsc с fmt=3, запоминает принятые сообщения, умеет задержку и сбои.
+
+Как сервер:  python bench/fake_smsc.py serve [порт] [задержка_мс] [доля_сбоев]
+             затем SMSC_URL=http://127.0.0.1:<порт>/sys/send.php SMSC_LOGIN=x SMSC_PASSWORD=x
+Самопроверка: python bench/fake_smsc.py [сообщений] [задержка_мс]
+             — отправка по одному против пачек провайдера backend/maintenance/sms.py
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend", "maintenance"))
+
+
+class FakeSmsc:
+    def __init__(self, port: int = 0, latency: float = 0.0, failure_rate: float = 0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.received = []  # [(phone, message)]
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/sys/send.php"
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self._answer(urllib.parse.parse_qs(self.rfile.read(length).decode()))
+
+            def do_GET(self):
+                self._answer(urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query))
+
+            def _answer(self, params):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                resp = fake.accept(params)
+                body = json.dumps(resp).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def accept(self, params: dict) -> dict:
+        with self._lock:
+            self.calls += 1
+            if random.random() < self.failure_rate:
+                return {"error": "service unavailable", "error_code": 9}
+            if "list" in params:
+                items = [line.split(":", 1) for line in params["list"][0].splitlines() if ":" in line]
+            else:
+                items = [(phone, params.get("mes", [""])[0]) for phone in params.get("phones", [""])[0].split(",")]
+            self.received.extend((phone, message) for phone, message in items)
+            sms_id, self._next_id = self._next_id, self._next_id + 1
+            return {"id": sms_id, "cnt": len(items)}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def self_check(messages: int, latency: float):
+    import sms
+
+    items = [(i, f"+7900{i:07d}", f"Ваш код Друг: {100000 + i}") for i in range(messages)]
+    with FakeSmsc(latency=latency) as fake:
+        provider = sms.SmscProvider("login", "password", url=fake.url)
+
+        started = time.perf_counter()
+        for item in items:
+            provider.send_batch([item])
+        one_by_one = time.perf_counter() - started
+
+        started = time.perf_counter()
+        batch = int(os.environ.get("SMS_BATCH", "50"))
+        results = {}
+        for i in range(0, len(items), batch):
+            results.update(provider.send_batch(items[i:i + batch]))
+        batched = time.perf_counter() - started
+
+        assert all(r.ok for r in results.values())
+        assert len(fake.received) == 2 * messages
+        print(f"{messages} СМС, задержка провайдера {latency * 1000:.0f} мс")
+        print(f"  по одному: {one_by_one:.2f} с ({messages} вызовов)")
+        print(f"  пачками:   {batched:.2f} с ({-(-messages // batch)} вызовов)")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8025
+        latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.0
+        failure_rate = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+        fake = FakeSmsc(port, latency, failure_rate)
+        print(f"fake smsc: {fake.url}")
+        fake.server.serve_forever()
+        return
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 20.0 / 1000
+    self_check(messages, latency)
+
+
+if __name__ == "__main__":
+    main()
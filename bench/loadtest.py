@@ -0,0 +1,306 @@
+"""
+Нагрузочный тест всех горячих обработчиков на локальном Postgres.
+
+1. Схема собирается из db_migrations/ (bench/schema.py), данные — bench/datagen.py через COPY.
+2. Потоки вызывают handler(event, context) функций auth, chats, messages и presence
+   по взвешенной смеси запросов; активность пользователей скошена по Ципфу.
+3. По каждому эндпоинту: p50/p95/p99, пропускная способность, запросов к БД на вызов.
+4. --save-baseline пишет результат в bench/baseline.json, --compare сверяет с ним
+   и завершается с кодом 1 при регрессии.
+5. --url http://127.0.0.1:8000 — тот же трафик по HTTP в backend/server.py вместо вызова
+   handler'ов в процессе; запросы к БД берутся из Server-Timing (сервер с INSTRUMENT=1).
+
+Запуск:
+DATABASE_URL=postgres://... python bench/loadtest.py --users 2000 --groups 200 --duration 30 --threads 8
+DATABASE_URL=postgres://... python bench/loadtest.py --skip-setup --compare
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import load_handler, make_event, summarize  # noqa: E402
+from datagen import WORDS, Config, Dataset, generate, session_token  # noqa: E402
+from schema import apply_migrations, use_schema_env  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+FUNCTIONS = ("auth", "chats", "messages", "presence")
+
+# эндпоинт -> вес в смеси
+MIXES = {
+    "default": {
+        "chats.list": 20, "messages.page": 25, "messages.sync": 15, "messages.send": 10,
+        "messages.read": 8, "chats.contacts": 8, "messages.search": 4, "presence.lookup": 5,
+        "auth.session": 5,
+    },
+    "write-heavy": {
+        "messages.send": 40, "messages.read": 20, "messages.sync": 20, "chats.list": 20,
+    },
+    "read-only": {
+        "chats.list": 30, "messages.page": 35, "chats.contacts": 15, "messages.search": 10,
+        "presence.lookup": 10,
+    },
+}
+
+_local = threading.local()
+
+
+def install_query_counter(db):
+    """Каждой выданной пулом connection — курсор, считающий execute в счётчик текущего потока."""
+    import psycopg2.extensions
+
+    class CountingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            _local.queries = getattr(_local, "queries", 0) + 1
+            return super().execute(query, vars)
+
+    real_get_conn = db.get_conn
+
+    def get_conn():
+        conn = real_get_conn()
+        conn.cursor_factory = CountingCursor
+        return conn
+
+    db.get_conn = get_conn
+
+
+class HttpFunction:
+    """handler(event, context), который на деле отправляет event в backend/server.py."""
+
+    _QUERIES = re.compile(r'desc="(\d+) queries"')
+
+    def __init__(self, base_url: str, function_name: str):
+        self.base = f"{base_url.rstrip('/')}/{function_name}"
+
+    def __call__(self, event: dict, context) -> dict:
+        url = self.base + event["path"]
+        if event.get("queryStringParameters"):
+            url += "?" + urllib.parse.urlencode(event["queryStringParameters"])
+        headers = {"Content-Type": "application/json", **(event.get("headers") or {})}
+        data = event["body"].encode() if event.get("body") else None
+        request = urllib.request.Request(url, data=data, headers=headers, method=event["httpMethod"])
+        try:
+            with urllib.request.urlopen(request, timeout=60) as r:
+                status, body, resp_headers = r.status, r.read(), r.headers
+        except urllib.error.HTTPError as e:
+            status, body, resp_headers = e.code, e.read(), e.headers
+        match = self._QUERIES.search(resp_headers.get("Server-Timing") or "")
+        _local.queries = int(match.group(1)) if match else 0
+        return {"statusCode": status, "body": body.decode()}
+
+
+class Traffic:
+    """Собирает event для эндпоинта от лица случайного (скошенно) пользователя."""
+
+    def __init__(self, ds: Dataset, seed: int):
+        self.ds = ds
+        self.rng = random.Random(seed)
+        users = [uid for uid in ds.user_ids if ds.user_chats.get(uid)]
+        self.users = users
+        self.user_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(users))))
+        self.counter = itertools.count()
+
+    def user(self):
+        uid = self.rng.choices(self.users, cum_weights=self.user_weights)[0]
+        return uid, session_token(uid), self.rng.choice(self.ds.user_chats[uid])
+
+    def build(self, endpoint: str):
+        uid, token, chat_id = self.user()
+        last_id = self.ds.chat_last.get(chat_id, 0)
+        if endpoint == "auth.session":
+            return "auth", make_event("GET", "/", token=token)
+        if endpoint == "chats.list":
+            return "chats", make_event("GET", "/", token=token, query={"limit": "50"})
+        if endpoint == "chats.contacts":
+            query = {"limit": "50"}
+            if self.rng.random() < 0.5:
+                query["q"] = self.rng.choice(["иван", "морозов", "финансы", "аналитик", "ма"])
+            return "chats", make_event("GET", "/contacts", token=token, query=query)
+        if endpoint == "messages.page":
+            return "messages", make_event("GET", "/", token=token, query={"chat_id": str(chat_id), "limit": "50"})
+        if endpoint == "messages.sync":
+            # Пустой курсор: чат начинается с отметки «прочитано» — отдаётся непрочитанное
+            query = {"chat_id": str(chat_id), "cursor": "", "timeout": "0"}
+            return "messages", make_event("GET", "/sync", token=token, query=query)
+        if endpoint == "messages.send":
+            text = " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(2, 12)))
+            body = {"chat_id": chat_id, "text": text, "client_msg_id": f"load-{uid}-{next(self.counter)}"}
+            return "messages", make_event("POST", "/", token=token, body=body)
+        if endpoint == "messages.read":
+            body = {"chat_id": chat_id, "message_id": last_id}
+            return "messages", make_event("POST", "/read", token=token, body=body)
+        if endpoint == "messages.search":
+            return "messages", make_event("GET", "/search", token=token, query={"q": self.rng.choice(WORDS)})
+        if endpoint == "presence.lookup":
+            ids = self.rng.sample(self.users, min(50, len(self.users)))
+            return "presence", make_event("GET", "/", token=token, query={"ids": ",".join(map(str, ids))})
+        raise ValueError(endpoint)
+
+
+def load_dataset(conn) -> Dataset:
+    """Dataset по уже сгенерированным данным (--skip-setup)."""
+    cur = conn.cursor()
+    ds = Dataset()
+    cur.execute("SELECT id FROM users WHERE username LIKE 'load\\_%%' ORDER BY id")
+    ds.user_ids = [r[0] for r in cur.fetchall()]
+    ds.tokens = {uid: session_token(uid) for uid in ds.user_ids}
+    ds.user_chats = {uid: [] for uid in ds.user_ids}
+    cur.execute("SELECT user_id, chat_id FROM chat_members WHERE user_id = ANY(%s)", (ds.user_ids,))
+    for uid, chat_id in cur.fetchall():
+        ds.user_chats[uid].append(chat_id)
+    cur.execute("SELECT id, COALESCE(last_message_id, 0) FROM chats")
+    ds.chat_last = dict(cur.fetchall())
+    conn.commit()
+    return ds
+
+
+def run(handlers, ds: Dataset, mix: dict, threads: int, duration: float, warmup: float, seed: int):
+    endpoints = list(mix)
+    weights = list(itertools.accumulate(mix[e] for e in endpoints))
+    started = time.monotonic()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    def worker(n):
+        traffic = Traffic(ds, seed + n)
+        samples = []
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                return samples
+            endpoint = traffic.rng.choices(endpoints, cum_weights=weights)[0]
+            function_name, event = traffic.build(endpoint)
+            _local.queries = 0
+            t0 = time.perf_counter()
+            resp = handlers[function_name](event, None)
+            ms = (time.perf_counter() - t0) * 1000
+            if endpoint == "messages.send" and resp["statusCode"] == 200:
+                chat_id = json.loads(event["body"])["chat_id"]
+                message_id = json.loads(resp["body"])["message"]["id"]
+                ds.chat_last[chat_id] = max(ds.chat_last.get(chat_id, 0), message_id)
+            if now >= measure_from:
+                samples.append((endpoint, ms, resp["statusCode"], _local.queries))
+
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(itertools.chain.from_iterable(pool.map(worker, range(threads))))
+    return results
+
+
+def report(results, duration: float) -> dict:
+    by_endpoint = {}
+    for endpoint, ms, status, queries in results:
+        by_endpoint.setdefault(endpoint, []).append((ms, status, queries))
+    summary = {}
+    for endpoint in sorted(by_endpoint):
+        rows = by_endpoint[endpoint]
+        s = summarize([ms for ms, _, _ in rows])
+        summary[endpoint] = {
+            "n": s["n"], "p50": s["p50"], "p95": s["p95"], "p99": s["p99"],
+            "rps": round(len(rows) / duration, 1),
+            "queries_per_request": round(sum(q for _, _, q in rows) / len(rows), 2),
+            "errors": sum(1 for _, status, _ in rows if status >= 400),
+        }
+    total = len(results)
+    print(f"{'endpoint':<18} {'n':>7} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'q/req':>6} {'err':>5}")
+    for endpoint, s in summary.items():
+        print(f"{endpoint:<18} {s['n']:>7} {s['rps']:>8.1f} {s['p50']:>8.2f} {s['p95']:>8.2f} "
+              f"{s['p99']:>8.2f} {s['queries_per_request']:>6.2f} {s['errors']:>5}")
+    print(f"{'total':<18} {total:>7} {total / duration:>8.1f}")
+    return summary
+
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> list:
+    """Регрессия: p95 хуже базового больше чем на tolerance (и на 1 мс), либо выросло число запросов к БД."""
+    problems = []
+    for endpoint, base in baseline["endpoints"].items():
+        cur = summary.get(endpoint)
+        if not cur:
+            continue
+        if cur["p95"] > base["p95"] * (1 + tolerance) and cur["p95"] - base["p95"] > 1.0:
+            problems.append(f"{endpoint}: p95 {base['p95']:.2f} -> {cur['p95']:.2f} ms")
+        if cur["queries_per_request"] > base["queries_per_request"] + 0.05:
+            problems.append(f"{endpoint}: queries/request {base['queries_per_request']} -> {cur['queries_per_request']}")
+        if cur["errors"] > base.get("errors", 0):
+            problems.append(f"{endpoint}: errors {base.get('errors', 0)} -> {cur['errors']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--personal-per-user", type=int, default=3)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--group-size-max", type=int, default=2000)
+    parser.add_argument("--messages-min", type=int, default=20, help="минимум сообщений в чате (хвост — по Парето)")
+    parser.add_argument("--messages-max", type=int, default=50_000)
+    parser.add_argument("--mix", choices=sorted(MIXES), default="default")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-setup", action="store_true", help="не пересоздавать схему и данные")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--url", help="гнать трафик по HTTP в backend/server.py")
+    args = parser.parse_args()
+
+    use_schema_env()
+    # Обработчики держат соединений не больше, чем потоков нагрузки
+    os.environ.setdefault("DB_POOL_MAX", str(args.threads))
+    handlers = {name: HttpFunction(args.url, name) if args.url else load_handler(name) for name in FUNCTIONS}
+    if args.url:
+        # Схема и данные всё равно готовятся напрямую — нужен db из backend/
+        load_handler("auth")
+    import db  # noqa: E402
+    install_query_counter(db)
+
+    conn = db.get_conn()
+    try:
+        if args.skip_setup:
+            ds = load_dataset(conn)
+        else:
+            apply_migrations(conn, reset=True)
+            cfg = Config(users=args.users, personal_per_user=args.personal_per_user, groups=args.groups,
+                         group_size_max=args.group_size_max, messages_min=args.messages_min,
+                         messages_max=args.messages_max, seed=args.seed)
+            ds = generate(conn, cfg)
+    finally:
+        db.put_conn(conn)
+
+    print(f"mix={args.mix} threads={args.threads} duration={args.duration}s warmup={args.warmup}s")
+    results = run(handlers, ds, MIXES[args.mix], args.threads, args.duration, args.warmup, args.seed)
+    summary = report(results, args.duration)
+
+    params = {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare", "baseline", "skip_setup", "url")}
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"params": params, "endpoints": summary}, f, ensure_ascii=False, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("params") != params:
+            print(f"warning: baseline params differ: {baseline.get('params')}")
+        problems = compare(summary, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+        print("no regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Локальная пара primary + потоковая реплика для проверки чтения с реплик.
+Поднимает оба кластера во временной папке (initdb, pg_basebackup -R), применяет
+db_migrations на primary и печатает переменные окружения для функций.
+
+С --check отправляет сообщения через handler messages и сразу читает историю и список
+чатов тем же пользователем: ответ обязан содержать только что отправленное сообщение,
+даже если реплика ещё не догнала primary. В конце — сколько чтений ушло на реплику,
+сколько вернулось на primary и отставание реплики.
+
+Нужны initdb, pg_ctl, pg_basebackup в PATH.
+Запуск: python bench/replica_pair.py [--check] [--keep] [--port 55432] [--requests 200]
+"""
+import argparse
+import json
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import load_handler, make_event  # noqa: E402
+from schema import apply_migrations, use_schema_env  # noqa: E402
+
+
+def run(*cmd):
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+
+
+def start_pair(root: str, port: int):
+    primary, replica = os.path.join(root, "primary"), os.path.join(root, "replica")
+    run("initdb", "-D", primary, "-U", "postgres", "--auth=trust")
+    with open(os.path.join(primary, "postgresql.conf"), "a") as f:
+        f.write(f"port = {port}\nwal_level = replica\nmax_wal_senders = 4\nlisten_addresses = '127.0.0.1'\n")
+    with open(os.path.join(primary, "pg_hba.conf"), "a") as f:
+        f.write("host replication postgres 127.0.0.1/32 trust\n")
+    run("pg_ctl", "-D", primary, "-l", os.path.join(root, "primary.log"), "-w", "start")
+
+    run("pg_basebackup", "-h", "127.0.0.1", "-p", str(port), "-U", "postgres", "-D", replica, "-R", "-X", "stream")
+    with open(os.path.join(replica, "postgresql.conf"), "a") as f:
+        f.write(f"port = {port + 1}\nhot_standby = on\n")
+    run("pg_ctl", "-D", replica, "-l", os.path.join(root, "replica.log"), "-w", "start")
+    return primary, replica
+
+
+def stop_pair(*data_dirs):
+    for data_dir in data_dirs:
+        subprocess.run(["pg_ctl", "-D", data_dir, "-m", "fast", "stop"], stdout=subprocess.DEVNULL)
+
+
+def setup(cur):
+    suffix = secrets.token_hex(4)
+    cur.execute(
+        """INSERT INTO users (username, display_name, password_hash, avatar_initials)
+           VALUES (%s, 'Реплика А', 'x', 'РА'), (%s, 'Реплика Б', 'x', 'РБ') RETURNING id""",
+        (f"replica_a_{suffix}", f"replica_b_{suffix}")
+    )
+    user_id, peer_id = sorted(r[0] for r in cur.fetchall())
+    token = secrets.token_hex(32)
+    cur.execute("INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL '1 day')",
+                (user_id, token))
+    return token, peer_id
+
+
+def check(requests: int):
+    chats = load_handler("chats")
+    messages = load_handler("messages")
+    import db  # из backend/chats, путь добавил load_handler
+
+    conn = db.get_conn()
+    try:
+        token, peer_id = setup(conn.cursor())
+        conn.commit()
+    finally:
+        db.put_conn(conn)
+
+    resp = chats(make_event("POST", "/", token=token, body={"user_id": peer_id}), None)
+    assert resp["statusCode"] == 200, resp
+    chat_id = json.loads(resp["body"])["chat_id"]
+
+    stale = 0
+    for i in range(requests):
+        text = f"реплика {i}"
+        resp = messages(make_event("POST", "/", token=token, body={"chat_id": chat_id, "text": text}), None)
+        assert resp["statusCode"] == 200, resp
+        # Как клиент: LSN записи из ответа уходит в заголовке следующего чтения
+        min_lsn = {"X-Min-LSN": resp["headers"]["X-Write-LSN"]}
+
+        resp = messages(make_event("GET", "/", token=token, query={"chat_id": str(chat_id), "limit": "1"},
+                                   headers=min_lsn), None)
+        assert resp["statusCode"] == 200, resp
+        page = json.loads(resp["body"])["messages"]
+        resp = chats(make_event("GET", "/", token=token, headers=min_lsn), None)
+        assert resp["statusCode"] == 200, resp
+        listed = next(c for c in json.loads(resp["body"])["chats"] if c["id"] == chat_id)
+        if not page or page[-1]["text"] != text or listed["last_message"] != text:
+            stale += 1
+
+    print(f"requests={requests} stale_reads={stale}")
+    for host, replica in db.replica_stats().items():
+        print(f"replica {host} reads={replica['reads']} fallbacks={replica['fallbacks']} "
+              f"errors={replica['errors']} lag={replica['lag_seconds']}s")
+    return stale
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="не останавливать кластеры после --check")
+    parser.add_argument("--port", type=int, default=55432)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="drug_replica_")
+    primary, replica = start_pair(root, args.port)
+    primary_url = f"postgres://postgres@127.0.0.1:{args.port}/postgres"
+    replica_url = f"postgres://postgres@127.0.0.1:{args.port + 1}/postgres"
+
+    import psycopg2
+    conn = psycopg2.connect(primary_url)
+    try:
+        applied = apply_migrations(conn)
+    finally:
+        conn.close()
+    print(f"migrations applied: {applied}, data: {root}")
+    print(f"export DATABASE_URL={primary_url}")
+    print(f"export DATABASE_REPLICA_URLS={replica_url}")
+
+    if not args.check:
+        print(f"stop: pg_ctl -D {replica} stop && pg_ctl -D {primary} stop")
+        return
+
+    os.environ["DATABASE_URL"] = primary_url
+    os.environ["DATABASE_REPLICA_URLS"] = replica_url
+    use_schema_env()
+    try:
+        stale = check(args.requests)
+    finally:
+        if not args.keep:
+            stop_pair(replica, primary)
+            shutil.rmtree(root, ignore_errors=True)
+    sys.exit(1 if stale else 0)
+
+
+if __name__ == "__main__":
+    main()
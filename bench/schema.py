@@ -0,0 +1,66 @@
+"""
+Локальная схема для бенчмарков: применяет db_migrations/ по порядку версий
+в схеме проекта на тестовом Postgres.
+
+Миграции V0001–V0004 не указывают схему, поздние — указывают
+t_p35508816_friend_app_developme; обе работают при search_path на эту схему.
+Обработчики получают тот же search_path через PGOPTIONS (его читает libpq).
+
+Запуск: DATABASE_URL=postgres://... python bench/schema.py [--reset]
+"""
+import glob
+import os
+import re
+import sys
+
+SCHEMA = "t_p35508816_friend_app_developme"
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "db_migrations")
+
+
+def use_schema_env():
+    """search_path для всех соединений процесса, включая пул backend/*/db.py."""
+    os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA},public"
+
+
+def migrations():
+    paths = glob.glob(os.path.join(MIGRATIONS_DIR, "V*__*.sql"))
+    return sorted(paths, key=lambda p: int(re.match(r"V(\d+)__", os.path.basename(p)).group(1)))
+
+
+def apply_migrations(conn, reset: bool = False) -> int:
+    cur = conn.cursor()
+    if reset:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}")
+    cur.execute(f"SET search_path TO {SCHEMA}, public")
+    cur.execute("CREATE TABLE IF NOT EXISTS bench_schema_version (version INTEGER PRIMARY KEY)")
+    cur.execute("SELECT version FROM bench_schema_version")
+    applied = {r[0] for r in cur.fetchall()}
+    conn.commit()
+
+    count = 0
+    for path in migrations():
+        version = int(re.match(r"V(\d+)__", os.path.basename(path)).group(1))
+        if version in applied:
+            continue
+        with open(path, encoding="utf-8") as f:
+            cur.execute(f.read())
+        cur.execute("INSERT INTO bench_schema_version (version) VALUES (%s)", (version,))
+        conn.commit()
+        count += 1
+        print(f"applied {os.path.basename(path)}")
+    return count
+
+
+def main():
+    import psycopg2
+
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    try:
+        apply_migrations(conn, reset="--reset" in sys.argv)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
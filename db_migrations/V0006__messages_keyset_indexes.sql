@@ -0,0 +1,7 @@
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id
+  ON t_p35508816_friend_app_developme.messages (chat_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_created_at
+  ON t_p35508816_friend_app_developme.messages (chat_id, created_at);
+
+DROP INDEX IF EXISTS t_p35508816_friend_app_developme.idx_messages_chat_id;
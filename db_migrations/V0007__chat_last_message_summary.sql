@@ -0,0 +1,29 @@
+ALTER TABLE t_p35508816_friend_app_developme.chats
+  ADD COLUMN IF NOT EXISTS last_message_id INTEGER NULL,
+  ADD COLUMN IF NOT EXISTS last_message_text TEXT NULL,
+  ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMPTZ NULL,
+  ADD COLUMN IF NOT EXISTS last_sender_id INTEGER NULL,
+  ADD COLUMN IF NOT EXISTS last_activity_at TIMESTAMPTZ NULL;
+
+UPDATE t_p35508816_friend_app_developme.chats c
+SET last_message_id = m.id,
+    last_message_text = m.text,
+    last_message_at = m.created_at,
+    last_sender_id = m.sender_id
+FROM (
+  SELECT DISTINCT ON (chat_id) chat_id, id, text, created_at, sender_id
+  FROM t_p35508816_friend_app_developme.messages
+  ORDER BY chat_id, id DESC
+) m
+WHERE m.chat_id = c.id;
+
+UPDATE t_p35508816_friend_app_developme.chats
+SET last_activity_at = COALESCE(last_message_at, created_at, NOW())
+WHERE last_activity_at IS NULL;
+
+ALTER TABLE t_p35508816_friend_app_developme.chats
+  ALTER COLUMN last_activity_at SET DEFAULT NOW(),
+  ALTER COLUMN last_activity_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_chats_last_activity
+  ON t_p35508816_friend_app_developme.chats (last_activity_at DESC, id DESC);
@@ -0,0 +1,38 @@
+ALTER TABLE t_p35508816_friend_app_developme.messages
+  ADD COLUMN IF NOT EXISTS seq INTEGER NULL;
+
+ALTER TABLE t_p35508816_friend_app_developme.chats
+  ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE t_p35508816_friend_app_developme.chat_members
+  ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS read_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE t_p35508816_friend_app_developme.messages m
+SET seq = s.rn
+FROM (
+  SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY id) AS rn
+  FROM t_p35508816_friend_app_developme.messages
+) s
+WHERE m.id = s.id;
+
+UPDATE t_p35508816_friend_app_developme.chats c
+SET message_count = s.cnt
+FROM (
+  SELECT chat_id, MAX(seq) AS cnt
+  FROM t_p35508816_friend_app_developme.messages
+  GROUP BY chat_id
+) s
+WHERE s.chat_id = c.id;
+
+-- Существующую историю считаем прочитанной
+UPDATE t_p35508816_friend_app_developme.chat_members cm
+SET last_read_message_id = COALESCE(c.last_message_id, 0),
+    read_count = c.message_count
+FROM t_p35508816_friend_app_developme.chats c
+WHERE c.id = cm.chat_id;
+
+-- Сообщения без порядкового номера (вставленные в обход API) находит сверка счётчиков
+CREATE INDEX IF NOT EXISTS idx_messages_seq_missing
+  ON t_p35508816_friend_app_developme.messages (chat_id)
+  WHERE seq IS NULL;
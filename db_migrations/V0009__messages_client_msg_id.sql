@@ -0,0 +1,6 @@
+ALTER TABLE t_p35508816_friend_app_developme.messages
+  ADD COLUMN IF NOT EXISTS client_msg_id VARCHAR(64) NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_messages_sender_client_msg_id
+  ON t_p35508816_friend_app_developme.messages (sender_id, client_msg_id)
+  WHERE client_msg_id IS NOT NULL;
@@ -0,0 +1,35 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE t_p35508816_friend_app_developme.users
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+-- Версия справочника для ETag: меняется только когда меняются видимые в /contacts поля
+CREATE OR REPLACE FUNCTION t_p35508816_friend_app_developme.users_touch_updated_at()
+RETURNS trigger AS $$
+BEGIN
+  IF (NEW.username, NEW.display_name, NEW.position, NEW.department, NEW.phone,
+      NEW.avatar_initials, NEW.avatar_url, NEW.online)
+     IS DISTINCT FROM
+     (OLD.username, OLD.display_name, OLD.position, OLD.department, OLD.phone,
+      OLD.avatar_initials, OLD.avatar_url, OLD.online) THEN
+    NEW.updated_at := NOW();
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_touch_updated_at ON t_p35508816_friend_app_developme.users;
+CREATE TRIGGER trg_users_touch_updated_at
+  BEFORE UPDATE ON t_p35508816_friend_app_developme.users
+  FOR EACH ROW EXECUTE FUNCTION t_p35508816_friend_app_developme.users_touch_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_users_updated_at
+  ON t_p35508816_friend_app_developme.users (updated_at);
+
+CREATE INDEX IF NOT EXISTS idx_users_display_name_id
+  ON t_p35508816_friend_app_developme.users (display_name, id);
+
+CREATE INDEX IF NOT EXISTS idx_users_directory_trgm
+  ON t_p35508816_friend_app_developme.users
+  USING gin ((lower(display_name) || ' ' || lower(username) || ' ' ||
+              lower(coalesce(department, '')) || ' ' || lower(coalesce(position, ''))) gin_trgm_ops);
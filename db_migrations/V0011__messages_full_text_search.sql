@@ -0,0 +1,12 @@
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+-- Русская морфология + simple для латиницы, кодов и смешанного текста
+ALTER TABLE t_p35508816_friend_app_developme.messages
+  ADD COLUMN IF NOT EXISTS search_tsv tsvector
+  GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(text, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(text, '')), 'B')
+  ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_messages_search
+  ON t_p35508816_friend_app_developme.messages USING gin (chat_id, search_tsv);
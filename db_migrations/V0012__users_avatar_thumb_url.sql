@@ -0,0 +1,2 @@
+ALTER TABLE t_p35508816_friend_app_developme.users
+  ADD COLUMN IF NOT EXISTS avatar_thumb_url TEXT NULL;
@@ -0,0 +1,21 @@
+CREATE TABLE IF NOT EXISTS t_p35508816_friend_app_developme.sms_outbox (
+  id BIGSERIAL PRIMARY KEY,
+  phone VARCHAR(20) NOT NULL,
+  message TEXT NOT NULL,
+  status VARCHAR(16) NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  expires_at TIMESTAMPTZ NOT NULL,
+  provider_id VARCHAR(64) NULL,
+  last_error TEXT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  sent_at TIMESTAMPTZ NULL
+);
+
+-- Очередь диспетчера: только недоставленные строки, в порядке готовности к отправке
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_due
+  ON t_p35508816_friend_app_developme.sms_outbox (next_attempt_at)
+  WHERE status IN ('pending', 'sending');
+
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_phone
+  ON t_p35508816_friend_app_developme.sms_outbox (phone, created_at);
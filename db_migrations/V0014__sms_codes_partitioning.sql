@@ -0,0 +1,53 @@
+-- sms_codes секционируется по дням created_at: старые дни удаляются DROP'ом секции (maintenance sweep_expired).
+-- Коды живут 10 минут, поэтому переносим только строки последних суток.
+ALTER TABLE t_p35508816_friend_app_developme.sms_codes RENAME TO sms_codes_legacy;
+
+CREATE TABLE t_p35508816_friend_app_developme.sms_codes (
+  id BIGSERIAL,
+  phone VARCHAR(20) NOT NULL,
+  code VARCHAR(6) NOT NULL,
+  purpose VARCHAR(20) NOT NULL DEFAULT 'login',
+  expires_at TIMESTAMPTZ NOT NULL,
+  used BOOLEAN DEFAULT false,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Страховка на случай, если обслуживание не успело создать секцию на новый день
+CREATE TABLE t_p35508816_friend_app_developme.sms_codes_default
+  PARTITION OF t_p35508816_friend_app_developme.sms_codes DEFAULT;
+
+DO $$
+DECLARE
+  d DATE;
+BEGIN
+  FOR d IN SELECT generate_series((NOW() AT TIME ZONE 'UTC')::date - 1, (NOW() AT TIME ZONE 'UTC')::date + 7, '1 day')::date LOOP
+    EXECUTE format(
+      'CREATE TABLE IF NOT EXISTS t_p35508816_friend_app_developme.%I PARTITION OF t_p35508816_friend_app_developme.sms_codes FOR VALUES FROM (%L) TO (%L)',
+      'sms_codes_p' || to_char(d, 'YYYYMMDD'), d::text || ' 00:00+00', (d + 1)::text || ' 00:00+00'
+    );
+  END LOOP;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_sms_codes_phone_created
+  ON t_p35508816_friend_app_developme.sms_codes (phone, created_at);
+
+INSERT INTO t_p35508816_friend_app_developme.sms_codes (id, phone, code, purpose, expires_at, used, created_at)
+SELECT id, phone, code, purpose, expires_at, used, COALESCE(created_at, NOW())
+FROM t_p35508816_friend_app_developme.sms_codes_legacy
+WHERE expires_at > NOW() - INTERVAL '1 day';
+
+SELECT setval(
+  pg_get_serial_sequence('t_p35508816_friend_app_developme.sms_codes', 'id'),
+  GREATEST((SELECT MAX(id) FROM t_p35508816_friend_app_developme.sms_codes_legacy), 1)
+);
+
+DROP TABLE t_p35508816_friend_app_developme.sms_codes_legacy;
+
+-- Пакетное удаление истёкших сессий идёт по этому индексу
+CREATE INDEX IF NOT EXISTS idx_sessions_expires_at
+  ON t_p35508816_friend_app_developme.sessions (expires_at);
+
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_done
+  ON t_p35508816_friend_app_developme.sms_outbox (created_at)
+  WHERE status IN ('sent', 'failed', 'expired');
@@ -0,0 +1,11 @@
+-- Общее хранилище корзин ограничения частоты (RATELIMIT_STORE=postgres).
+-- UNLOGGED: без записи в WAL; после сбоя таблица пустеет — корзины просто снова полные.
+CREATE UNLOGGED TABLE IF NOT EXISTS t_p35508816_friend_app_developme.rate_limits (
+  key VARCHAR(128) PRIMARY KEY,
+  tokens DOUBLE PRECISION NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  allowed BOOLEAN NOT NULL DEFAULT true
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limits_updated_at
+  ON t_p35508816_friend_app_developme.rate_limits (updated_at);
@@ -0,0 +1,130 @@
+-- messages → таблица, секционированная по диапазонам BIGINT id, без остановки записи. Шаг 1 из 2.
+-- Рядом создаётся messages_new, триггер зеркалирует в неё каждую запись в messages,
+-- историю переносит maintenance {"action": "backfill_messages"} пачками по id.
+-- Шаг 2 (V0017) под короткой блокировкой докопирует остаток и поменяет таблицы местами.
+-- На большой базе V0016 применяют отдельно и запускают backfill_messages до done: true —
+-- тогда V0017 копирует только хвост; на маленькой V0017 сам перенесёт всё.
+--
+-- id растёт вместе со временем, поэтому секция по диапазону id — это и диапазон времени.
+-- Секции по 5 млн id (MESSAGES_PARTITION_SIZE в maintenance, там же создание секций вперёд):
+-- keyset-запросы по (chat_id, id) отсекают секции по id, свежие страницы читают только новые секции.
+--
+-- Ключ идемпотентности отправки переезжает в message_client_ids уже здесь: новый код отправки
+-- работает с ней, а старый (ON CONFLICT по уникальному индексу messages) до V0017 пишет в неё
+-- через триггер. Поэтому код и миграции можно выкатывать в любом порядке между V0016 и V0017.
+
+ALTER SEQUENCE t_p35508816_friend_app_developme.messages_id_seq AS BIGINT;
+
+CREATE TABLE t_p35508816_friend_app_developme.messages_new (
+  id BIGINT NOT NULL DEFAULT nextval('t_p35508816_friend_app_developme.messages_id_seq'),
+  chat_id INTEGER NOT NULL REFERENCES t_p35508816_friend_app_developme.chats(id),
+  sender_id INTEGER NOT NULL REFERENCES t_p35508816_friend_app_developme.users(id),
+  text TEXT,
+  file_name VARCHAR(255),
+  file_size VARCHAR(50),
+  msg_type VARCHAR(20) DEFAULT 'text',
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  seq INTEGER NULL,
+  client_msg_id VARCHAR(64) NULL,
+  search_tsv tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(text, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(text, '')), 'B')
+  ) STORED,
+  PRIMARY KEY (id)
+) PARTITION BY RANGE (id);
+
+-- Страховка на случай, если обслуживание не успело создать секцию впереди; строки из неё
+-- переносит в новую секцию rotate_messages_partitions
+CREATE TABLE t_p35508816_friend_app_developme.messages_default
+  PARTITION OF t_p35508816_friend_app_developme.messages_new DEFAULT;
+
+DO $$
+DECLARE
+  size CONSTANT BIGINT := 5000000;
+  top BIGINT;
+  lo BIGINT := 0;
+BEGIN
+  SELECT last_value INTO top FROM t_p35508816_friend_app_developme.messages_id_seq;
+  WHILE lo <= (top / size + 2) * size LOOP
+    EXECUTE format(
+      'CREATE TABLE IF NOT EXISTS t_p35508816_friend_app_developme.%I PARTITION OF t_p35508816_friend_app_developme.messages_new FOR VALUES FROM (%s) TO (%s)',
+      'messages_p' || lpad(lo::text, 12, '0'), lo, lo + size
+    );
+    lo := lo + size;
+  END LOOP;
+END $$;
+
+-- Имена временные: постоянные заняты индексами старой messages, V0017 переименует
+CREATE INDEX IF NOT EXISTS idx_messages_new_chat_id_id
+  ON t_p35508816_friend_app_developme.messages_new (chat_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_messages_new_seq_missing
+  ON t_p35508816_friend_app_developme.messages_new (chat_id)
+  WHERE seq IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_messages_new_search
+  ON t_p35508816_friend_app_developme.messages_new USING gin (chat_id, search_tsv);
+
+CREATE INDEX IF NOT EXISTS idx_messages_new_chat_id_created_at
+  ON t_p35508816_friend_app_developme.messages_new (chat_id, created_at);
+
+-- Уникальный индекс по (sender_id, client_msg_id) на секционированной таблице невозможен
+-- без ключа секционирования, поэтому идемпотентность отправки держит отдельная таблица.
+-- Повтор отправки приходит в течение минут; строки старше MESSAGE_CLIENT_ID_TTL_DAYS удаляет maintenance.
+CREATE TABLE IF NOT EXISTS t_p35508816_friend_app_developme.message_client_ids (
+  sender_id INTEGER NOT NULL,
+  client_msg_id VARCHAR(64) NOT NULL,
+  message_id BIGINT NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (sender_id, client_msg_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_client_ids_created
+  ON t_p35508816_friend_app_developme.message_client_ids (created_at);
+
+-- Двойная запись: вставка и изменение — upsert (строка могла ещё не доехать из backfill), удаление — удаление.
+-- Ключ идемпотентности новой строки — в message_client_ids (новый код отправки занимает его сам, тогда DO NOTHING)
+CREATE OR REPLACE FUNCTION t_p35508816_friend_app_developme.messages_mirror() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    DELETE FROM t_p35508816_friend_app_developme.messages_new WHERE id = OLD.id;
+    RETURN OLD;
+  END IF;
+  INSERT INTO t_p35508816_friend_app_developme.messages_new
+    (id, chat_id, sender_id, text, file_name, file_size, msg_type, created_at, seq, client_msg_id)
+  VALUES (NEW.id, NEW.chat_id, NEW.sender_id, NEW.text, NEW.file_name, NEW.file_size, NEW.msg_type,
+          NEW.created_at, NEW.seq, NEW.client_msg_id)
+  ON CONFLICT (id) DO UPDATE SET
+    chat_id = EXCLUDED.chat_id, sender_id = EXCLUDED.sender_id, text = EXCLUDED.text,
+    file_name = EXCLUDED.file_name, file_size = EXCLUDED.file_size, msg_type = EXCLUDED.msg_type,
+    created_at = EXCLUDED.created_at, seq = EXCLUDED.seq, client_msg_id = EXCLUDED.client_msg_id;
+  IF TG_OP = 'INSERT' AND NEW.client_msg_id IS NOT NULL THEN
+    INSERT INTO t_p35508816_friend_app_developme.message_client_ids (sender_id, client_msg_id, message_id, created_at)
+    VALUES (NEW.sender_id, NEW.client_msg_id, NEW.id, COALESCE(NEW.created_at, NOW()))
+    ON CONFLICT DO NOTHING;
+  END IF;
+  RETURN NEW;
+END $$;
+
+CREATE TRIGGER messages_mirror
+  AFTER INSERT OR UPDATE OR DELETE ON t_p35508816_friend_app_developme.messages
+  FOR EACH ROW EXECUTE FUNCTION t_p35508816_friend_app_developme.messages_mirror();
+
+-- Курсор переноса истории: строки с id <= upto существовали до триггера, остальные он уже зеркалирует
+CREATE TABLE t_p35508816_friend_app_developme.messages_backfill (
+  singleton BOOLEAN PRIMARY KEY DEFAULT true CHECK (singleton),
+  last_id BIGINT NOT NULL DEFAULT 0,
+  upto BIGINT NOT NULL
+);
+
+INSERT INTO t_p35508816_friend_app_developme.messages_backfill (upto)
+SELECT COALESCE(MAX(id), 0) FROM t_p35508816_friend_app_developme.messages;
+
+-- Свежие ключи идемпотентности — после триггера, чтобы между ними ничего не потерялось.
+-- Читает messages без блокировок записи; старше TTL ключи не нужны
+INSERT INTO t_p35508816_friend_app_developme.message_client_ids (sender_id, client_msg_id, message_id, created_at)
+SELECT sender_id, client_msg_id, id, created_at
+FROM t_p35508816_friend_app_developme.messages
+WHERE client_msg_id IS NOT NULL AND created_at > NOW() - INTERVAL '7 days'
+ON CONFLICT DO NOTHING;
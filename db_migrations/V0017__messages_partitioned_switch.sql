@@ -0,0 +1,43 @@
+-- messages → секционированная таблица, шаг 2 из 2 (шаг 1 — V0016).
+-- Под блокировкой messages докопируем то, что не успел перенести backfill_messages,
+-- и меняем таблицы местами. Если backfill дошёл до конца, блокировка держится секунды.
+LOCK TABLE t_p35508816_friend_app_developme.messages IN EXCLUSIVE MODE;
+
+INSERT INTO t_p35508816_friend_app_developme.messages_new
+  (id, chat_id, sender_id, text, file_name, file_size, msg_type, created_at, seq, client_msg_id)
+SELECT m.id, m.chat_id, m.sender_id, m.text, m.file_name, m.file_size, m.msg_type, m.created_at, m.seq, m.client_msg_id
+FROM t_p35508816_friend_app_developme.messages m
+WHERE m.id > (SELECT last_id FROM t_p35508816_friend_app_developme.messages_backfill)
+ON CONFLICT (id) DO NOTHING;
+
+DROP TRIGGER messages_mirror ON t_p35508816_friend_app_developme.messages;
+DROP FUNCTION t_p35508816_friend_app_developme.messages_mirror();
+DROP TABLE t_p35508816_friend_app_developme.messages_backfill;
+
+ALTER SEQUENCE t_p35508816_friend_app_developme.messages_id_seq OWNED BY NONE;
+DROP TABLE t_p35508816_friend_app_developme.messages;
+
+ALTER TABLE t_p35508816_friend_app_developme.messages_new RENAME TO messages;
+ALTER TABLE t_p35508816_friend_app_developme.messages RENAME CONSTRAINT messages_new_pkey TO messages_pkey;
+ALTER TABLE t_p35508816_friend_app_developme.messages RENAME CONSTRAINT messages_new_chat_id_fkey TO messages_chat_id_fkey;
+ALTER TABLE t_p35508816_friend_app_developme.messages RENAME CONSTRAINT messages_new_sender_id_fkey TO messages_sender_id_fkey;
+ALTER INDEX t_p35508816_friend_app_developme.idx_messages_new_chat_id_id RENAME TO idx_messages_chat_id_id;
+ALTER INDEX t_p35508816_friend_app_developme.idx_messages_new_seq_missing RENAME TO idx_messages_seq_missing;
+ALTER INDEX t_p35508816_friend_app_developme.idx_messages_new_search RENAME TO idx_messages_search;
+ALTER INDEX t_p35508816_friend_app_developme.idx_messages_new_chat_id_created_at RENAME TO idx_messages_chat_id_created_at;
+ALTER SEQUENCE t_p35508816_friend_app_developme.messages_id_seq OWNED BY t_p35508816_friend_app_developme.messages.id;
+
+-- Каталог выгруженных в архив секций (maintenance {"action": "archive_messages"}, backend/maintenance/archive.py)
+CREATE TABLE t_p35508816_friend_app_developme.messages_archive (
+  partition_name VARCHAR(63) PRIMARY KEY,
+  id_from BIGINT NOT NULL,
+  id_to BIGINT NOT NULL,
+  created_from TIMESTAMPTZ NULL,
+  created_to TIMESTAMPTZ NULL,
+  row_count BIGINT NOT NULL,
+  location TEXT NOT NULL,
+  bytes BIGINT NOT NULL,
+  sha256 CHAR(64) NOT NULL,
+  archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  restored_at TIMESTAMPTZ NULL
+);
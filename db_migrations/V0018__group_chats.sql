@@ -0,0 +1,27 @@
+-- Групповые чаты: роль участника (составом группы управляет владелец) и число участников в chats,
+-- чтобы размер группы на десятки тысяч человек не считался COUNT(*) по chat_members
+ALTER TABLE t_p35508816_friend_app_developme.chat_members
+  ADD COLUMN IF NOT EXISTS role VARCHAR(20) NOT NULL DEFAULT 'member';
+
+ALTER TABLE t_p35508816_friend_app_developme.chats
+  ADD COLUMN IF NOT EXISTS member_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE t_p35508816_friend_app_developme.chats c
+SET member_count = s.cnt
+FROM (
+  SELECT chat_id, COUNT(*) AS cnt
+  FROM t_p35508816_friend_app_developme.chat_members
+  GROUP BY chat_id
+) s
+WHERE s.chat_id = c.id;
+
+-- У существующих групп владельцем становится первый вступивший участник
+UPDATE t_p35508816_friend_app_developme.chat_members cm
+SET role = 'owner'
+FROM (
+  SELECT DISTINCT ON (m.chat_id) m.id
+  FROM t_p35508816_friend_app_developme.chat_members m
+  JOIN t_p35508816_friend_app_developme.chats c ON c.id = m.chat_id AND c.type = 'group'
+  ORDER BY m.chat_id, m.id
+) f
+WHERE cm.id = f.id;
@@ -0,0 +1,92 @@
+-- Личный чат находится по упорядоченной паре (pair_low, pair_high) = (меньший id, больший id):
+-- один поиск по уникальному индексу вместо двойного join по chat_members, а уникальность
+-- не даёт двум параллельным запросам создать два чата одной пары.
+ALTER TABLE t_p35508816_friend_app_developme.chats
+  ADD COLUMN IF NOT EXISTS pair_low INTEGER NULL,
+  ADD COLUMN IF NOT EXISTS pair_high INTEGER NULL;
+
+-- Пара — только у чатов ровно с двумя участниками. Личный чат, из которого осталось меньше двух
+-- (собеседник удалён), остаётся с pair_low/pair_high = NULL: он не сливается с другими чатами
+-- того же пользователя и не находится по паре (NULL не конфликтует в уникальном индексе).
+CREATE TEMP TABLE personal_pairs AS
+SELECT cm.chat_id, MIN(cm.user_id) AS low, MAX(cm.user_id) AS high
+FROM t_p35508816_friend_app_developme.chat_members cm
+JOIN t_p35508816_friend_app_developme.chats c ON c.id = cm.chat_id AND c.type = 'personal'
+GROUP BY cm.chat_id
+HAVING COUNT(*) = 2;
+
+-- Дубли одной пары сливаются в чат с самой длинной историей (при равенстве — в самый старый)
+CREATE TEMP TABLE personal_merge AS
+SELECT p.chat_id,
+       FIRST_VALUE(p.chat_id) OVER (PARTITION BY p.low, p.high ORDER BY c.message_count DESC, c.id) AS keep_id
+FROM personal_pairs p
+JOIN t_p35508816_friend_app_developme.chats c ON c.id = p.chat_id;
+
+DELETE FROM personal_merge WHERE chat_id = keep_id;
+
+UPDATE t_p35508816_friend_app_developme.messages m
+SET chat_id = pm.keep_id
+FROM personal_merge pm
+WHERE m.chat_id = pm.chat_id;
+
+-- Участник сохраняет самую дальнюю отметку «прочитано» из всех дублей
+UPDATE t_p35508816_friend_app_developme.chat_members k
+SET last_read_message_id = d.max_read
+FROM (
+  SELECT pm.keep_id, cm.user_id, MAX(cm.last_read_message_id) AS max_read
+  FROM t_p35508816_friend_app_developme.chat_members cm
+  JOIN personal_merge pm ON pm.chat_id = cm.chat_id
+  GROUP BY pm.keep_id, cm.user_id
+) d
+WHERE k.chat_id = d.keep_id AND k.user_id = d.user_id AND d.max_read > k.last_read_message_id;
+
+DELETE FROM t_p35508816_friend_app_developme.chat_members cm
+USING personal_merge pm
+WHERE cm.chat_id = pm.chat_id;
+
+DELETE FROM t_p35508816_friend_app_developme.chats c
+USING personal_merge pm
+WHERE c.id = pm.chat_id;
+
+-- В слитых чатах история перемешалась: заново нумеруем seq и пересчитываем сводку и счётчики
+UPDATE t_p35508816_friend_app_developme.messages m
+SET seq = s.rn
+FROM (
+  SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY id) AS rn
+  FROM t_p35508816_friend_app_developme.messages
+  WHERE chat_id IN (SELECT keep_id FROM personal_merge)
+) s
+WHERE m.id = s.id;
+
+UPDATE t_p35508816_friend_app_developme.chats c
+SET message_count = s.seq,
+    last_message_id = s.id,
+    last_message_text = s.text,
+    last_message_at = s.created_at,
+    last_sender_id = s.sender_id,
+    last_activity_at = GREATEST(c.last_activity_at, s.created_at)
+FROM (
+  SELECT DISTINCT ON (chat_id) chat_id, id, seq, text, created_at, sender_id
+  FROM t_p35508816_friend_app_developme.messages
+  WHERE chat_id IN (SELECT keep_id FROM personal_merge)
+  ORDER BY chat_id, id DESC
+) s
+WHERE c.id = s.chat_id;
+
+UPDATE t_p35508816_friend_app_developme.chat_members cm
+SET read_count = COALESCE((
+  SELECT m.seq FROM t_p35508816_friend_app_developme.messages m WHERE m.id = cm.last_read_message_id
+), 0)
+WHERE cm.chat_id IN (SELECT keep_id FROM personal_merge);
+
+UPDATE t_p35508816_friend_app_developme.chats c
+SET pair_low = p.low, pair_high = p.high
+FROM personal_pairs p
+WHERE c.id = p.chat_id;
+
+DROP TABLE personal_merge;
+DROP TABLE personal_pairs;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_chats_personal_pair
+  ON t_p35508816_friend_app_developme.chats (pair_low, pair_high)
+  WHERE type = 'personal';
@@ -0,0 +1,44 @@
+-- chats.last_message_id и chat_members.last_read_message_id → BIGINT (messages.id стал BIGINT в V0016)
+-- без ALTER COLUMN TYPE: тот переписал бы обе горячие таблицы под ACCESS EXCLUSIVE. Шаг 1 из 2.
+-- Рядом добавляются BIGINT-колонки (без перезаписи: NULL или константа по умолчанию), триггер
+-- копирует в них каждую запись, старые строки переносит maintenance {"action": "backfill_message_refs"}.
+-- Шаг 2 (V0021) докопирует остаток и заменит колонки — только изменение каталога.
+ALTER TABLE t_p35508816_friend_app_developme.chats
+  ADD COLUMN IF NOT EXISTS last_message_id_big BIGINT NULL;
+
+ALTER TABLE t_p35508816_friend_app_developme.chat_members
+  ADD COLUMN IF NOT EXISTS last_read_message_id_big BIGINT NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION t_p35508816_friend_app_developme.chats_last_message_id_big() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.last_message_id_big := NEW.last_message_id;
+  RETURN NEW;
+END $$;
+
+CREATE OR REPLACE FUNCTION t_p35508816_friend_app_developme.chat_members_last_read_message_id_big() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.last_read_message_id_big := NEW.last_read_message_id;
+  RETURN NEW;
+END $$;
+
+CREATE TRIGGER chats_last_message_id_big
+  BEFORE INSERT OR UPDATE OF last_message_id ON t_p35508816_friend_app_developme.chats
+  FOR EACH ROW EXECUTE FUNCTION t_p35508816_friend_app_developme.chats_last_message_id_big();
+
+CREATE TRIGGER chat_members_last_read_message_id_big
+  BEFORE INSERT OR UPDATE OF last_read_message_id ON t_p35508816_friend_app_developme.chat_members
+  FOR EACH ROW EXECUTE FUNCTION t_p35508816_friend_app_developme.chat_members_last_read_message_id_big();
+
+-- Курсоры переноса по id строк: строки с id <= upto существовали до триггеров
+CREATE TABLE t_p35508816_friend_app_developme.message_refs_backfill (
+  table_name VARCHAR(63) PRIMARY KEY,
+  last_id BIGINT NOT NULL DEFAULT 0,
+  upto BIGINT NOT NULL
+);
+
+INSERT INTO t_p35508816_friend_app_developme.message_refs_backfill (table_name, upto)
+SELECT 'chats', COALESCE(MAX(id), 0) FROM t_p35508816_friend_app_developme.chats
+UNION ALL
+SELECT 'chat_members', COALESCE(MAX(id), 0) FROM t_p35508816_friend_app_developme.chat_members;
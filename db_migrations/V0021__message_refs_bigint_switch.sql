@@ -0,0 +1,24 @@
+-- chats.last_message_id и chat_members.last_read_message_id → BIGINT, шаг 2 из 2 (шаг 1 — V0020).
+-- Перед применением backfill_message_refs должен дойти до done: true — тогда докопировать нечего,
+-- а замена колонок (DROP COLUMN, RENAME) меняет только каталог и держит блокировку мгновения.
+UPDATE t_p35508816_friend_app_developme.chats c
+SET last_message_id_big = c.last_message_id
+WHERE c.id > (SELECT last_id FROM t_p35508816_friend_app_developme.message_refs_backfill WHERE table_name = 'chats')
+  AND c.id <= (SELECT upto FROM t_p35508816_friend_app_developme.message_refs_backfill WHERE table_name = 'chats');
+
+UPDATE t_p35508816_friend_app_developme.chat_members cm
+SET last_read_message_id_big = cm.last_read_message_id
+WHERE cm.id > (SELECT last_id FROM t_p35508816_friend_app_developme.message_refs_backfill WHERE table_name = 'chat_members')
+  AND cm.id <= (SELECT upto FROM t_p35508816_friend_app_developme.message_refs_backfill WHERE table_name = 'chat_members');
+
+DROP TRIGGER chats_last_message_id_big ON t_p35508816_friend_app_developme.chats;
+DROP TRIGGER chat_members_last_read_message_id_big ON t_p35508816_friend_app_developme.chat_members;
+DROP FUNCTION t_p35508816_friend_app_developme.chats_last_message_id_big();
+DROP FUNCTION t_p35508816_friend_app_developme.chat_members_last_read_message_id_big();
+DROP TABLE t_p35508816_friend_app_developme.message_refs_backfill;
+
+ALTER TABLE t_p35508816_friend_app_developme.chats DROP COLUMN last_message_id;
+ALTER TABLE t_p35508816_friend_app_developme.chats RENAME COLUMN last_message_id_big TO last_message_id;
+
+ALTER TABLE t_p35508816_friend_app_developme.chat_members DROP COLUMN last_read_message_id;
+ALTER TABLE t_p35508816_friend_app_developme.chat_members RENAME COLUMN last_read_message_id_big TO last_read_message_id;
@@ -0,0 +1,3 @@
+-- /sync читает новые сообщения по seq-отметкам чатов (seq > отметки) — индекс под этот диапазон
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_seq
+  ON t_p35508816_friend_app_developme.messages (chat_id, seq);
@@ -9,6 +9,13 @@ const API = {
   avatar: "https://functions.poehali.dev/164ba4b4-9b9c-4668-8ca1-0bf6fbcbf6ab",
 };
 
+// LSN последней своей записи (X-Write-LSN): чтения с реплики не вернут данных старше неё
+let lastWriteLsn = "";
+const rememberWrite = (res: Response) => {
+  const lsn = res.headers.get("X-Write-LSN");
+  if (lsn) lastWriteLsn = lsn;
+};
+
 type Section = "chats" | "contacts" | "calls" | "video" | "files" | "bots" | "settings" | "analytics";
 
 interface User {
@@ -505,6 +512,7 @@ function SettingsPanel({
         headers: { "Content-Type": "application/json", "X-Session-Id": sessionToken },
         body: JSON.stringify({ image: b64, content_type: file.type }),
       });
+      rememberWrite(res);
       const data = await res.json();
       if (!res.ok) {
         setAvatarError(data.message || "Не удалось загрузить фото");
@@ -534,6 +542,7 @@ function SettingsPanel({
         headers: { "Content-Type": "application/json", "X-Session-Id": sessionToken },
         body: JSON.stringify({ display_name: displayName.trim(), position: position.trim(), department: department.trim() }),
       });
+      rememberWrite(res);
       const data = await res.json();
       if (!res.ok) {
         setError(data.message || "Не удалось сохранить");
@@ -730,9 +739,10 @@ export default function App() {
     setAuthChecked(true);
   }, []);
 
-  const authHeaders = useCallback(() => ({
+  const authHeaders = useCallback((): Record<string, string> => ({
     "Content-Type": "application/json",
     "X-Session-Id": sessionToken || "",
+    ...(lastWriteLsn ? { "X-Min-LSN": lastWriteLsn } : {}),
   }), [sessionToken]);
 
   // Load chats
@@ -803,6 +813,7 @@ export default function App() {
         headers: authHeaders(),
         body: JSON.stringify({ chat_id: activeChat.id, text }),
       });
+      rememberWrite(res);
       const data = await res.json();
       if (data.message) {
         setMessages(prev => [...prev, data.message]);
@@ -834,6 +845,7 @@ export default function App() {
         headers: authHeaders(),
         body: JSON.stringify({ user_id: contactId }),
       });
+      rememberWrite(res);
       const data = await res.json();
       if (data.chat_id) {
         await loadChats();